@@ -0,0 +1,316 @@
+import json
+import os
+import random
+import statistics
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import networkx as nx
+
+import workers
+from utils.compression import compress_graph_json, decompress_graph_json
+from workers.actions import (
+    process_schema_create,
+    process_schema_delete,
+    process_schema_update,
+    update_state_instances,
+)
+from workers.delta_sink import DeltaSink
+from workers.instance_store import InstanceStore
+
+from .standins import LocalRedis, SQLiteDeltaWriter
+from .synthetic import SyntheticSchema
+
+TIMESTAMP = 1_700_000_000
+
+
+def timed(
+    run: Callable[[Any], Any],
+    setup: Optional[Callable[[], Any]] = None,
+    repeat: int = 3,
+) -> Dict[str, Any]:
+    """
+    Run ``run`` repeat times, each on a fresh result of ``setup``, and time
+    the runs only
+    """
+    samples = []
+    for _ in range(repeat):
+        prepared = setup() if setup is not None else None
+        started = time.perf_counter()
+        run(prepared)
+        samples.append(time.perf_counter() - started)
+    return {
+        "median_seconds": statistics.median(samples),
+        "min_seconds": min(samples),
+        "samples": samples,
+    }
+
+
+def point(scale: int, operations: int, timing: Dict[str, Any], **extra) -> Dict:
+    """One point of a scaling curve"""
+    median = timing["median_seconds"]
+    return {
+        "scale": scale,
+        "operations": operations,
+        **timing,
+        "ops_per_second": operations / median if median else None,
+        **extra,
+    }
+
+
+def build_schema(synthetic: SyntheticSchema):
+    schema = nx.DiGraph()
+    state = InstanceStore()
+    for payload in synthetic.node_payloads() + synthetic.edge_payloads():
+        process_schema_create(payload, schema, state, TIMESTAMP)
+    return schema, state
+
+
+# Schema actions
+
+
+def bench_schema_create(scale: int, instances_per_part: int, repeat: int) -> Dict:
+    synthetic = SyntheticSchema(scale, instances_per_part)
+    payloads = synthetic.node_payloads() + synthetic.edge_payloads()
+
+    def run(graphs):
+        schema, state = graphs
+        for payload in payloads:
+            process_schema_create(payload, schema, state, TIMESTAMP)
+
+    timing = timed(run, lambda: (nx.DiGraph(), InstanceStore()), repeat)
+    return point(
+        scale,
+        len(payloads),
+        timing,
+        nodes=len(synthetic.node_payloads()),
+        edges=len(synthetic.edges),
+    )
+
+
+def bench_schema_update(scale: int, instances_per_part: int, repeat: int) -> Dict:
+    synthetic = SyntheticSchema(scale, instances_per_part)
+    payloads = synthetic.update_payloads(max(1000, scale))
+
+    def run(graphs):
+        schema, state = graphs
+        for payload in payloads:
+            process_schema_update(payload, schema, state, TIMESTAMP + 1)
+
+    timing = timed(run, lambda: build_schema(synthetic), repeat)
+    return point(scale, len(payloads), timing)
+
+
+def bench_schema_delete(scale: int, instances_per_part: int, repeat: int) -> Dict:
+    """Delete every edge, then every Parts node with its instances"""
+    synthetic = SyntheticSchema(scale, instances_per_part)
+    payloads = [
+        {"source_id": source, "target_id": target}
+        for source, target, _ in synthetic.edges
+    ] + [{"node_id": node_id} for node_id in synthetic.nodes["Parts"]]
+
+    def run(graphs):
+        schema, state = graphs
+        for payload in payloads:
+            process_schema_delete(payload, schema, state, TIMESTAMP + 1)
+
+    timing = timed(run, lambda: build_schema(synthetic), repeat)
+    return point(scale, len(payloads), timing)
+
+
+# Instances
+
+
+def filled_store(instances: int, per_parent: int) -> InstanceStore:
+    state = InstanceStore()
+    for parent in range(max(1, instances // per_parent)):
+        update_state_instances(state, f"Parts-{parent}", "Parts", per_parent, TIMESTAMP)
+    return state
+
+
+def bench_update_state_instances(
+    instances: int, per_parent: int, calls: int, repeat: int
+) -> Dict:
+    """
+    Calls moving random parents of a store holding ``instances`` instances
+    to between half and one and a half times ``per_parent`` instances
+    """
+    rng = random.Random(0)
+    parents = max(1, instances // per_parent)
+    targets = [
+        (
+            f"Parts-{rng.randrange(parents)}",
+            rng.randint(per_parent // 2, per_parent * 3 // 2),
+        )
+        for _ in range(calls)
+    ]
+
+    def run(state):
+        for i, (parent, target) in enumerate(targets):
+            update_state_instances(state, parent, "Parts", target, TIMESTAMP + i)
+
+    timing = timed(run, lambda: filled_store(instances, per_parent), repeat)
+    return point(instances, calls, timing)
+
+
+def bench_update_state_instances_bulk(instances: int, repeat: int) -> Dict:
+    """One parent from no instances to ``instances`` and back to none"""
+
+    def run(state):
+        update_state_instances(state, "Parts-0", "Parts", instances, TIMESTAMP)
+        update_state_instances(state, "Parts-0", "Parts", 0, TIMESTAMP + 1)
+
+    timing = timed(run, InstanceStore, repeat)
+    return point(instances, 2 * instances, timing)
+
+
+# Serialization
+
+
+def bench_compression(graph_data: Dict[str, Any], scale: int, repeat: int) -> Dict:
+    compressed = compress_graph_json(graph_data)
+    compress = timed(lambda _: compress_graph_json(graph_data), repeat=repeat)
+    decompress = timed(lambda _: decompress_graph_json(compressed), repeat=repeat)
+    nodes = len(graph_data["nodes"])
+    return {
+        "compress": point(
+            scale,
+            nodes,
+            compress,
+            json_bytes=len(json.dumps(graph_data)),
+            compressed_bytes=len(json.dumps(compressed, separators=(",", ":"))),
+        ),
+        "decompress": point(scale, nodes, decompress),
+    }
+
+
+def bench_save_and_load(
+    schema: nx.DiGraph, state: InstanceStore, scale: int, fmt: str, repeat: int
+) -> Dict:
+    """save_graph and the load functions of the live files in one format"""
+    previous = workers.SNAPSHOT_FORMAT
+    workers.SNAPSHOT_FORMAT = fmt
+    paths = workers.get_paths(f"bench-save-{fmt}-{scale}")
+    try:
+        results = {}
+        for name, graph, is_schema, load in (
+            ("schema", schema, True, workers.load_live_schema),
+            ("state", state, False, workers.load_live_state),
+        ):
+            save = timed(
+                lambda _: workers.save_graph(graph, paths, is_schema=is_schema),
+                repeat=repeat,
+            )
+            directory = paths["LIVESCHEMA_PATH" if is_schema else "LIVESTATE_PATH"]
+            size = sum(
+                os.path.getsize(os.path.join(directory, f))
+                for f in os.listdir(directory)
+                if f.startswith("current_")
+            )
+            loaded = timed(lambda _: load(paths), repeat=repeat)
+            results[name] = {
+                "save": point(scale, len(graph), save, file_bytes=size),
+                "load": point(scale, len(graph), loaded),
+            }
+        return results
+    finally:
+        workers.SNAPSHOT_FORMAT = previous
+
+
+# End to end
+
+
+class EndToEnd:
+    """
+    Queue-to-persist runs of the worker: changes pushed to an in-process
+    Redis stand-in are drained, applied, persisted and archived as by a pool
+    worker, and their deltas written by the delta sink to SQLite, or to
+    Postgres when ``postgres`` is set
+    """
+
+    def __init__(self, directory: str, postgres: bool = False):
+        self.redis = LocalRedis()
+        self.writer = None
+        write = workers.write_to_postgres
+        if not postgres:
+            self.writer = SQLiteDeltaWriter(os.path.join(directory, "deltas.sqlite"))
+            write = self.writer
+        workers.redis_client = self.redis
+        workers.delta_sink = DeltaSink(
+            write=write,
+            batch_size=workers.DELTA_SINK_BATCH_SIZE,
+            flush_interval_ms=workers.DELTA_SINK_FLUSH_INTERVAL_MS,
+            max_backlog=workers.DELTA_SINK_MAX_BACKLOG,
+        )
+        self._runs = 0
+
+    def run(self, changes: List[Dict[str, Any]]) -> Dict[str, float]:
+        """Queue the changes and process them; the seconds each part took"""
+        started = time.perf_counter()
+        self.redis.rpush("changes", *[json.dumps(change) for change in changes])
+        queued = time.perf_counter()
+
+        last_maintenance = queued
+        while True:
+            batch = workers.drain_changes(linger_ms=0)
+            if not batch:
+                break
+            workers.process_change_batch(workers.decode_changes(batch))
+            # As often as a pool worker would
+            if (
+                time.perf_counter() - last_maintenance
+                > workers.MAINTENANCE_INTERVAL_SECONDS
+            ):
+                workers.maintain_live_graphs()
+                last_maintenance = time.perf_counter()
+        applied = time.perf_counter()
+
+        workers.delta_sink.flush()
+        workers.checkpointer.flush()
+        persisted = time.perf_counter()
+        return {
+            "queue_seconds": queued - started,
+            "apply_seconds": applied - queued,
+            "flush_seconds": persisted - applied,
+            "total_seconds": persisted - started,
+        }
+
+    def bench(
+        self,
+        scale: int,
+        instances_per_part: int,
+        changes_per_timestamp: int,
+        repeat: int,
+    ) -> Dict:
+        parts = []
+        operations = 0
+        for _ in range(repeat):
+            # A new version each run, so runs do not build on each other
+            self._runs += 1
+            version = f"bench-e2e-{scale}-{self._runs}"
+            changes = SyntheticSchema(scale, instances_per_part).changes(
+                version,
+                updates=scale,
+                timestamp=TIMESTAMP,
+                changes_per_timestamp=changes_per_timestamp,
+            )
+            operations = len(changes)
+            parts.append(self.run(changes))
+            workers.graph_store.evict(version)
+
+        totals = [run["total_seconds"] for run in parts]
+        timing = {
+            "median_seconds": statistics.median(totals),
+            "min_seconds": min(totals),
+            "samples": totals,
+        }
+        breakdown = {
+            key: statistics.median(run[key] for run in parts)
+            for key in ("queue_seconds", "apply_seconds", "flush_seconds")
+        }
+        return point(scale, operations, timing, **breakdown)
+
+    def close(self) -> None:
+        workers.delta_sink.flush()
+        if self.writer is not None:
+            self.writer.close()
@@ -0,0 +1,231 @@
+"""
+Benchmarks of the worker hot paths, written as JSON scaling curves.
+
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --scales 100,1000 --compare results.json
+
+Every benchmark is a curve of points, one per scale, holding the median and
+minimum of the timed runs and the operations per second at the median. The
+worker writes to a temporary data directory unless the *_PATH variables are
+set. Redis is replaced by an in-process stand-in and Postgres by SQLite,
+unless --postgres is given.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+PATH_VARIABLES = (
+    "LIVESTATE_PATH",
+    "STATEARCHIVE_PATH",
+    "SCHEMAARCHIVE_PATH",
+    "LIVESCHEMA_PATH",
+)
+
+SUITES = ("actions", "instances", "compression", "files", "end_to_end")
+
+
+def _integers(value: str) -> List[int]:
+    return [int(item) for item in value.split(",") if item]
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--scales",
+        type=_integers,
+        default=[100, 1000, 10000],
+        help="Parts nodes of the synthetic schemas, comma separated",
+    )
+    parser.add_argument(
+        "--instance-counts",
+        type=_integers,
+        default=[10_000, 100_000, 1_000_000],
+        help="instances held by the store for the update_state_instances curves",
+    )
+    parser.add_argument("--instances-per-part", type=int, default=100)
+    parser.add_argument(
+        "--calls",
+        type=int,
+        default=1000,
+        help="update_state_instances calls per run",
+    )
+    parser.add_argument(
+        "--changes-per-timestamp",
+        type=int,
+        default=100,
+        help="end to end changes between archives",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--only", type=lambda value: value.split(","), default=list(SUITES)
+    )
+    parser.add_argument(
+        "--postgres",
+        action="store_true",
+        help="write end to end deltas to POSTGRES_URL instead of SQLite",
+    )
+    parser.add_argument("--output", help="file for the results, stdout if not given")
+    parser.add_argument(
+        "--compare", help="results of an earlier run to print speedups against"
+    )
+    args = parser.parse_args(argv)
+    unknown = set(args.only) - set(SUITES)
+    if unknown:
+        parser.error(f"Unknown suites: {', '.join(sorted(unknown))}")
+    return args
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(args: argparse.Namespace, directory: str) -> Dict[str, Any]:
+    # Imported once the data paths are set, the worker reads them on import
+    from workers.instance_store import node_link_data
+
+    from . import cases
+    from .synthetic import SyntheticSchema
+
+    # The workers log every change at INFO
+    logging.disable(logging.INFO)
+    results: Dict[str, List[Dict[str, Any]]] = {}
+
+    def add(name: str, result: Dict[str, Any]) -> None:
+        results.setdefault(name, []).append(result)
+        print(
+            f"{name} scale {result['scale']}: {result['median_seconds'] * 1000:.1f} ms, "
+            f"{result['ops_per_second'] or 0:.0f} ops/s",
+            file=sys.stderr,
+        )
+
+    if "actions" in args.only:
+        for scale in args.scales:
+            for name, bench in (
+                ("process_schema_create", cases.bench_schema_create),
+                ("process_schema_update", cases.bench_schema_update),
+                ("process_schema_delete", cases.bench_schema_delete),
+            ):
+                add(name, bench(scale, args.instances_per_part, args.repeat))
+
+    if "instances" in args.only:
+        for instances in args.instance_counts:
+            add(
+                "update_state_instances",
+                cases.bench_update_state_instances(
+                    instances, args.instances_per_part, args.calls, args.repeat
+                ),
+            )
+            add(
+                "update_state_instances_bulk",
+                cases.bench_update_state_instances_bulk(instances, args.repeat),
+            )
+
+    if "compression" in args.only or "files" in args.only:
+        for scale in args.scales:
+            schema, state = cases.build_schema(
+                SyntheticSchema(scale, args.instances_per_part)
+            )
+            if "compression" in args.only:
+                for name, data in (
+                    ("schema", node_link_data(schema)),
+                    ("state", state.node_link_data()),
+                ):
+                    curves = cases.bench_compression(data, scale, args.repeat)
+                    add(f"compress_graph_json.{name}", curves["compress"])
+                    add(f"decompress_graph_json.{name}", curves["decompress"])
+            if "files" in args.only:
+                for fmt in ("json", "binary"):
+                    saved = cases.bench_save_and_load(
+                        schema, state, scale, fmt, args.repeat
+                    )
+                    for name, curves in saved.items():
+                        add(f"save_graph.{name}.{fmt}", curves["save"])
+                        add(f"load_live_{name}.{fmt}", curves["load"])
+
+    if "end_to_end" in args.only:
+        end_to_end = cases.EndToEnd(directory, postgres=args.postgres)
+        try:
+            for scale in args.scales:
+                add(
+                    "end_to_end",
+                    end_to_end.bench(
+                        scale,
+                        args.instances_per_part,
+                        args.changes_per_timestamp,
+                        args.repeat,
+                    ),
+                )
+        finally:
+            end_to_end.close()
+
+    return {
+        "meta": {
+            "started_at": int(time.time()),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "processor": platform.processor() or platform.machine(),
+            "cpus": os.cpu_count(),
+            "arguments": {
+                key: value for key, value in vars(args).items() if key != "compare"
+            },
+        },
+        "results": results,
+    }
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any]) -> List[str]:
+    """Lines with the speedup of every point also in the baseline"""
+    lines = []
+    for name, points in results["results"].items():
+        earlier = {point["scale"]: point for point in baseline["results"].get(name, [])}
+        for point in points:
+            before = earlier.get(point["scale"])
+            if before is None or not point["median_seconds"]:
+                continue
+            speedup = before["median_seconds"] / point["median_seconds"]
+            lines.append(f"{name} scale {point['scale']}: {speedup:.2f}x")
+    return lines
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    directory = tempfile.mkdtemp(prefix="graph-server-bench-")
+    for variable in PATH_VARIABLES:
+        os.environ.setdefault(variable, os.path.join(directory, variable.lower()))
+
+    results = run_benchmarks(args, directory)
+
+    encoded = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(encoded)
+    else:
+        print(encoded)
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+        for line in compare(results, baseline):
+            print(line, file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
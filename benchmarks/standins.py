@@ -0,0 +1,81 @@
+import json
+import sqlite3
+import threading
+from collections import defaultdict, deque
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class LocalRedis:
+    """
+    In-process stand-in for the Redis commands the worker sends: RPUSH and
+    LPOP with a count on lists, and PUBLISH, which only counts messages
+    """
+
+    def __init__(self):
+        self._lists: Dict[str, deque] = defaultdict(deque)
+        self._lock = threading.Lock()
+        self.published = 0
+
+    def rpush(self, key: str, *values) -> int:
+        with self._lock:
+            items = self._lists[key]
+            items.extend(
+                value.encode() if isinstance(value, str) else value for value in values
+            )
+            return len(items)
+
+    def lpop(self, key: str, count: Optional[int] = None):
+        with self._lock:
+            items = self._lists[key]
+            if count is None:
+                return items.popleft() if items else None
+            if not items:
+                return None
+            return [items.popleft() for _ in range(min(count, len(items)))]
+
+    def llen(self, key: str) -> int:
+        with self._lock:
+            return len(self._lists[key])
+
+    def publish(self, channel: str, message: Any) -> int:
+        self.published += 1
+        return 0
+
+
+class SQLiteDeltaWriter:
+    """
+    Writes delta rows to a SQLite state_deltas table with the columns and the
+    (version, seq) key of the Postgres one, for the DeltaSink of a benchmark
+    run without Postgres
+    """
+
+    def __init__(self, path: str):
+        # The sink writes from its own thread
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS state_deltas (
+                version TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                timestamp INTEGER NOT NULL,
+                applied_timestamp INTEGER,
+                action TEXT NOT NULL,
+                change_type TEXT NOT NULL,
+                change_data TEXT NOT NULL,
+                PRIMARY KEY (version, seq)
+            )
+        """
+        )
+        self._conn.commit()
+        self.rows = 0
+
+    def __call__(self, rows: List[Tuple]) -> None:
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO state_deltas VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [row[:-1] + (json.dumps(row[-1]),) for row in rows],
+        )
+        self._conn.commit()
+        self.rows += len(rows)
+
+    def close(self) -> None:
+        self._conn.close()
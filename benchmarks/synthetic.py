@@ -0,0 +1,167 @@
+import json
+import os
+import random
+from typing import Any, Dict, List, Optional, Tuple
+
+RELATIONS_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "metadata",
+    "relations.json",
+)
+
+# Nodes of each type per Parts node, the scale of a synthetic schema is its
+# number of Parts. Types of relations.json not listed get one node per 100.
+NODES_PER_PART = {
+    "Parts": 1,
+    "Supplier": 0.02,
+    "Warehouse": 0.05,
+    "Facility": 0.05,
+    "ProductOffering": 0.02,
+    "ProductFamily": 0.005,
+    "BusinessUnit": 0.001,
+}
+
+# Edges of each relation per source node, each to a random node of the target
+# type
+EDGES_PER_SOURCE = 2
+
+# Instances are valid this long, so none expires while a benchmark runs
+INSTANCE_EXPIRY_SECONDS = 10**9
+
+
+def load_relations(path: str = RELATIONS_PATH) -> Dict[str, Any]:
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def _feature_value(name: str, kind: str, node_id: str, rng: random.Random):
+    if kind == "float":
+        return round(rng.uniform(0, 1000), 2)
+    if kind == "integer":
+        return rng.randint(0, 1000)
+    return f"{name}-{node_id}"
+
+
+class SyntheticSchema:
+    """
+    Schema changes shaped like metadata/relations.json: nodes of every type
+    with values for its features, and edges of every relation between nodes
+    of its source and target types. The same scale and seed always give the
+    same changes.
+    """
+
+    def __init__(
+        self,
+        scale: int,
+        instances_per_part: int = 100,
+        seed: int = 0,
+        relations: Optional[Dict[str, Any]] = None,
+    ):
+        self.scale = scale
+        self.instances_per_part = instances_per_part
+        self.relations = relations or load_relations()
+        self._rng = random.Random(seed)
+        self.nodes: Dict[str, List[str]] = {}
+        # Types with instances last: a version applies its first change
+        # before it has a timestamp, which instances that expire need
+        node_types = sorted(
+            self.relations["nodes"],
+            key=lambda t: "units_in_chain" in self.relations["nodes"][t]["features"],
+        )
+        for node_type in node_types:
+            count = max(1, int(scale * NODES_PER_PART.get(node_type, 0.01)))
+            self.nodes[node_type] = [f"{node_type}-{i}" for i in range(count)]
+        self.edges: List[Tuple[str, str, str]] = []
+        for edge_type, relation in self.relations["edges"].items():
+            targets = self.nodes[relation["target"]]
+            for source in self.nodes[relation["source"]]:
+                picked = self._rng.sample(targets, min(EDGES_PER_SOURCE, len(targets)))
+                self.edges.extend((source, target, edge_type) for target in picked)
+
+    def node_ids(self) -> List[str]:
+        return [node_id for ids in self.nodes.values() for node_id in ids]
+
+    def node_payloads(self) -> List[Dict[str, Any]]:
+        """Create payloads of every node, Parts with their instances"""
+        payloads = []
+        for node_type, ids in self.nodes.items():
+            features = self.relations["nodes"][node_type]["features"]
+            for node_id in ids:
+                properties = {
+                    name: _feature_value(name, kind, node_id, self._rng)
+                    for name, kind in features.items()
+                    if name != "id"
+                }
+                if "units_in_chain" in properties:
+                    properties["units_in_chain"] = self.instances_per_part
+                if "expiry" in properties:
+                    properties["expiry"] = INSTANCE_EXPIRY_SECONDS
+                payloads.append(
+                    {
+                        "node_id": node_id,
+                        "node_type": node_type,
+                        "properties": properties,
+                    }
+                )
+        return payloads
+
+    def edge_payloads(self) -> List[Dict[str, Any]]:
+        payloads = []
+        for source, target, edge_type in self.edges:
+            features = self.relations["edges"][edge_type]["features"]
+            payloads.append(
+                {
+                    "source_id": source,
+                    "target_id": target,
+                    "edge_type": edge_type,
+                    "properties": {
+                        name: _feature_value(name, kind, source, self._rng)
+                        for name, kind in features.items()
+                    },
+                }
+            )
+        return payloads
+
+    def update_payloads(self, count: int) -> List[Dict[str, Any]]:
+        """Updates of random Parts to a new number of instances around the initial one"""
+        parts = self.nodes["Parts"]
+        payloads = []
+        for _ in range(count):
+            units = self._rng.randint(
+                self.instances_per_part // 2, self.instances_per_part * 3 // 2
+            )
+            payloads.append(
+                {
+                    "node_id": self._rng.choice(parts),
+                    "updates": {"properties": {"units_in_chain": units}},
+                }
+            )
+        return payloads
+
+    def changes(
+        self,
+        version: str,
+        updates: int = 0,
+        timestamp: int = 1_700_000_000,
+        changes_per_timestamp: int = 100,
+    ) -> List[Dict[str, Any]]:
+        """
+        Change dicts as queued by the API: the nodes, the edges, then updates.
+        The timestamp moves every changes_per_timestamp changes, which is
+        when the worker archives.
+        """
+        actions = (
+            [("create", payload) for payload in self.node_payloads()]
+            + [("create", payload) for payload in self.edge_payloads()]
+            + [("update", payload) for payload in self.update_payloads(updates)]
+        )
+        return [
+            {
+                "action": action,
+                "type": "schema",
+                "timestamp": timestamp + i // max(1, changes_per_timestamp),
+                "payload": payload,
+                "version": version,
+            }
+            for i, (action, payload) in enumerate(actions)
+        ]
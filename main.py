@@ -1,8 +1,8 @@
 import uvicorn
 from server import create_app
-from workers import start_worker, main_worker
+from workers import start_worker, flush_live_graphs
+from server.utils.change_feed import change_feed
 from contextlib import asynccontextmanager
-import threading
 import logging
 
 logger = logging.getLogger(__name__)
@@ -13,13 +13,13 @@ async def lifespan(app):
     logger.info("Starting up the application")
 
     start_worker()
-    livestate_worker = threading.Thread(target=main_worker, daemon=True)
-    livestate_worker.start()
+    await change_feed.start()
 
     yield
 
     logger.info("Shutting down the application")
-    # Add any cleanup code here if needed
+    await change_feed.stop()
+    flush_live_graphs()
 
 
 app = create_app()
@@ -0,0 +1,533 @@
+"""
+Load generator for the change ingest and the worker.
+
+Sends schema changes shaped like the Change model to /schema/live/update,
+or in batches to /schema/live/update/bulk, from concurrent clients at a
+target rate, over several versions and with a configurable mix of create,
+update and delete. The nodes and edges follow metadata/relations.json.
+
+Reports latency percentiles of ingest, the time a request takes to be
+accepted, and of apply lag, the time from sending a change until the change
+feed of its version announces it committed. Every change carries a load_id
+in its payload to match it with its feed event.
+
+    python scripts/load_generator.py --rate 500 --duration 60 --versions 4
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import os
+import random
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiohttp
+
+RELATIONS_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "metadata",
+    "relations.json",
+)
+
+# Share of node creates that make an edge instead, once both ends exist
+EDGE_SHARE = 0.3
+
+
+class Histogram:
+    """
+    Latencies in logarithmic buckets of about 1% width, so percentiles have
+    that precision whatever the range and memory stays constant
+    """
+
+    GROWTH = 1.01
+    FLOOR = 1e-6
+
+    def __init__(self):
+        self.counts: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def record(self, seconds: float) -> None:
+        seconds = max(seconds, self.FLOOR)
+        bucket = int(math.log(seconds / self.FLOOR, self.GROWTH))
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+    def percentile(self, percent: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(self.count * percent / 100))
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                # Upper bound of the bucket, capped at the largest recorded
+                return min(self.FLOOR * self.GROWTH ** (bucket + 1), self.max)
+        return self.max
+
+    def summary(self) -> Dict[str, Any]:
+        def ms(seconds):
+            return None if seconds is None else round(seconds * 1000, 3)
+
+        return {
+            "count": self.count,
+            "mean_ms": ms(self.total / self.count) if self.count else None,
+            "min_ms": ms(self.min),
+            "p50_ms": ms(self.percentile(50)),
+            "p90_ms": ms(self.percentile(90)),
+            "p99_ms": ms(self.percentile(99)),
+            "p999_ms": ms(self.percentile(99.9)),
+            "max_ms": ms(self.max),
+        }
+
+    def buckets(self) -> List[Tuple[float, int]]:
+        """Upper bound in ms and count of every non-empty bucket"""
+        return [
+            (round(self.FLOOR * self.GROWTH ** (bucket + 1) * 1000, 4), count)
+            for bucket, count in sorted(self.counts.items())
+        ]
+
+
+class _Pool:
+    """Set with constant time add, remove and random choice"""
+
+    def __init__(self):
+        self.items: List[Any] = []
+        self.index: Dict[Any, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __contains__(self, item) -> bool:
+        return item in self.index
+
+    def add(self, item) -> None:
+        if item not in self.index:
+            self.index[item] = len(self.items)
+            self.items.append(item)
+
+    def remove(self, item) -> None:
+        position = self.index.pop(item)
+        last = self.items.pop()
+        if position < len(self.items):
+            self.items[position] = last
+            self.index[last] = position
+
+    def choice(self, rng: random.Random):
+        return self.items[rng.randrange(len(self.items))]
+
+
+class VersionModel:
+    """
+    What the generator has created in a version, to pick changes that apply.
+    Changes are applied asynchronously and may be reordered between
+    concurrent clients, so a few of them still fail.
+    """
+
+    def __init__(
+        self, name: str, relations: Dict[str, Any], rng: random.Random, run_id: str
+    ):
+        self.name = name
+        # Node ids of earlier runs may still exist in the version
+        self.run_id = run_id
+        self.relations = relations
+        self.rng = rng
+        self.nodes: Dict[str, _Pool] = {t: _Pool() for t in relations["nodes"]}
+        self.node_types: Dict[str, str] = {}
+        self.all_nodes = _Pool()
+        self.edges = _Pool()
+        self.node_edges: Dict[str, set] = {}
+        self._ids = itertools.count()
+
+    def _properties(self, node_type: str, node_id: str, max_units: int) -> Dict:
+        properties = {}
+        for name, kind in self.relations["nodes"][node_type]["features"].items():
+            if name in ("id", "expiry"):
+                continue
+            if name == "units_in_chain":
+                properties[name] = self.rng.randint(0, max_units)
+            elif kind == "float":
+                properties[name] = round(self.rng.uniform(0, 1000), 2)
+            elif kind == "integer":
+                properties[name] = self.rng.randint(0, 1000)
+            else:
+                properties[name] = f"{name}-{node_id}"
+        return properties
+
+    def create(self, max_units: int) -> Dict[str, Any]:
+        if self.all_nodes and self.rng.random() < EDGE_SHARE:
+            edge = self._new_edge()
+            if edge is not None:
+                return edge
+
+        node_type = self.rng.choice(list(self.relations["nodes"]))
+        node_id = f"{node_type}-{self.run_id}-{next(self._ids)}"
+        self.nodes[node_type].add(node_id)
+        self.node_types[node_id] = node_type
+        self.all_nodes.add(node_id)
+        self.node_edges[node_id] = set()
+        return {
+            "node_id": node_id,
+            "node_type": node_type,
+            "properties": self._properties(node_type, node_id, max_units),
+        }
+
+    def _new_edge(self) -> Optional[Dict[str, Any]]:
+        edge_type = self.rng.choice(list(self.relations["edges"]))
+        relation = self.relations["edges"][edge_type]
+        sources = self.nodes[relation["source"]]
+        targets = self.nodes[relation["target"]]
+        if not sources or not targets:
+            return None
+        edge = (sources.choice(self.rng), targets.choice(self.rng))
+        if edge in self.edges or edge[0] == edge[1]:
+            return None
+        self.edges.add(edge)
+        for node_id in edge:
+            self.node_edges[node_id].add(edge)
+        return {
+            "source_id": edge[0],
+            "target_id": edge[1],
+            "edge_type": edge_type,
+            "properties": {},
+        }
+
+    def _remove_edge(self, edge: Tuple[str, str]) -> None:
+        self.edges.remove(edge)
+        for node_id in edge:
+            self.node_edges[node_id].discard(edge)
+
+    def update(self, max_units: int) -> Optional[Dict[str, Any]]:
+        if not self.all_nodes:
+            return None
+        node_id = self.all_nodes.choice(self.rng)
+        properties = self._properties(self.node_types[node_id], node_id, max_units)
+        name = self.rng.choice(list(properties))
+        return {"node_id": node_id, "updates": {"properties": {name: properties[name]}}}
+
+    def delete(self) -> Optional[Dict[str, Any]]:
+        if self.edges and self.rng.random() < 0.5:
+            edge = self.edges.choice(self.rng)
+            self._remove_edge(edge)
+            return {"source_id": edge[0], "target_id": edge[1]}
+        if not self.all_nodes:
+            return None
+        node_id = self.all_nodes.choice(self.rng)
+        self.all_nodes.remove(node_id)
+        self.nodes[self.node_types.pop(node_id)].remove(node_id)
+        # Its edges go with it
+        for edge in list(self.node_edges[node_id]):
+            self._remove_edge(edge)
+        del self.node_edges[node_id]
+        return {"node_id": node_id}
+
+
+class LoadGenerator:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.url = args.url.rstrip("/")
+        with open(args.relations, "r") as f:
+            relations = json.load(f)
+        rng = random.Random(args.seed)
+        self.rng = rng
+        self.models = [
+            VersionModel(f"{args.version_prefix}{i}", relations, rng, args.run_id)
+            for i in range(args.versions)
+        ]
+        self.actions, self.weights = zip(*args.mix.items())
+        self.load_ids = itertools.count(1)
+
+        self.ingest = Histogram()
+        self.apply_lag = Histogram()
+        self.sent_at: Dict[int, float] = {}
+        self.sent = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.errors = 0
+        self.behind_schedule = 0
+        self.resyncs = 0
+        self.last_applied: Optional[float] = None
+
+    def next_change(self) -> Dict[str, Any]:
+        model = self.rng.choice(self.models)
+        action = self.rng.choices(self.actions, self.weights)[0]
+        payload = None
+        if action == "update":
+            payload = model.update(self.args.max_units)
+        elif action == "delete":
+            payload = model.delete()
+        if payload is None:
+            action = "create"
+            payload = model.create(self.args.max_units)
+        payload["load_id"] = next(self.load_ids)
+        return {
+            "action": action,
+            "type": "schema",
+            "timestamp": int(time.time()),
+            "payload": payload,
+            "version": model.name,
+        }
+
+    # Sending
+
+    async def send(self, session: aiohttp.ClientSession, changes: List[Dict]):
+        started = time.perf_counter()
+        for change in changes:
+            self.sent_at[change["payload"]["load_id"]] = started
+        self.sent += len(changes)
+        try:
+            if len(changes) == 1:
+                url = f"{self.url}/schema/live/update"
+                body = changes[0]
+            else:
+                url = f"{self.url}/schema/live/update/bulk"
+                body = changes
+            async with session.post(url, json=body) as response:
+                await response.read()
+                ok = response.status < 300
+        except aiohttp.ClientError:
+            ok = False
+            self.errors += 1
+        self.ingest.record(time.perf_counter() - started)
+        if ok:
+            self.accepted += len(changes)
+        else:
+            self.rejected += len(changes)
+            for change in changes:
+                self.sent_at.pop(change["payload"]["load_id"], None)
+
+    async def client(self, session: aiohttp.ClientSession, slots: asyncio.Queue):
+        while True:
+            changes = await slots.get()
+            if changes is None:
+                return
+            await self.send(session, changes)
+
+    async def schedule(self, slots: asyncio.Queue) -> None:
+        """
+        Hand batches of changes to the clients at the target rate. A batch
+        waiting for a free client is counted as behind schedule: the server
+        or the clients cannot keep up with the rate.
+        """
+        args = self.args
+        interval = args.batch / args.rate if args.rate else 0
+        started = time.perf_counter()
+        deadline = started + args.duration if args.duration else None
+        batches = 0
+        while True:
+            if args.changes and batches * args.batch >= args.changes:
+                break
+            now = time.perf_counter()
+            if deadline is not None and now >= deadline:
+                break
+            if interval:
+                due = started + batches * interval
+                if due > now:
+                    await asyncio.sleep(due - now)
+                elif now - due > interval:
+                    self.behind_schedule += 1
+            await slots.put([self.next_change() for _ in range(args.batch)])
+            batches += 1
+
+    # Apply lag
+
+    async def follow(self, session: aiohttp.ClientSession, version: str) -> None:
+        """Match the change feed of a version with the changes sent to it"""
+        timeout = aiohttp.ClientTimeout(total=None, sock_read=None)
+        async with session.get(f"{self.url}/feed/{version}", timeout=timeout) as r:
+            event = None
+            async for raw_line in r.content:
+                line = raw_line.decode().rstrip("\n")
+                if line.startswith("event:"):
+                    event = line[6:].strip()
+                elif line.startswith("data:") and event == "change":
+                    self._applied(json.loads(line[5:]))
+                elif line.startswith("data:") and event == "resync":
+                    self.resyncs += 1
+
+    def _applied(self, message: Dict[str, Any]) -> None:
+        payload = message.get("payload") or {}
+        sent_at = self.sent_at.pop(payload.get("load_id"), None)
+        if sent_at is not None:
+            self.last_applied = time.perf_counter()
+            self.apply_lag.record(self.last_applied - sent_at)
+
+    async def run(self) -> Dict[str, Any]:
+        args = self.args
+        connector = aiohttp.TCPConnector(limit=args.concurrency + args.versions)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            followers = []
+            if not args.no_lag:
+                followers = [
+                    asyncio.ensure_future(self.follow(session, model.name))
+                    for model in self.models
+                ]
+                # Let the subscriptions start before the first change
+                await asyncio.sleep(0.5)
+
+            slots: asyncio.Queue = asyncio.Queue(maxsize=args.concurrency)
+            clients = [
+                asyncio.ensure_future(self.client(session, slots))
+                for _ in range(args.concurrency)
+            ]
+            started = time.perf_counter()
+            await self.schedule(slots)
+            for _ in clients:
+                await slots.put(None)
+            await asyncio.gather(*clients)
+            sending_seconds = time.perf_counter() - started
+
+            # Wait for the worker to apply what was accepted, until the feeds
+            # stay quiet for the drain timeout
+            while followers and self.sent_at:
+                quiet_since = max(
+                    self.last_applied or started, started + sending_seconds
+                )
+                if time.perf_counter() - quiet_since >= args.drain_timeout:
+                    break
+                await asyncio.sleep(0.1)
+            applied_seconds = (self.last_applied or time.perf_counter()) - started
+            for follower in followers:
+                follower.cancel()
+            await asyncio.gather(*followers, return_exceptions=True)
+
+        return {
+            "arguments": {
+                key: value for key, value in vars(args).items() if key != "output"
+            },
+            "sent": self.sent,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "errors": self.errors,
+            "behind_schedule": self.behind_schedule,
+            "sending_seconds": round(sending_seconds, 3),
+            "applied_seconds": round(applied_seconds, 3),
+            "ingest_rate": round(self.accepted / sending_seconds, 1),
+            "apply_rate": (
+                round(self.apply_lag.count / applied_seconds, 1) if followers else None
+            ),
+            # Accepted but never announced: failed to apply, or still queued
+            # when the drain timeout ran out
+            "unconfirmed": len(self.sent_at) if followers else None,
+            "resyncs": self.resyncs,
+            "ingest": {**self.ingest.summary(), "buckets": self.ingest.buckets()},
+            "apply_lag": {
+                **self.apply_lag.summary(),
+                "buckets": self.apply_lag.buckets(),
+            },
+        }
+
+
+def _mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for part in value.split(","):
+        action, _, weight = part.partition("=")
+        if action not in ("create", "update", "delete"):
+            raise argparse.ArgumentTypeError(f"Unknown action {action}")
+        mix[action] = float(weight)
+    if not any(mix.values()):
+        raise argparse.ArgumentTypeError("The mix needs a positive weight")
+    return mix
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument(
+        "--rate", type=float, default=100, help="changes per second, 0 for no limit"
+    )
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument(
+        "--duration", type=float, default=30, help="seconds to send for"
+    )
+    parser.add_argument(
+        "--changes", type=int, default=0, help="stop after this many changes"
+    )
+    parser.add_argument(
+        "--batch",
+        type=int,
+        default=1,
+        help="changes per request, more than one sends to the bulk endpoint",
+    )
+    parser.add_argument("--versions", type=int, default=1)
+    parser.add_argument("--version-prefix", default="load-")
+    parser.add_argument(
+        "--mix",
+        type=_mix,
+        default=_mix("create=0.5,update=0.4,delete=0.1"),
+        help="weights of the actions, as create=0.5,update=0.4,delete=0.1",
+    )
+    parser.add_argument(
+        "--max-units", type=int, default=100, help="most instances per node"
+    )
+    parser.add_argument(
+        "--no-lag",
+        action="store_true",
+        help="do not follow the change feeds to measure apply lag",
+    )
+    parser.add_argument(
+        "--drain-timeout",
+        type=float,
+        default=5,
+        help="seconds without an applied change after which to stop waiting",
+    )
+    parser.add_argument("--relations", default=RELATIONS_PATH)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--run-id",
+        default=format(int(time.time()), "x"),
+        help="part of the node ids, unique per run by default",
+    )
+    parser.add_argument("--output", help="file for the JSON report")
+    args = parser.parse_args(argv)
+    if args.rate < 0 or args.concurrency < 1 or args.batch < 1:
+        parser.error("--rate, --concurrency and --batch must be positive")
+    if not args.duration and not args.changes:
+        parser.error("Give --duration or --changes")
+    return args
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(
+        f"sent {report['sent']}, accepted {report['accepted']}, "
+        f"rejected {report['rejected']}, errors {report['errors']}, "
+        f"behind schedule {report['behind_schedule']}"
+    )
+    print(
+        f"ingest {report['ingest_rate']}/s over {report['sending_seconds']} s"
+        + (
+            f", applied {report['apply_rate']}/s, unconfirmed {report['unconfirmed']}"
+            if report["apply_rate"] is not None
+            else ""
+        )
+    )
+    for name in ("ingest", "apply_lag"):
+        summary = report[name]
+        if not summary["count"]:
+            continue
+        print(
+            f"{name:>9} ms: p50 {summary['p50_ms']}  p90 {summary['p90_ms']}  "
+            f"p99 {summary['p99_ms']}  p999 {summary['p999_ms']}  "
+            f"max {summary['max_ms']}  (n={summary['count']})"
+        )
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    report = asyncio.run(LoadGenerator(args).run())
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
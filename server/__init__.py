@@ -1,7 +1,10 @@
 import logging
 from fastapi import FastAPI
+from .utils.request_metrics import RequestMetricsMiddleware
 from .routes import (
     archive,
+    feed,
+    metrics,
     state,
     schema,
 )
@@ -19,6 +22,8 @@ def create_app():
         redoc_url="/redoc",
     )
 
+    app.add_middleware(RequestMetricsMiddleware)
+
     @app.get("/")
     async def root():
         return {"message": "Server is running"}
@@ -27,5 +32,7 @@ def create_app():
     app.include_router(archive.router)
     app.include_router(state.router)
     app.include_router(schema.router)
+    app.include_router(feed.router)
+    app.include_router(metrics.router)
 
     return app
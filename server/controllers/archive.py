@@ -1,68 +1,219 @@
 import os
 import json
+import logging
 import networkx as nx
+import psycopg2
+from typing import Optional
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
 from ..config import get_paths
+from ..utils.response_cache import archive_cache, cached_json_response, stream_response
+from utils.archive import get_timeline, stream_archive
+from utils.streaming import STREAM_ENCODERS
+from workers.history import HistoryUnavailable
+
+# Resolved on use, the worker package imports server.config on import
+import workers
+
+logger = logging.getLogger(__name__)
+
+# Directory listings and archive reads run in the threadpool so large archives
+# do not block the event loop for other requests
+
+
+def _archive_page(directory: str, start, end, limit, cursor):
+    return get_timeline(directory).between(start, end, after=cursor, limit=limit)
+
+
+def _archive_at_or_before(directory: str, timestamp: int):
+    return get_timeline(directory).at_or_before(timestamp)
+
+
+async def _list_archives(
+    directory: str,
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[int] = None,
+):
+    # The body stays a plain list of timestamps, the next page is announced
+    # in a header
+    timestamps, next_cursor = await run_in_threadpool(
+        _archive_page, directory, start, end, limit, cursor
+    )
+    if next_cursor is None:
+        return timestamps
+    return JSONResponse(timestamps, headers={"X-Next-Cursor": str(next_cursor)})
+
+
+async def _get_archive(
+    directory: str, timestamp: int, stream: Optional[str], request: Optional[Request]
+):
+    if stream is not None:
+        # Delta chains are read in the threadpool, the keyframe as it is sent
+        members = await run_in_threadpool(stream_archive, directory, timestamp)
+        if members is None:
+            return None
+        encoder, media_type = STREAM_ENCODERS[stream]
+        return stream_response(request, encoder(members), media_type)
+
+    entry = await run_in_threadpool(archive_cache.load, directory, timestamp)
+    if entry is None:
+        return None
+    return await cached_json_response(request, entry)
+
+
+async def _find_archive(directory: str, timestamp: int, name: str):
+    found = await run_in_threadpool(_archive_at_or_before, directory, timestamp)
+    if found is not None:
+        return {"timestamp": found}
+    else:
+        return {"error": f"No {name} archive at or before {timestamp}"}
 
 
-async def get_schema_archive_list(version: str = None):
+async def get_schema_archive_list(
+    version: str = None,
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[int] = None,
+):
     paths = get_paths(version)
-    archives = os.listdir(paths["SCHEMAARCHIVE_PATH"])
-    return [int(f.split(".")[0]) for f in archives]
+    return await _list_archives(paths["SCHEMAARCHIVE_PATH"], start, end, limit, cursor)
 
 
-async def get_specific_schema_archive(timestamp: int, version: str = None):
+async def find_schema_archive(timestamp: int, version: str = None):
     paths = get_paths(version)
-    file_path = os.path.join(paths["SCHEMAARCHIVE_PATH"], f"{timestamp}.json")
-    if os.path.exists(file_path):
-        with open(file_path, "r") as f:
-            return json.load(f)
+    return await _find_archive(paths["SCHEMAARCHIVE_PATH"], timestamp, "schema")
+
+
+async def get_specific_schema_archive(
+    timestamp: int,
+    version: str = None,
+    stream: Optional[str] = None,
+    request: Optional[Request] = None,
+):
+    paths = get_paths(version)
+    archive = await _get_archive(
+        paths["SCHEMAARCHIVE_PATH"], timestamp, stream, request
+    )
+    if archive is not None:
+        return archive
     else:
         return {"error": "Schema archive not found"}
 
 
-async def get_state_archive_list(version: str = None):
+async def get_state_archive_list(
+    version: str = None,
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[int] = None,
+):
     paths = get_paths(version)
-    archives = os.listdir(paths["STATEARCHIVE_PATH"])
-    return [int(f.split(".")[0]) for f in archives]
+    return await _list_archives(paths["STATEARCHIVE_PATH"], start, end, limit, cursor)
 
 
-async def get_specific_state_archive(timestamp: int, version: str = None):
+async def find_state_archive(timestamp: int, version: str = None):
     paths = get_paths(version)
-    file_path = os.path.join(paths["STATEARCHIVE_PATH"], f"state_{timestamp}.json")
-    if os.path.exists(file_path):
-        with open(file_path, "r") as f:
-            return json.load(f)
+    return await _find_archive(paths["STATEARCHIVE_PATH"], timestamp, "state")
+
+
+async def get_specific_state_archive(
+    timestamp: int,
+    version: str = None,
+    stream: Optional[str] = None,
+    request: Optional[Request] = None,
+):
+    paths = get_paths(version)
+    archive = await _get_archive(paths["STATEARCHIVE_PATH"], timestamp, stream, request)
+    if archive is not None:
+        return archive
     else:
         return {"error": "State archive not found"}
 
 
-async def get_network_object_timestamps(version: str = None):
-    paths = get_paths(version)
-    files = os.listdir(paths["NETWORKOBJECT_PATH"])
+def _encoded_graphs_as_of(version: str, timestamp: int):
+    return json.dumps(workers.graphs_as_of(version, timestamp)).encode()
+
+
+async def get_graphs_as_of(timestamp: int, version: str = None):
+    try:
+        content = await run_in_threadpool(_encoded_graphs_as_of, version, timestamp)
+    except HistoryUnavailable as e:
+        return {"error": str(e)}
+    except psycopg2.Error as e:
+        logger.error(f"Error reading deltas of version {version}: {str(e)}")
+        return {"error": "Delta log unavailable"}
+    return Response(content=content, media_type="application/json")
+
+
+def _list_versions():
+    base_path = os.environ.get("LIVESTATE_PATH", "/app/data/livestate")
+    try:
+        return [
+            d
+            for d in os.listdir(base_path)
+            if os.path.isdir(os.path.join(base_path, d))
+        ]
+    except FileNotFoundError:
+        return []
+
+
+async def get_versions():
+    return {"versions": await run_in_threadpool(_list_versions)}
+
+
+def _list_network_objects(directory: str):
+    files = os.listdir(directory)
     return [int(f.split("_")[1].split(".")[0]) for f in files if f.endswith(".json")]
 
 
-async def get_network_object(timestamp: int, version: str = None):
+async def get_network_object_timestamps(version: str = None):
     paths = get_paths(version)
-    file_path = os.path.join(paths["NETWORKOBJECT_PATH"], f"network_{timestamp}.json")
+    return await run_in_threadpool(_list_network_objects, paths["NETWORKOBJECT_PATH"])
+
+
+def _read_network_object(file_path: str):
     if os.path.exists(file_path):
         with open(file_path, "r") as f:
             return json.load(f)
+    return None
+
+
+async def get_network_object(timestamp: int, version: str = None):
+    paths = get_paths(version)
+    file_path = os.path.join(paths["NETWORKOBJECT_PATH"], f"network_{timestamp}.json")
+    network_object = await run_in_threadpool(_read_network_object, file_path)
+    if network_object is not None:
+        return network_object
     else:
         return {"error": "Network object not found"}
 
 
-async def get_geometric_object_timestamps(version: str = None):
-    paths = get_paths(version)
-    files = os.listdir(paths["GRAPHOBJECT_PATH"])
+def _list_geometric_objects(directory: str):
+    files = os.listdir(directory)
     return [int(f.split("_")[1].split(".")[0]) for f in files if f.endswith(".graphml")]
 
 
-async def get_geometric_object(timestamp: int, version: str = None):
+async def get_geometric_object_timestamps(version: str = None):
     paths = get_paths(version)
-    file_path = os.path.join(paths["GRAPHOBJECT_PATH"], f"graph_{timestamp}.graphml")
+    return await run_in_threadpool(_list_geometric_objects, paths["GRAPHOBJECT_PATH"])
+
+
+def _read_geometric_object(file_path: str):
     if os.path.exists(file_path):
         G = nx.read_graphml(file_path)
         return nx.node_link_data(G)
+    return None
+
+
+async def get_geometric_object(timestamp: int, version: str = None):
+    paths = get_paths(version)
+    file_path = os.path.join(paths["GRAPHOBJECT_PATH"], f"graph_{timestamp}.graphml")
+    geometric_object = await run_in_threadpool(_read_geometric_object, file_path)
+    if geometric_object is not None:
+        return geometric_object
     else:
         return {"error": "Geometric object not found"}
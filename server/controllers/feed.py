@@ -0,0 +1,73 @@
+import asyncio
+import json
+import logging
+from typing import Any, Dict, Optional
+from fastapi.responses import StreamingResponse
+from ..config import CHANGE_FEED_HEARTBEAT_SECONDS
+from ..utils.change_feed import RESYNC, change_feed
+
+logger = logging.getLogger(__name__)
+
+
+def _change_event(message: Dict[str, Any]) -> str:
+    return f"id: {message['seq']}\nevent: change\ndata: {json.dumps(message)}\n\n"
+
+
+def _resync_event(version: str, since: Optional[int]) -> str:
+    # The client catches up through the diff endpoints from since and skips
+    # changes up to the generation of that diff
+    data = json.dumps({"version": version, "since": since})
+    return f"event: resync\ndata: {data}\n\n"
+
+
+async def stream_changes(version: str, since: Optional[int] = None):
+    """
+    Server-sent events of the changes of a version as the worker commits them.
+    Each event carries the seq of the change as its id, so a reconnecting
+    client resumes after the last change it received.
+    """
+    subscription, backlog = change_feed.subscribe(version, since)
+
+    async def events():
+        last_sent = since
+        resynced = False
+        try:
+            yield ": connected\n\n"
+            pending = list(backlog)
+            while True:
+                if pending:
+                    message = pending.pop(0)
+                else:
+                    try:
+                        message = await asyncio.wait_for(
+                            subscription.queue.get(), CHANGE_FEED_HEARTBEAT_SECONDS
+                        )
+                    except asyncio.TimeoutError:
+                        yield ": heartbeat\n\n"
+                        continue
+
+                if message is RESYNC:
+                    yield _resync_event(version, last_sent)
+                    resynced = True
+                    continue
+                if last_sent is not None and message["seq"] <= last_sent:
+                    continue
+                if (
+                    last_sent is not None
+                    and message["seq"] > last_sent + 1
+                    and not resynced
+                ):
+                    # Changes between were published before this subscriber
+                    # could receive them
+                    yield _resync_event(version, last_sent)
+                yield _change_event(message)
+                last_sent = message["seq"]
+                resynced = False
+        finally:
+            change_feed.unsubscribe(subscription)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
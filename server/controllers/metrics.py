@@ -0,0 +1,119 @@
+import logging
+import math
+from fastapi import Response
+from ..config import async_redis_client
+from ..utils.change_feed import change_feed
+from utils.metrics import CONTENT_TYPE, REGISTRY, counter, gauge
+
+# Resolved on use, the worker package imports server.config on import
+import workers
+
+logger = logging.getLogger(__name__)
+
+# Read from where they are kept each time the metrics are scraped
+changes_queue_length = gauge(
+    "graph_server_changes_queue_length",
+    "Changes waiting in the Redis changes queue",
+)
+shard_backlog = gauge(
+    "graph_server_worker_shard_backlog",
+    "Changes dispatched to a worker shard and not yet applied",
+    ("shard",),
+)
+delta_sink_backlog = gauge(
+    "graph_server_delta_sink_backlog",
+    "Delta rows waiting to be written to Postgres",
+)
+delta_sink_rows = counter(
+    "graph_server_delta_sink_rows_total",
+    "Delta rows written to Postgres",
+)
+delta_sink_full_waits = counter(
+    "graph_server_delta_sink_full_waits_total",
+    "Hand-overs of delta rows that waited for room in a full backlog",
+)
+delta_sink_failures = counter(
+    "graph_server_delta_sink_failures_total",
+    "Failed writes of delta rows to Postgres",
+)
+delta_sink_flushes = counter(
+    "graph_server_delta_sink_flushes_total",
+    "Batches of delta rows written to Postgres",
+)
+delta_sink_flush_seconds = gauge(
+    "graph_server_delta_sink_flush_seconds",
+    "Time of the last and the slowest write of delta rows",
+    ("flush",),
+)
+change_feed_subscribers = gauge(
+    "graph_server_change_feed_subscribers",
+    "Clients following the change feed",
+)
+resident_versions = gauge(
+    "graph_server_resident_versions",
+    "Versions whose live graphs are held in memory",
+)
+graph_nodes = gauge(
+    "graph_server_graph_nodes",
+    "Nodes of the live graphs of a resident version",
+    ("version", "graph"),
+)
+graph_edges = gauge(
+    "graph_server_graph_edges",
+    "Edges of the live graphs of a resident version",
+    ("version", "graph"),
+)
+state_bytes = gauge(
+    "graph_server_state_bytes",
+    "Memory held by the instance columns of a resident version",
+    ("version",),
+)
+version_seq = gauge(
+    "graph_server_version_seq",
+    "Last change applied to a resident version",
+    ("version",),
+)
+
+
+def _collect() -> None:
+    for shard, backlog in enumerate(workers.worker_pool.backlog()):
+        shard_backlog.labels(shard).set(backlog)
+
+    stats = workers.delta_sink_stats()
+    delta_sink_backlog.set(stats["backlog"])
+    delta_sink_rows.set(stats["written"])
+    delta_sink_full_waits.set(stats["full_waits"])
+    delta_sink_failures.set(stats["failures"])
+    delta_sink_flushes.set(stats["flushes"])
+    for flush in ("last", "max"):
+        # None until the first flush
+        flush_ms = stats[f"{flush}_flush_ms"] or 0
+        delta_sink_flush_seconds.labels(flush).set(flush_ms / 1000)
+
+    change_feed_subscribers.set(change_feed.stats()["subscribers"])
+
+    # Evicted versions drop out of the per-version gauges
+    versions = workers.resident_version_stats()
+    resident_versions.set(len(versions))
+    for metric in (graph_nodes, graph_edges, state_bytes, version_seq):
+        metric.clear()
+    for stats in versions:
+        version = stats["version"]
+        for name in ("schema", "state"):
+            graph_nodes.labels(version, name).set(stats[f"{name}_nodes"])
+            graph_edges.labels(version, name).set(stats[f"{name}_edges"])
+        state_bytes.labels(version).set(stats["state_bytes"])
+        version_seq.labels(version).set(stats["seq"])
+
+
+REGISTRY.add_collector(_collect)
+
+
+async def get_metrics():
+    """Every metric of the process in the Prometheus text format"""
+    try:
+        changes_queue_length.set(await async_redis_client.llen("changes"))
+    except Exception as e:
+        logger.error(f"Error reading the changes queue length: {str(e)}")
+        changes_queue_length.set(math.nan)
+    return Response(content=REGISTRY.render(), media_type=CONTENT_TYPE)
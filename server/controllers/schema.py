@@ -2,33 +2,128 @@ import os
 import json
 import networkx as nx
 import logging
-from ..config import get_paths, redis_client
+from typing import Optional
+from fastapi import Request, Response
+from starlette.concurrency import run_in_threadpool
+from ..config import DEFAULT_VERSION, get_paths, async_redis_client
 from ..models.change import Change
+from ..utils.change_ingest import queue_bulk_changes
+from ..utils.response_cache import cached_json_response, response_cache
+from utils.archive import find_graph_file, read_graph
+from workers.diff import file_diff, graph_diff
+from workers.subgraph import neighborhood, subgraph_data
+
+# Resolved on use, the worker package imports server.config on import
+import workers
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-async def get_live_schema(version: str = None):
+def _live_schema_file(version: str = None):
     paths = get_paths(version)
-    try:
-        with open(f"{paths['LIVESCHEMA_PATH']}/current_schema.json", "r") as f:
-            return json.load(f)
-    except FileNotFoundError:
+    base = f"{paths['LIVESCHEMA_PATH']}/current_schema"
+    return find_graph_file(base) or f"{base}.json"
+
+
+async def get_live_schema(version: str = None, request: Optional[Request] = None):
+    # Unchanged polls are answered from the cache without leaving the event
+    # loop; encoding and file access run in the threadpool
+    entry = response_cache.lookup(version, "schema")
+    if entry is None:
+        entry = await run_in_threadpool(
+            response_cache.load, version, "schema", _live_schema_file
+        )
+    if entry is None:
         return {"error": "Live schema not found"}
+    return await cached_json_response(request, entry)
 
 
 async def queue_live_schema_update(update: Change):
     logger.info(f"Queueing schema update")
 
-    # Convert Change model to dict before serializing
-    change_dict = {
-        "action": update.action,
-        "type": update.type,
-        "timestamp": update.timestamp,
-        "payload": update.payload,
-        "version": update.version,
-    }
-
-    redis_client.rpush("changes", json.dumps(change_dict))
+    await async_redis_client.rpush("changes", json.dumps(update.to_dict()))
     return {"status": "Schema update queued"}
+
+
+async def queue_live_schema_updates(request: Request):
+    logger.info(f"Queueing bulk schema updates")
+    return await queue_bulk_changes(request)
+
+
+def _query_live_schema(
+    version: str,
+    node_id: str,
+    hops: Optional[int],
+    direction: str,
+    relationship_type: Optional[str],
+):
+    # Versions are loaded by the worker shard that owns them only; one not
+    # resident is queried from its live file
+    live = workers.graph_store.peek(version or DEFAULT_VERSION)
+    if live is None:
+        path = _live_schema_file(version)
+        if not os.path.exists(path):
+            return None
+        return _query_schema(
+            read_graph(path), node_id, hops, direction, relationship_type
+        )
+
+    # Only the matching nodes are visited and copied, under the version lock
+    with live.lock:
+        return _query_schema(live.schema, node_id, hops, direction, relationship_type)
+
+
+def _query_schema(
+    schema: nx.DiGraph,
+    node_id: str,
+    hops: Optional[int],
+    direction: str,
+    relationship_type: Optional[str],
+):
+    if not schema.has_node(node_id):
+        return None
+    nodes = neighborhood(schema, node_id, hops, direction, relationship_type)
+    return {"root": node_id, **subgraph_data(schema, nodes, relationship_type)}
+
+
+async def query_live_schema(
+    version: str,
+    node_id: str,
+    hops: Optional[int] = 1,
+    direction: str = "both",
+    relationship_type: Optional[str] = None,
+):
+    data = await run_in_threadpool(
+        _query_live_schema, version, node_id, hops, direction, relationship_type
+    )
+    if data is None:
+        return {"error": f"Node {node_id} not found in live schema"}
+    return data
+
+
+def _live_schema_diff(version: str, since, since_timestamp):
+    live = workers.graph_store.peek(version or DEFAULT_VERSION)
+    if live is None:
+        # Not loaded from the API, which would take the version from the
+        # worker shard that owns it
+        data = file_diff(
+            version or DEFAULT_VERSION,
+            _live_schema_file(version),
+            since,
+            since_timestamp,
+        )
+    else:
+        data = graph_diff(live, "schema", since, since_timestamp)
+    return json.dumps(data).encode()
+
+
+async def get_live_schema_diff(
+    version: str = None,
+    since: Optional[int] = None,
+    since_timestamp: Optional[int] = None,
+):
+    content = await run_in_threadpool(
+        _live_schema_diff, version, since, since_timestamp
+    )
+    return Response(content=content, media_type="application/json")
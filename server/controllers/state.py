@@ -1,29 +1,184 @@
 import os
 import json
 import logging
-from ..config import get_paths, redis_client
+from typing import Optional
+from fastapi import Request, Response
+from starlette.concurrency import run_in_threadpool
+from ..config import DEFAULT_VERSION, get_paths, async_redis_client
 from ..models.change import Change
+from ..utils.change_ingest import queue_bulk_changes
+from ..utils.response_cache import (
+    cached_json_response,
+    response_cache,
+    stream_response,
+)
+from utils.archive import find_graph_file, read_graph, stream_graph_file
+from utils.streaming import CHUNK_ITEMS, STREAM_ENCODERS, Items
+from workers.diff import file_diff, graph_diff
+from workers.rollup import InventoryRollup
+from workers.subgraph import LINKS_KEY
+
+# Resolved on use, the worker package imports server.config on import
+import workers
 
 logger = logging.getLogger(__name__)
 
 
-async def get_live_state(version: str = None):
+def _live_state_file(version: str = None):
     paths = get_paths(version)
     os.makedirs(paths["LIVESTATE_PATH"], exist_ok=True)
 
-    state_file = f"{paths['LIVESTATE_PATH']}/current_state.json"
-    if not os.path.exists(state_file):
+    base = f"{paths['LIVESTATE_PATH']}/current_state"
+    state_file = find_graph_file(base)
+    if state_file is None:
+        state_file = f"{base}.json"
         with open(state_file, "w") as f:
             json.dump({"nodes": {}, "links": []}, f)
+    return state_file
+
+
+def _live_state_chunks(live, last_id: int):
+    after = 0
+    while True:
+        # Each chunk is read under the lock, so changes applied while the
+        # stream is sent show in the chunks read after them
+        with live.lock:
+            records = live.state.records_after(after, CHUNK_ITEMS, last_id)
+        if not records:
+            return
+        after = records[-1]["id"]
+        yield records
+
+
+def _live_state_members(live):
+    with live.lock:
+        graph = live.state.graph_data()
+        last_id = live.state.last_id()
+    yield "directed", True
+    yield "multigraph", False
+    yield "graph", graph
+    yield "nodes", Items(_live_state_chunks(live, last_id))
+    yield LINKS_KEY, Items([])
+
+
+def _stream_live_state(version: str, stream: str, request: Optional[Request]):
+    encoder, media_type = STREAM_ENCODERS[stream]
+    live = workers.graph_store.peek(version or DEFAULT_VERSION)
+    if live is None:
+        members = stream_graph_file(_live_state_file(version))
+        return stream_response(request, encoder(members), media_type)
 
-    try:
-        with open(state_file, "r") as f:
-            state_data = json.load(f)
-            return state_data if state_data else {"nodes": {}, "links": []}
-    except (FileNotFoundError, json.JSONDecodeError):
+    with live.lock:
+        generation = live.generation
+    return stream_response(
+        request,
+        encoder(_live_state_members(live)),
+        media_type,
+        headers={"X-Generation": str(generation)},
+    )
+
+
+async def get_live_state(
+    version: str = None, request: Optional[Request] = None, stream: str = None
+):
+    if stream is not None:
+        # Sent as it is produced, from the resident instances or the state
+        # file, without holding the whole body in memory
+        return await run_in_threadpool(_stream_live_state, version, stream, request)
+
+    # Unchanged polls are answered from the cache without leaving the event
+    # loop; encoding and file access run in the threadpool
+    entry = response_cache.lookup(version, "state")
+    if entry is None:
+        entry = await run_in_threadpool(
+            response_cache.load, version, "state", _live_state_file
+        )
+    if entry is None:
         return {"nodes": {}, "links": []}
+    return await cached_json_response(request, entry)
 
 
 async def queue_live_state_update(update: Change):
-    redis_client.rpush("changes", json.dumps(update))
+    await async_redis_client.rpush("changes", json.dumps(update.to_dict()))
     return {"status": "State update queued"}
+
+
+async def queue_live_state_updates(request: Request):
+    logger.info(f"Queueing bulk state updates")
+    return await queue_bulk_changes(request)
+
+
+def _live_state_diff(version: str, since, since_timestamp):
+    live = workers.graph_store.peek(version or DEFAULT_VERSION)
+    if live is None:
+        # Not loaded from the API, which would take the version from the
+        # worker shard that owns it
+        data = file_diff(
+            version or DEFAULT_VERSION,
+            _live_state_file(version),
+            since,
+            since_timestamp,
+        )
+    else:
+        data = graph_diff(live, "state", since, since_timestamp)
+    return json.dumps(data).encode()
+
+
+async def get_live_state_diff(
+    version: str = None,
+    since: Optional[int] = None,
+    since_timestamp: Optional[int] = None,
+):
+    content = await run_in_threadpool(_live_state_diff, version, since, since_timestamp)
+    return Response(content=content, media_type="application/json")
+
+
+def _file_inventory(version: str, node_id: Optional[str], verify: bool):
+    # Counted from the live files of a version that is not resident; the
+    # generation is only known to the live graphs
+    paths = get_paths(version)
+    schema_file = find_graph_file(f"{paths['LIVESCHEMA_PATH']}/current_schema")
+    if schema_file is None:
+        return {"error": "Live schema not found"}
+    schema = read_graph(schema_file)
+    state = workers.read_live_state(_live_state_file(version))
+    rollup = InventoryRollup()
+    rollup.rebuild(schema, state)
+    if node_id is not None:
+        counts = rollup.get(node_id)
+        if counts is None:
+            return None
+        return {"node_id": node_id, "generation": None, **counts}
+
+    data = {"generation": None, "nodes": rollup.all()}
+    if verify:
+        data["mismatches"] = rollup.verify(schema, state)
+    return data
+
+
+def _live_inventory(version: str, node_id: Optional[str], verify: bool):
+    live = workers.graph_store.peek(version or DEFAULT_VERSION)
+    if live is None:
+        return _file_inventory(version, node_id, verify)
+
+    with live.lock:
+        if node_id is not None:
+            counts = live.rollup.get(node_id)
+            if counts is None:
+                return None
+            return {"node_id": node_id, "generation": live.generation, **counts}
+
+        data = {"generation": live.generation, "nodes": live.rollup.all()}
+        if verify:
+            # Full recompute from the instances, to check the maintained counts
+            data["mismatches"] = live.rollup.verify(live.schema, live.state)
+    return data
+
+
+async def get_live_inventory(
+    version: str = None, node_id: Optional[str] = None, verify: bool = False
+):
+    data = await run_in_threadpool(_live_inventory, version, node_id, verify)
+    if data is None:
+        return {"error": f"Node {node_id} not found in live schema"}
+    return data
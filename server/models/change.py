@@ -8,3 +8,12 @@ class Change(BaseModel):
     timestamp: int
     payload: Dict
     version: Optional[str] = None
+
+    def to_dict(self) -> Dict:
+        return {
+            "action": self.action,
+            "type": self.type,
+            "timestamp": self.timestamp,
+            "payload": self.payload,
+            "version": self.version,
+        }
@@ -1,36 +1,72 @@
-from fastapi import APIRouter, Depends
+from typing import Literal, Optional
+from fastapi import APIRouter, Depends, Query, Request
 from ..controllers import archive
-import os
 
 router = APIRouter(tags=["archive"])
 
 
 # Schema archives
 @router.get("/archive/schema/{version}")
-async def get_schema_archive_list(version: str):
-    return await archive.get_schema_archive_list(version)
+async def get_schema_archive_list(
+    version: str,
+    start: Optional[int] = Query(None, alias="from"),
+    end: Optional[int] = Query(None, alias="to"),
+    limit: Optional[int] = Query(None, ge=1),
+    cursor: Optional[int] = None,
+):
+    return await archive.get_schema_archive_list(version, start, end, limit, cursor)
 
 
 @router.get("/archive/schema/{version}/{timestamp}")
-async def get_specific_schema_archive(timestamp: int, version: str):
-    return await archive.get_specific_schema_archive(timestamp, version)
+async def get_specific_schema_archive(
+    timestamp: int,
+    version: str,
+    request: Request,
+    stream: Optional[Literal["json", "ndjson"]] = None,
+):
+    return await archive.get_specific_schema_archive(
+        timestamp, version, stream, request
+    )
+
+
+@router.get("/archive/schema/{version}/at/{timestamp}")
+async def find_schema_archive(timestamp: int, version: str):
+    return await archive.find_schema_archive(timestamp, version)
 
 
 # State archives
+@router.get("/archive/state/{version}")
+async def get_state_archive_list(
+    version: str,
+    start: Optional[int] = Query(None, alias="from"),
+    end: Optional[int] = Query(None, alias="to"),
+    limit: Optional[int] = Query(None, ge=1),
+    cursor: Optional[int] = None,
+):
+    return await archive.get_state_archive_list(version, start, end, limit, cursor)
+
+
 @router.get("/archive/state/{version}/{timestamp}")
-async def get_specific_state_archive(timestamp: int, version: str):
-    return await archive.get_specific_state_archive(timestamp, version)
+async def get_specific_state_archive(
+    timestamp: int,
+    version: str,
+    request: Request,
+    stream: Optional[Literal["json", "ndjson"]] = None,
+):
+    return await archive.get_specific_state_archive(timestamp, version, stream, request)
+
+
+@router.get("/archive/state/{version}/at/{timestamp}")
+async def find_state_archive(timestamp: int, version: str):
+    return await archive.find_state_archive(timestamp, version)
+
+
+# Schema and state at any point in time
+@router.get("/archive/asof/{version}/{timestamp}")
+async def get_graphs_as_of(timestamp: int, version: str):
+    return await archive.get_graphs_as_of(timestamp, version)
 
 
 @router.get("/versions")
 async def get_versions():
-    base_path = os.environ.get("LIVESTATE_PATH", "/app/data/livestate")
-    try:
-        versions = [
-            d
-            for d in os.listdir(base_path)
-            if os.path.isdir(os.path.join(base_path, d))
-        ]
-        return {"versions": versions}
-    except FileNotFoundError:
-        return {"versions": []}
+    return await archive.get_versions()
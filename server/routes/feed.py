@@ -0,0 +1,17 @@
+from typing import Optional
+from fastapi import APIRouter, Header
+from ..controllers import feed
+
+router = APIRouter(tags=["feed"])
+
+
+@router.get("/feed/{version}")
+async def get_change_feed(
+    version: str,
+    since: Optional[int] = None,
+    last_event_id: Optional[int] = Header(None),
+):
+    # Browsers reconnect with the id of the last event they received
+    if since is None:
+        since = last_event_id
+    return await feed.stream_changes(version, since)
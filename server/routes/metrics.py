@@ -0,0 +1,10 @@
+from fastapi import APIRouter
+from ..controllers import metrics
+
+router = APIRouter(tags=["metrics"])
+
+
+# Prometheus scrape target
+@router.get("/metrics")
+async def get_metrics():
+    return await metrics.get_metrics()
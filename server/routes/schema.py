@@ -1,15 +1,80 @@
-from fastapi import APIRouter
+from typing import Literal, Optional
+from fastapi import APIRouter, Query, Request
 from ..controllers import schema
 from ..models.change import Change
 
 router = APIRouter(tags=["schema"])
 
+# Deepest neighborhood a single request may ask for
+MAX_QUERY_HOPS = 10
+
 
 @router.get("/schema/live/{version}")
-async def get_live_schema(version: str):
-    return await schema.get_live_schema(version)
+async def get_live_schema(version: str, request: Request):
+    return await schema.get_live_schema(version, request)
+
+
+@router.get("/schema/live/{version}/diff")
+async def get_live_schema_diff(
+    version: str,
+    since: Optional[int] = None,
+    since_timestamp: Optional[int] = None,
+):
+    return await schema.get_live_schema_diff(version, since, since_timestamp)
 
 
 @router.post("/schema/live/update")
 async def update_live_schema(update: Change):
     return await schema.queue_live_schema_update(update)
+
+
+@router.post("/schema/live/update/bulk")
+async def update_live_schema_bulk(request: Request):
+    return await schema.queue_live_schema_updates(request)
+
+
+# Subgraph queries over the live schema
+@router.get("/schema/live/{version}/nodes/{node_id}")
+async def get_schema_node(
+    version: str, node_id: str, relationship_type: Optional[str] = None
+):
+    return await schema.query_live_schema(
+        version, node_id, hops=1, relationship_type=relationship_type
+    )
+
+
+@router.get("/schema/live/{version}/nodes/{node_id}/neighborhood")
+async def get_schema_neighborhood(
+    version: str,
+    node_id: str,
+    hops: int = Query(1, ge=1, le=MAX_QUERY_HOPS),
+    direction: Literal["out", "in", "both"] = "both",
+    relationship_type: Optional[str] = None,
+):
+    return await schema.query_live_schema(
+        version, node_id, hops, direction, relationship_type
+    )
+
+
+@router.get("/schema/live/{version}/nodes/{node_id}/descendants")
+async def get_schema_descendants(
+    version: str,
+    node_id: str,
+    max_depth: Optional[int] = Query(None, ge=1),
+    relationship_type: Optional[str] = None,
+):
+    return await schema.query_live_schema(
+        version, node_id, max_depth, "out", relationship_type
+    )
+
+
+@router.get("/schema/live/{version}/nodes/{node_id}/ancestors")
+async def get_schema_ancestors(
+    version: str,
+    node_id: str,
+    max_depth: Optional[int] = Query(None, ge=1),
+    relationship_type: Optional[str] = None,
+):
+    return await schema.query_live_schema(
+        version, node_id, max_depth, "in", relationship_type
+    )
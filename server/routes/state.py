@@ -1,4 +1,5 @@
-from fastapi import APIRouter, Depends
+from typing import Literal, Optional
+from fastapi import APIRouter, Depends, Request
 from ..controllers import state
 from ..models.change import Change
 
@@ -6,10 +7,37 @@ router = APIRouter(tags=["state"])
 
 
 @router.get("/state/live/{version}")
-async def get_live_state(version: str):
-    return await state.get_live_state(version)
+async def get_live_state(
+    version: str, request: Request, stream: Optional[Literal["json", "ndjson"]] = None
+):
+    return await state.get_live_state(version, request, stream)
+
+
+@router.get("/state/live/{version}/diff")
+async def get_live_state_diff(
+    version: str,
+    since: Optional[int] = None,
+    since_timestamp: Optional[int] = None,
+):
+    return await state.get_live_state_diff(version, since, since_timestamp)
+
+
+# Instance counts per schema node and type, rolled up the schema edges
+@router.get("/state/live/{version}/inventory")
+async def get_live_inventory(version: str, verify: bool = False):
+    return await state.get_live_inventory(version, verify=verify)
+
+
+@router.get("/state/live/{version}/inventory/{node_id}")
+async def get_live_node_inventory(version: str, node_id: str):
+    return await state.get_live_inventory(version, node_id)
 
 
 @router.post("/state/live/update")
 async def update_live_state(update: Change):
     return await state.queue_live_state_update(update)
+
+
+@router.post("/state/live/update/bulk")
+async def update_live_state_bulk(request: Request):
+    return await state.queue_live_state_updates(request)
@@ -0,0 +1,183 @@
+import asyncio
+import json
+import logging
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+# Resolved on use: importing the worker package imports server.config, which
+# may happen while this module is itself being imported
+import workers
+from ..config import (
+    CHANGE_FEED_BACKEND,
+    CHANGE_FEED_BUFFER,
+    CHANGE_FEED_CHANNEL,
+    CHANGE_FEED_HISTORY,
+    async_redis_client,
+)
+
+logger = logging.getLogger(__name__)
+
+# Queued in place of the changes a subscriber fell too far behind to receive
+RESYNC = None
+
+# How long the redis listener waits before subscribing again after an error
+RESUBSCRIBE_SECONDS = 1
+
+
+class Subscription:
+    """Changes of one version waiting to be sent to one client"""
+
+    def __init__(self, version: str, buffer_size: int):
+        self.version = version
+        self.queue: "asyncio.Queue[Optional[Dict[str, Any]]]" = asyncio.Queue(
+            maxsize=max(1, buffer_size)
+        )
+        self.overflows = 0
+
+    def put(self, message: Dict[str, Any]) -> None:
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # Drop everything buffered rather than block the hub or grow
+            # without bound; the client resyncs with a diff instead
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC)
+            self.overflows += 1
+
+
+class ChangeFeedHub:
+    """
+    Fans the changes committed by the workers out to feed subscribers.
+
+    With the "local" backend the hub listens to the worker of its own process,
+    with "redis" it subscribes to the channels the workers publish on, so
+    every replica sees every change. Changes are delivered on the event loop
+    to a bounded queue per subscriber; a subscriber whose queue fills up gets
+    a resync marker in place of what it missed. The last ``history_size``
+    changes of each version are kept so clients can resume after a seq.
+    """
+
+    def __init__(
+        self,
+        backend: str = "local",
+        channel: str = "changes",
+        history_size: int = 1000,
+        buffer_size: int = 1000,
+    ):
+        self._backend = backend
+        self._channel = channel
+        self._history_size = max(1, history_size)
+        self._buffer_size = buffer_size
+        self._history: Dict[str, Deque[Dict[str, Any]]] = {}
+        self._subscribers: Dict[str, Set[Subscription]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._listener: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        if self._loop is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        if self._backend == "redis":
+            self._listener = asyncio.create_task(self._listen())
+        else:
+            workers.change_listeners.append(self.publish)
+        logger.info(f"Started change feed with the {self._backend} backend")
+
+    async def stop(self) -> None:
+        if self.publish in workers.change_listeners:
+            workers.change_listeners.remove(self.publish)
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        self._loop = None
+
+    def publish(self, messages: List[Dict[str, Any]]) -> None:
+        """Deliver committed changes; safe to call from any thread"""
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        loop.call_soon_threadsafe(self._dispatch, messages)
+
+    def subscribe(
+        self, version: str, since: Optional[int] = None
+    ) -> Tuple[Subscription, List[Optional[Dict[str, Any]]]]:
+        """
+        Register a subscriber of a version. Returns the subscription and what
+        to send before its queued changes: the kept changes after since, or a
+        resync marker if changes after since are no longer kept.
+        """
+        subscription = Subscription(version, self._buffer_size)
+        self._subscribers.setdefault(version, set()).add(subscription)
+        if since is None:
+            return subscription, []
+
+        history = self._history.get(version, ())
+        latest = history[-1]["seq"] if history else None
+        live = workers.graph_store.peek(version)
+        if live is not None and (latest is None or live.generation > latest):
+            latest = live.generation
+        if latest is None or since >= latest:
+            return subscription, []
+        if not history or history[0]["seq"] > since + 1:
+            return subscription, [RESYNC]
+        return subscription, [m for m in history if m["seq"] > since]
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        subscribers = self._subscribers.get(subscription.version)
+        if subscribers is None:
+            return
+        subscribers.discard(subscription)
+        if not subscribers:
+            del self._subscribers[subscription.version]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "subscribers": sum(len(s) for s in self._subscribers.values()),
+            "versions": len(self._history),
+        }
+
+    def _dispatch(self, messages: List[Dict[str, Any]]) -> None:
+        for message in messages:
+            version = message["version"]
+            history = self._history.get(version)
+            if history is None:
+                history = self._history[version] = deque(maxlen=self._history_size)
+            history.append(message)
+            for subscription in self._subscribers.get(version, ()):
+                subscription.put(message)
+
+    async def _listen(self) -> None:
+        while True:
+            pubsub = async_redis_client.pubsub()
+            try:
+                await pubsub.psubscribe(f"{self._channel}:*")
+                async for item in pubsub.listen():
+                    if item.get("type") != "pmessage":
+                        continue
+                    try:
+                        self._dispatch(json.loads(item["data"]))
+                    except (ValueError, KeyError, TypeError) as e:
+                        logger.error(f"Invalid change feed message: {str(e)}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error listening for changes on redis: {str(e)}")
+                await asyncio.sleep(RESUBSCRIBE_SECONDS)
+            finally:
+                try:
+                    await pubsub.close()
+                except Exception:
+                    pass
+
+
+change_feed = ChangeFeedHub(
+    backend=CHANGE_FEED_BACKEND,
+    channel=CHANGE_FEED_CHANNEL,
+    history_size=CHANGE_FEED_HISTORY,
+    buffer_size=CHANGE_FEED_BUFFER,
+)
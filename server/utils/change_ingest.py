@@ -0,0 +1,121 @@
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import JSONResponse
+from pydantic import ValidationError
+from starlette.concurrency import run_in_threadpool
+
+from ..config import CHANGE_BULK_MAX_ITEMS, CHANGE_BULK_PUSH_CHUNK, async_redis_client
+from ..models.change import Change
+
+NDJSON_CONTENT_TYPES = (
+    "application/x-ndjson",
+    "application/ndjson",
+    "application/jsonl",
+)
+
+
+class BulkParseError(ValueError):
+    pass
+
+
+def _validation_message(error: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(loc) for loc in e['loc']) or 'change'}: {e['msg']}"
+        for e in error.errors()
+    )
+
+
+def parse_changes(body: bytes, ndjson: bool) -> List[Tuple[Any, Optional[str]]]:
+    """
+    Split a request body into items, each paired with a decoding error or
+    None. A JSON array is one item per element, NDJSON one per non-empty line.
+    """
+    if ndjson:
+        items = []
+        for line in body.splitlines():
+            if not line.strip():
+                continue
+            try:
+                items.append((json.loads(line), None))
+            except (json.JSONDecodeError, UnicodeDecodeError) as e:
+                items.append((None, f"Invalid JSON: {str(e)}"))
+    else:
+        try:
+            data = json.loads(body)
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            raise BulkParseError(f"Invalid JSON: {str(e)}")
+        if not isinstance(data, list):
+            raise BulkParseError("Request body must be a JSON array of changes")
+        items = [(item, None) for item in data]
+
+    if len(items) > CHANGE_BULK_MAX_ITEMS:
+        raise BulkParseError(
+            f"At most {CHANGE_BULK_MAX_ITEMS} changes are accepted per request"
+        )
+    return items
+
+
+def validate_changes(
+    items: List[Tuple[Any, Optional[str]]]
+) -> Tuple[List[str], List[Dict[str, Any]]]:
+    """
+    Validate decoded items against the Change model. Returns the encoded queue
+    entries of the valid ones and a result per item in submitted order.
+    """
+    encoded = []
+    results = []
+    for index, (item, error) in enumerate(items):
+        if error is None and not isinstance(item, dict):
+            error = "Change must be a JSON object"
+        if error is None:
+            try:
+                change = Change(**item)
+            except ValidationError as e:
+                error = _validation_message(e)
+
+        if error is None:
+            encoded.append(json.dumps(change.to_dict()))
+            results.append({"index": index, "status": "accepted"})
+        else:
+            results.append({"index": index, "status": "rejected", "error": error})
+    return encoded, results
+
+
+def _decode_and_validate(body: bytes, ndjson: bool):
+    return validate_changes(parse_changes(body, ndjson))
+
+
+async def enqueue_changes(encoded: List[str]) -> None:
+    """Append changes to the queue in order with a single round trip"""
+    if not encoded:
+        return
+    async with async_redis_client.pipeline(transaction=False) as pipe:
+        for start in range(0, len(encoded), CHANGE_BULK_PUSH_CHUNK):
+            pipe.rpush("changes", *encoded[start : start + CHANGE_BULK_PUSH_CHUNK])
+        await pipe.execute()
+
+
+async def queue_bulk_changes(request: Request):
+    """
+    Queue the changes of a JSON array or NDJSON request body. Invalid items are
+    rejected individually, the valid ones are queued in submitted order.
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    body = await request.body()
+
+    # Decoding and validating large bodies is kept off the event loop
+    try:
+        encoded, results = await run_in_threadpool(
+            _decode_and_validate, body, content_type in NDJSON_CONTENT_TYPES
+        )
+    except BulkParseError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+
+    await enqueue_changes(encoded)
+    return {
+        "accepted": len(encoded),
+        "rejected": len(results) - len(encoded),
+        "results": results,
+    }
@@ -0,0 +1,61 @@
+import time
+
+from utils.metrics import counter, histogram
+
+# Other methods are counted as "other", they come from clients
+HTTP_METHODS = ("GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS")
+
+request_seconds = histogram(
+    "graph_server_http_request_seconds",
+    "Time from receiving a request to sending its response headers, by route",
+    ("method", "route", "status"),
+)
+requests_started = counter(
+    "graph_server_http_requests_started_total",
+    "Requests received, by method",
+    ("method",),
+)
+
+
+class RequestMetricsMiddleware:
+    """
+    Times every HTTP request up to the start of its response and labels it
+    with the path template of the route it matched, so the paths of versions
+    and timestamps do not add label values. Streamed bodies, the change feed
+    above all, are not waited for.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"] if scope["method"] in HTTP_METHODS else "other"
+        requests_started.labels(method).inc()
+        started = time.perf_counter()
+        observed = False
+
+        def observe(status) -> None:
+            nonlocal observed
+            observed = True
+            route = scope.get("route")
+            request_seconds.labels(
+                method,
+                getattr(route, "path", None) or "unmatched",
+                status,
+            ).observe(time.perf_counter() - started)
+
+        async def send_observed(message):
+            if message["type"] == "http.response.start" and not observed:
+                observe(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_observed)
+        except Exception:
+            if not observed:
+                observe(500)
+            raise
@@ -0,0 +1,325 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from fastapi import Request, Response
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+
+from utils.archive import (
+    SNAPSHOT_SUFFIX,
+    archive_file,
+    load_archive,
+    read_graph_file,
+)
+from utils.encoding import (
+    CONTENT_CODINGS,
+    encode_content,
+    encode_stream,
+    negotiate_encoding,
+)
+from workers.instance_store import InstanceStore, node_link_data
+
+# Resolved on use: importing the worker package imports server.config, which
+# may happen while this module is itself being imported
+import workers
+from ..config import (
+    ARCHIVE_RESPONSE_CACHE_MAX_ENTRIES,
+    COMPRESSION_MIN_BYTES,
+    RESPONSE_CACHE_MAX_ENTRIES,
+)
+
+
+class CachedResponse:
+    """
+    Encoded JSON body of a live graph or an archive and its validators. The
+    body compressed with a content coding is produced on the first request
+    accepting it and kept with the entry.
+    """
+
+    def __init__(
+        self,
+        content: bytes,
+        etag: str,
+        modified_at: float,
+        seq: Optional[int] = None,
+        stat_key: Optional[Tuple[int, int]] = None,
+    ):
+        self.content = content
+        self.etag = etag
+        self.modified_at = int(modified_at)
+        self.last_modified = formatdate(self.modified_at, usegmt=True)
+        # Change the body reflects when encoded from memory, file state otherwise
+        self.seq = seq
+        self.stat_key = stat_key
+        self._encoded: Dict[str, bytes] = {}
+        self._encode_lock = threading.Lock()
+
+    def compressible(self) -> bool:
+        return len(self.content) >= COMPRESSION_MIN_BYTES
+
+    def is_encoded(self, coding: str) -> bool:
+        return coding in self._encoded
+
+    def encoded(self, coding: str) -> bytes:
+        """The body compressed with a content coding, compressed at most once"""
+        encoded = self._encoded.get(coding)
+        if encoded is not None:
+            return encoded
+        with self._encode_lock:
+            encoded = self._encoded.get(coding)
+            if encoded is None:
+                encoded = self._encoded[coding] = encode_content(self.content, coding)
+        return encoded
+
+    def etag_for(self, coding: Optional[str]) -> str:
+        # A compressed body is a different representation, so it gets its own
+        # strong validator
+        if coding is None:
+            return self.etag
+        return f'{self.etag[:-1]}-{coding}"'
+
+
+class ResponseCache:
+    """
+    Encoded live schema and state responses, one per version and graph.
+
+    Versions resident in the graph store are encoded from the in-memory graphs
+    and tagged with the WAL seq of the last change they contain. The worker
+    publishes a new generation after each batch, and an entry stays current
+    until a generation past its seq is published, so unchanged polls neither
+    touch the graphs nor encode them again. Versions that are not resident are
+    served from their live file and tagged with its modification time.
+    """
+
+    def __init__(self, max_entries: int = 32):
+        self._max_entries = max(1, max_entries)
+        self._entries: "OrderedDict[Tuple[str, str], CachedResponse]" = OrderedDict()
+        self._encode_locks: Dict[Tuple[str, str], threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def lookup(self, version: str, name: str) -> Optional[CachedResponse]:
+        """
+        Return the cached response of a resident version if it is current.
+        Never blocks on I/O or on the worker, so it is safe on the event loop.
+        """
+        live = workers.graph_store.peek(version)
+        if live is None:
+            return None
+        with self._lock:
+            entry = self._entries.get((version, name))
+            if entry is None or entry.seq is None:
+                return None
+            if not live.generation <= entry.seq <= live.seq:
+                return None
+            self._entries.move_to_end((version, name))
+            return entry
+
+    def load(
+        self, version: str, name: str, file_path: Callable[[str], str]
+    ) -> Optional[CachedResponse]:
+        """
+        Return the current response, encoding it when the cached one is stale.
+        None if the version is not resident and has no live file.
+        """
+        key = (version, name)
+        with self._lock:
+            encode_lock = self._encode_locks.setdefault(key, threading.Lock())
+
+        # Concurrent requests for a stale entry wait for a single encode
+        with encode_lock:
+            entry = self.lookup(version, name)
+            if entry is not None:
+                return entry
+
+            live = workers.graph_store.peek(version)
+            if live is not None:
+                entry = self._encode_live(live, name)
+            else:
+                entry = self._read_file(version, name, file_path(version))
+
+            with self._lock:
+                if entry is None:
+                    self._entries.pop(key, None)
+                    return None
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                while len(self._entries) > self._max_entries:
+                    self._entries.popitem(last=False)
+            return entry
+
+    def _encode_live(self, live, name: str) -> CachedResponse:
+        # Snapshot under the lock, encode outside so the worker is not held up
+        with live.lock:
+            if name == "schema":
+                data = node_link_data(live.schema)
+            else:
+                # Rendered after the lock is released
+                data = live.state.copy()
+            seq = live.seq
+            modified_at = live.modified_at
+
+        if isinstance(data, InstanceStore):
+            data = data.node_link_data()
+        return CachedResponse(
+            content=json.dumps(data).encode(),
+            etag=f'"{live.version}-{name}-{seq}"',
+            modified_at=modified_at,
+            seq=seq,
+        )
+
+    def _read_file(
+        self, version: str, name: str, path: str
+    ) -> Optional[CachedResponse]:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+
+        stat_key = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            entry = self._entries.get((version, name))
+        if entry is not None and entry.stat_key == stat_key:
+            return entry
+
+        try:
+            if path.endswith(SNAPSHOT_SUFFIX):
+                content = json.dumps(read_graph_file(path)).encode()
+            else:
+                with open(path, "rb") as f:
+                    content = f.read()
+        except FileNotFoundError:
+            return None
+        if not content.strip():
+            return None
+
+        return CachedResponse(
+            content=content,
+            etag=f'"{version}-{name}-f{stat.st_mtime_ns:x}-{stat.st_size:x}"',
+            modified_at=stat.st_mtime,
+            stat_key=stat_key,
+        )
+
+
+class ArchiveResponseCache:
+    """
+    Encoded archive responses, one per archive directory and timestamp, least
+    recently used first out. An entry is checked against the size and
+    modification time of the archive file, as live files are.
+    """
+
+    def __init__(self, max_entries: int = 16):
+        self._max_entries = max(1, max_entries)
+        self._entries: "OrderedDict[Tuple[str, int], CachedResponse]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, directory: str, timestamp: int) -> Optional[CachedResponse]:
+        """The archive at a timestamp, encoded, None if there is none"""
+        path = archive_file(directory, timestamp)
+        if path is None:
+            return None
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+
+        key = (directory, timestamp)
+        stat_key = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.stat_key == stat_key:
+                self._entries.move_to_end(key)
+                return entry
+
+        archive = load_archive(directory, timestamp)
+        if archive is None:
+            return None
+        entry = CachedResponse(
+            content=json.dumps(archive).encode(),
+            etag=f'"{timestamp}-f{stat.st_mtime_ns:x}-{stat.st_size:x}"',
+            modified_at=stat.st_mtime,
+            stat_key=stat_key,
+        )
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+
+def is_not_modified(request: Optional[Request], entry: CachedResponse) -> bool:
+    """Evaluate If-None-Match, or If-Modified-Since when it is absent"""
+    if request is None:
+        return False
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        # A tag of any coding of the body validates it, the body is the same
+        etags = {entry.etag_for(coding) for coding in (None,) + CONTENT_CODINGS}
+        return "*" in tags or any(
+            (tag[2:] if tag.startswith("W/") else tag) in etags for tag in tags
+        )
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return entry.modified_at <= since
+    return False
+
+
+async def cached_json_response(
+    request: Optional[Request], entry: CachedResponse
+) -> Response:
+    coding = None
+    if request is not None and entry.compressible():
+        coding = negotiate_encoding(request.headers.get("accept-encoding"))
+    headers = {
+        "ETag": entry.etag_for(coding),
+        "Last-Modified": entry.last_modified,
+        # Clients may keep the body but have to revalidate it on every poll
+        "Cache-Control": "no-cache",
+        "Vary": "Accept-Encoding",
+    }
+    if is_not_modified(request, entry):
+        return Response(status_code=304, headers=headers)
+    if coding is None:
+        return Response(
+            content=entry.content, media_type="application/json", headers=headers
+        )
+
+    if not entry.is_encoded(coding):
+        # Compressed once per entry, off the event loop
+        await run_in_threadpool(entry.encoded, coding)
+    headers["Content-Encoding"] = coding
+    return Response(
+        content=entry.encoded(coding), media_type="application/json", headers=headers
+    )
+
+
+def stream_response(
+    request: Optional[Request],
+    chunks: Iterable[bytes],
+    media_type: str,
+    headers: Optional[Dict[str, str]] = None,
+) -> StreamingResponse:
+    """A streamed body, compressed chunk by chunk when the client accepts it"""
+    headers = dict(headers or {})
+    headers["Vary"] = "Accept-Encoding"
+    if request is not None:
+        coding = negotiate_encoding(request.headers.get("accept-encoding"))
+        if coding is not None:
+            chunks = encode_stream(chunks, coding)
+            headers["Content-Encoding"] = coding
+    return StreamingResponse(chunks, media_type=media_type, headers=headers)
+
+
+response_cache = ResponseCache(max_entries=RESPONSE_CACHE_MAX_ENTRIES)
+archive_cache = ArchiveResponseCache(max_entries=ARCHIVE_RESPONSE_CACHE_MAX_ENTRIES)
@@ -0,0 +1,81 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The worker creates its data directories on import, keep them out of /app/data
+_data = tempfile.mkdtemp(prefix="graph-server-tests-")
+for _name in ("LIVESTATE", "STATEARCHIVE", "SCHEMAARCHIVE", "LIVESCHEMA"):
+    os.environ.setdefault(f"{_name}_PATH", os.path.join(_data, _name.lower()))
+
+
+class RecordingWriter:
+    """Stands in for write_to_postgres, raising while ``fail`` is set"""
+
+    def __init__(self):
+        self.rows = []
+        self.fail = False
+
+    def __call__(self, rows):
+        if self.fail:
+            raise ConnectionError("postgres is down")
+        self.rows.extend(rows)
+
+    def seqs(self, version):
+        return sorted({row[1] for row in self.rows if row[0] == version})
+
+
+@pytest.fixture
+def delta_writer():
+    return RecordingWriter()
+
+
+@pytest.fixture
+def worker(tmp_path, monkeypatch, delta_writer):
+    """
+    The worker module with its data under tmp_path, an empty graph store and
+    a delta sink writing to delta_writer
+    """
+    import server.config
+    import workers
+
+    for name in ("LIVESTATE", "STATEARCHIVE", "SCHEMAARCHIVE", "LIVESCHEMA"):
+        monkeypatch.setattr(server.config, f"BASE_{name}_PATH", str(tmp_path / name))
+    monkeypatch.setattr(workers, "delta_sink", _new_delta_sink(delta_writer))
+    monkeypatch.setattr(workers, "graph_store", _new_graph_store(workers))
+    return workers
+
+
+@pytest.fixture
+def crash_worker(worker, monkeypatch):
+    """
+    Drop the resident versions and the delta rows of the worker without
+    writing them, as a crash does, and restart it with an empty graph store
+    and a delta sink writing to the RecordingWriter returned
+    """
+
+    def crash():
+        for live in worker.graph_store.entries():
+            live.wal.close()
+        writer = RecordingWriter()
+        # The old sink keeps failing on the old writer, its rows are lost
+        monkeypatch.setattr(worker, "delta_sink", _new_delta_sink(writer))
+        monkeypatch.setattr(worker, "graph_store", _new_graph_store(worker))
+        return writer
+
+    return crash
+
+
+def _new_delta_sink(writer):
+    from workers.delta_sink import DeltaSink
+
+    return DeltaSink(writer, flush_interval_ms=10, retry_seconds=0.01)
+
+
+def _new_graph_store(workers):
+    from workers.graph_store import GraphStore
+
+    return GraphStore(loader=workers.load_version, on_evict=workers.close_live_graphs)
@@ -0,0 +1,127 @@
+import json
+import os
+
+import pytest
+
+import workers.checkpoint
+from workers.checkpoint import checkpoint_path
+
+
+def create(node_id, timestamp, **properties):
+    return {
+        "action": "create",
+        "type": "schema",
+        "timestamp": timestamp,
+        "payload": {"node_id": node_id, "node_type": "Part", "properties": properties},
+        "version": "v",
+    }
+
+
+def checkpoint(worker):
+    live = worker.graph_store.get("v")
+    assert worker.checkpointer.checkpoint(live, worker.get_paths("v"))
+    worker.checkpointer.flush()
+
+
+def read_checkpoint(worker):
+    with open(checkpoint_path(worker.get_paths("v"))) as f:
+        return json.load(f)
+
+
+def live_files(worker):
+    paths = worker.get_paths("v")
+    return sorted(
+        name
+        for key in ("LIVESCHEMA_PATH", "LIVESTATE_PATH")
+        for name in os.listdir(paths[key])
+        if name.startswith("current_")
+    )
+
+
+@pytest.fixture
+def binary(worker, monkeypatch):
+    monkeypatch.setattr(worker, "SNAPSHOT_FORMAT", "binary")
+    return worker
+
+
+def test_checkpoint_points_at_the_live_files(binary, crash_worker):
+    binary.process_change_batch([create("A", 1, units_in_chain=2)])
+    checkpoint(binary)
+    binary.process_change_batch([create("B", 2, units_in_chain=3)])
+
+    data = read_checkpoint(binary)
+    assert data["seq"] == 1
+    assert data["timestamp"] == 1
+    assert "schema" not in data and "state" not in data
+    assert data["files"]["state"]["file"] == "current_state.snap"
+    assert live_files(binary) == ["current_schema.snap", "current_state.snap"]
+
+    crash_worker()
+    live = binary.graph_store.get("v")
+    assert live.seq == 2
+    assert live.current_timestamp == 2
+    assert sorted(live.schema.nodes) == ["A", "B"]
+    assert live.state.counts_by_type("A") == {"Part": 2}
+    assert len(live.state) == 5
+
+
+def test_staged_files_are_moved_into_place_on_load(binary, crash_worker, monkeypatch):
+    binary.process_change_batch([create("A", 1, units_in_chain=2)])
+    checkpoint(binary)
+    # Crash once the checkpoint file is written, before the files are moved
+    monkeypatch.setattr(workers.checkpoint, "finish_checkpoint", lambda *args: None)
+    binary.process_change_batch([create("B", 2)])
+    checkpoint(binary)
+    assert "current_schema.2.snap" in live_files(binary)
+
+    crash_worker()
+    live = binary.graph_store.get("v")
+    assert live.seq == 2
+    assert sorted(live.schema.nodes) == ["A", "B"]
+    assert live_files(binary) == ["current_schema.snap", "current_state.snap"]
+
+
+def test_unrecorded_checkpoint_leaves_the_previous_one(
+    binary, crash_worker, monkeypatch
+):
+    binary.process_change_batch([create("A", 1)])
+    checkpoint(binary)
+
+    # Crash before the checkpoint file of the next checkpoint is written
+    def crash(*args, **kwargs):
+        raise OSError("crashed")
+
+    monkeypatch.setattr(binary.checkpointer, "_write_json", crash)
+    binary.process_change_batch([create("B", 2)])
+    checkpoint(binary)
+
+    assert "current_schema.2.snap" in live_files(binary)
+
+    crash_worker()
+    live = binary.graph_store.get("v")
+    assert read_checkpoint(binary)["seq"] == 1
+    assert live.seq == 2
+    assert sorted(live.schema.nodes) == ["A", "B"]
+    assert live_files(binary) == ["current_schema.snap", "current_state.snap"]
+
+
+def test_checkpoints_holding_the_graphs_still_load(worker, crash_worker):
+    worker.process_change_batch([create("A", 1, units_in_chain=2)])
+    live = worker.graph_store.get("v")
+    crash_worker()
+    with open(checkpoint_path(worker.get_paths("v")), "w") as f:
+        json.dump(
+            {
+                "seq": 1,
+                "timestamp": 1,
+                "modified_at": None,
+                "schema": worker.node_link_data(live.schema),
+                "state": live.state.node_link_data(),
+            },
+            f,
+        )
+
+    live = worker.graph_store.get("v")
+    assert live.seq == 1
+    assert list(live.schema.nodes) == ["A"]
+    assert len(live.state) == 2
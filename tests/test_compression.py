@@ -0,0 +1,112 @@
+import pytest
+
+from utils.compression import (
+    compress_graph_json,
+    decode_snapshot,
+    decompress_graph_json,
+    encode_snapshot,
+    read_snapshot,
+    read_snapshot_graph,
+)
+from workers.instance_store import InstanceStore
+
+
+def graph_data(nodes, edges=()):
+    return {
+        "directed": True,
+        "multigraph": False,
+        "graph": {"name": "g"},
+        "nodes": nodes,
+        "edges": list(edges),
+    }
+
+
+def typed(value):
+    return type(value), value
+
+
+SCHEMA = graph_data(
+    [
+        {"node_type": "Part", "id": "P1", "units_in_chain": 3, "weight": 1.5},
+        {"node_type": "Part", "id": "P2", "units_in_chain": 4, "weight": 2.0},
+        {"node_type": "Facility", "id": "F", "tags": ["a", "b"]},
+    ],
+    [
+        {"relationship_type": "in", "source": "P1", "target": "F"},
+        {"source": "P2", "target": "F", "relationship_type": "in", "since": 7},
+    ],
+)
+
+
+def test_compress_round_trip():
+    assert decompress_graph_json(compress_graph_json(SCHEMA)) == SCHEMA
+
+
+def test_equal_values_of_different_types_are_not_collapsed():
+    values = [1, True, 1.0]
+    data = graph_data(
+        [{"node_type": "X", "id": i, "v": v} for i, v in enumerate(values)]
+    )
+    for decoded in (
+        decompress_graph_json(compress_graph_json(data)),
+        decode_snapshot(encode_snapshot(data, "none")),
+    ):
+        assert [typed(node["v"]) for node in decoded["nodes"]] == [
+            typed(v) for v in values
+        ]
+
+
+def test_equal_mutable_values_are_not_shared():
+    data = graph_data([{"node_type": "X", "id": i, "tags": ["a"]} for i in range(3)])
+    for decoded in (
+        decompress_graph_json(compress_graph_json(data)),
+        decode_snapshot(encode_snapshot(data, "zlib")),
+    ):
+        decoded["nodes"][0]["tags"].append("b")
+        assert [node["tags"] for node in decoded["nodes"]] == [["a", "b"], ["a"], ["a"]]
+
+
+def test_mutable_consts_of_older_layouts_are_copied():
+    layout = compress_graph_json(graph_data([{"node_type": "X", "id": 1}]))
+    layout["node_groups"] = [
+        {
+            "keys": ["node_type", "id", "tags"],
+            "columns": [
+                {"const": "X", "count": 2},
+                [1, 2],
+                {"const": ["a"], "count": 2},
+            ],
+        }
+    ]
+    layout["node_order"] = [[0, 2]]
+    nodes = decompress_graph_json(layout)["nodes"]
+    nodes[0]["tags"].append("b")
+    assert nodes[1]["tags"] == ["a"]
+
+
+@pytest.mark.parametrize("codec", ["none", "zlib"])
+def test_snapshot_round_trip(tmp_path, codec):
+    path = tmp_path / "schema.snap"
+    path.write_bytes(encode_snapshot(SCHEMA, codec))
+    assert read_snapshot(str(path)) == SCHEMA
+
+    graph = read_snapshot_graph(str(path))
+    assert graph.graph == {"name": "g"}
+    assert graph.nodes["P2"] == {
+        "node_type": "Part",
+        "units_in_chain": 4,
+        "weight": 2.0,
+    }
+    assert graph.edges["P2", "F"] == {"relationship_type": "in", "since": 7}
+
+
+def test_snapshot_of_a_state_round_trip(tmp_path):
+    state = InstanceStore()
+    state.add("P1", "Part", 3, 10, valid_to=20)
+    state.add("P2", None, 2, 11)
+    state.remove_oldest("P1", 1)
+    data = state.node_link_data()
+
+    path = tmp_path / "state.snap"
+    path.write_bytes(encode_snapshot(data, "none"))
+    assert read_snapshot(str(path)) == data
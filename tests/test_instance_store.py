@@ -0,0 +1,93 @@
+import pytest
+
+from workers.instance_store import InstanceStore, node_link_data
+from workers.transaction import GraphTransaction
+
+
+def instances(store):
+    return node_link_data(store)["nodes"]
+
+
+def round_trip(store):
+    return InstanceStore.from_node_link_data(node_link_data(store))
+
+
+@pytest.fixture
+def store():
+    store = InstanceStore()
+    store.add("P1", "unit", 3, created_at=10)
+    store.add("P2", "unit", 2, created_at=5, valid_to=20)
+    store.add("P1", "pallet", 2, created_at=12, valid_from=11, valid_to=30)
+    return store
+
+
+def test_add_round_trips_through_node_link_data(store):
+    data = node_link_data(store)
+    assert data["edges"] == []
+    assert [n["id"] for n in data["nodes"]] == [1, 2, 3, 4, 5, 6, 7]
+    assert data["nodes"][3] == {
+        "parent_id": "P2",
+        "type": "unit",
+        "created_at": 5,
+        "valid_to": 20,
+        "id": 4,
+    }
+
+    loaded = round_trip(store)
+    assert instances(loaded) == data["nodes"]
+    assert loaded.count("P1") == 5
+    assert loaded.counts_by_type("P1") == {"unit": 3, "pallet": 2}
+    # New instances continue after the loaded ids
+    assert loaded.add("P2", "unit", 1, created_at=40).tolist() == [8]
+
+
+def test_remove_oldest_round_trips(store):
+    assert store.remove_oldest("P1", 4).tolist() == [1, 2, 3, 6]
+    assert store.count("P1") == 1
+
+    loaded = round_trip(store)
+    assert instances(loaded) == instances(store)
+    assert [n["id"] for n in instances(loaded)] == [4, 5, 7]
+    assert loaded.remove_oldest("P1", 5).tolist() == [7]
+
+
+def test_expire_round_trips(store):
+    assert store.next_expiry() == 20
+    assert store.expire(25).tolist() == [4, 5]
+    assert store.count("P2") == 0
+
+    loaded = round_trip(store)
+    assert instances(loaded) == instances(store)
+    assert loaded.next_expiry() == 30
+    assert loaded.expire(30, limit=1).tolist() == [6]
+
+
+def test_compact_keeps_the_instances(store):
+    store.remove_oldest("P1", 2)
+    store.expire(20)
+    before = instances(store)
+
+    store.compact()
+
+    assert instances(store) == before
+    assert instances(round_trip(store)) == before
+    assert store.remove_oldest("P1", 2).tolist() == [3, 6]
+    assert store.add("P2", "unit", 1, created_at=1).tolist() == [8]
+
+
+def test_rolled_back_mutations_round_trip_unchanged(store):
+    before = node_link_data(store)
+
+    with pytest.raises(RuntimeError):
+        with GraphTransaction() as tx:
+            store.add("P3", "unit", 2, created_at=50, tx=tx)
+            store.remove_oldest("P1", 4, tx=tx)
+            store.expire(25, tx=tx)
+            raise RuntimeError("change failed")
+
+    assert instances(store) == before["nodes"]
+    assert store.count("P1") == 5
+    assert store.count("P2") == 2
+    assert store.count("P3") == 0
+    assert store.next_expiry() == 20
+    assert instances(round_trip(store)) == before["nodes"]
@@ -0,0 +1,77 @@
+import networkx as nx
+import pytest
+from networkx.readwrite import json_graph
+
+from workers.transaction import GraphTransaction
+
+
+def snapshot(graph):
+    """Nodes and edges with their attributes; a restored node is added last"""
+    data = json_graph.node_link_data(graph, edges="edges")
+    return (
+        sorted(data["nodes"], key=lambda node: node["id"]),
+        sorted(data["edges"], key=lambda edge: (edge["source"], edge["target"])),
+    )
+
+
+@pytest.fixture
+def graph():
+    graph = nx.DiGraph()
+    graph.add_node("A", node_type="Part", units=1)
+    graph.add_node("B", node_type="Part", units=2)
+    graph.add_node("C", node_type="Facility")
+    graph.add_edge("A", "B", relationship_type="in", weight=3)
+    graph.add_edge("B", "C", relationship_type="at")
+    graph.add_edge("C", "B", relationship_type="supplies")
+    return graph
+
+
+def test_rollback_of_remove_node_restores_in_and_out_edges(graph):
+    before = snapshot(graph)
+
+    tx = GraphTransaction()
+    tx.remove_node(graph, "B")
+    assert not graph.has_node("B")
+    assert graph.number_of_edges() == 0
+    tx.rollback()
+
+    assert snapshot(graph) == before
+    assert graph.edges["A", "B"] == {"relationship_type": "in", "weight": 3}
+    assert graph.nodes["B"] == {"node_type": "Part", "units": 2}
+
+
+def test_rollback_of_add_edge_removes_the_nodes_it_created(graph):
+    before = snapshot(graph)
+
+    with pytest.raises(RuntimeError):
+        with GraphTransaction() as tx:
+            tx.add_edge(graph, "A", "D", relationship_type="in")
+            tx.add_edge(graph, "E", "F")
+            assert graph.has_node("D") and graph.has_node("E")
+            raise RuntimeError("change failed")
+
+    assert snapshot(graph) == before
+    assert not any(graph.has_node(n) for n in ("D", "E", "F"))
+
+
+def test_rollback_of_add_edge_keeps_existing_endpoints(graph):
+    before = snapshot(graph)
+
+    tx = GraphTransaction()
+    tx.add_edge(graph, "A", "C", relationship_type="in")
+    tx.add_edge(graph, "A", "B", weight=5)
+    tx.rollback()
+
+    assert snapshot(graph) == before
+
+
+def test_commit_keeps_mutations_and_touched_sets(graph):
+    with GraphTransaction() as tx:
+        tx.remove_node(graph, "B")
+        tx.add_edge(graph, "A", "D")
+
+    assert not graph.has_node("B")
+    assert graph.has_edge("A", "D")
+    assert tx.touched_nodes(graph) == {"A", "B", "D"}
+    assert tx.touched_edges(graph) == {("A", "B"), ("B", "C"), ("C", "B"), ("A", "D")}
+    assert len(tx) == 0
@@ -0,0 +1,349 @@
+import bisect
+import json
+import os
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import networkx as nx
+from networkx.readwrite import json_graph
+
+from utils.compression import links_key, read_snapshot, read_snapshot_graph
+from utils.streaming import Members, iter_json_members, node_link_members, patch_members
+
+# Archives are stored as keyframes holding the full node-link graph in
+# "{timestamp}.json" (the format every archive used to have) or, as a binary
+# snapshot, in "{timestamp}.snap", and deltas holding only what changed since
+# the previous archive in "{timestamp}.delta.json".
+KEYFRAME_SUFFIX = ".json"
+SNAPSHOT_SUFFIX = ".snap"
+DELTA_SUFFIX = ".delta.json"
+GRAPH_FILE_SUFFIXES = (SNAPSHOT_SUFFIX, KEYFRAME_SUFFIX)
+
+# Every archive directory keeps an append-only timeline of its timestamps, one
+# per line, so listing archives does not have to scan the directory
+TIMELINE_FILE = "timeline.idx"
+
+
+def keyframe_path(directory: str, timestamp: int, suffix: str = KEYFRAME_SUFFIX) -> str:
+    return os.path.join(directory, f"{timestamp}{suffix}")
+
+
+def find_graph_file(base: str) -> Optional[str]:
+    """
+    Path of the graph file stored at base plus one of GRAPH_FILE_SUFFIXES,
+    the most recently written one if the format was switched. None if there
+    is none.
+    """
+    found = None
+    for suffix in GRAPH_FILE_SUFFIXES:
+        try:
+            mtime = os.stat(base + suffix).st_mtime_ns
+        except FileNotFoundError:
+            continue
+        if found is None or mtime > found[0]:
+            found = (mtime, base + suffix)
+    return found[1] if found else None
+
+
+def read_graph_file(path: str) -> Dict[str, Any]:
+    """Node-link data of a JSON or binary snapshot graph file"""
+    if path.endswith(SNAPSHOT_SUFFIX):
+        return read_snapshot(path)
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def read_graph(path: str) -> nx.DiGraph:
+    """Graph stored in a JSON or binary snapshot graph file"""
+    if path.endswith(SNAPSHOT_SUFFIX):
+        return read_snapshot_graph(path)
+    with open(path, "r") as f:
+        return json_graph.node_link_graph(json.load(f))
+
+
+def find_keyframe(directory: str, timestamp: int) -> Optional[str]:
+    return find_graph_file(os.path.join(directory, str(timestamp)))
+
+
+def delta_path(directory: str, timestamp: int) -> str:
+    return os.path.join(directory, f"{timestamp}{DELTA_SUFFIX}")
+
+
+def archive_file(directory: str, timestamp: int) -> Optional[str]:
+    """Path of the keyframe or delta archived at a timestamp, None if neither"""
+    path = find_keyframe(directory, timestamp)
+    if path is None and os.path.exists(delta_path(directory, timestamp)):
+        path = delta_path(directory, timestamp)
+    return path
+
+
+def archive_timestamp(filename: str) -> Optional[int]:
+    """Return the timestamp of an archive file name, None for other files"""
+    if not filename.endswith(GRAPH_FILE_SUFFIXES):
+        return None
+    try:
+        return int(filename.split(".")[0])
+    except ValueError:
+        return None
+
+
+def build_delta(
+    graph: nx.DiGraph,
+    base_timestamp: int,
+    nodes: Iterable[Any],
+    edges: Iterable[Tuple[Any, Any]],
+) -> Dict[str, Any]:
+    """
+    Describe the current attributes of the given nodes and edges of a graph
+    relative to the archive at base_timestamp. Nodes and edges that no longer
+    exist are recorded as removed.
+    """
+    delta = {
+        "base": base_timestamp,
+        "nodes": [],
+        "removed_nodes": [],
+        "links": [],
+        "removed_links": [],
+    }
+    for node_id in nodes:
+        if graph.has_node(node_id):
+            delta["nodes"].append({**graph.nodes[node_id], "id": node_id})
+        else:
+            delta["removed_nodes"].append(node_id)
+
+    for source, target in edges:
+        if graph.has_edge(source, target):
+            delta["links"].append(
+                {**graph.edges[source, target], "source": source, "target": target}
+            )
+        else:
+            delta["removed_links"].append([source, target])
+    return delta
+
+
+def apply_deltas(node_link_data: Dict[str, Any], deltas: List[Dict[str, Any]]) -> None:
+    """Apply deltas in order, in place, to node-link data"""
+    key = links_key(node_link_data)
+    nodes = {node["id"]: node for node in node_link_data["nodes"]}
+    links = {(link["source"], link["target"]): link for link in node_link_data[key]}
+
+    for delta in deltas:
+        for node_id in delta["removed_nodes"]:
+            nodes.pop(node_id, None)
+        for node in delta["nodes"]:
+            nodes[node["id"]] = node
+        # Edges of removed nodes are listed in removed_links as well
+        for source, target in delta["removed_links"]:
+            links.pop((source, target), None)
+        for link in delta["links"]:
+            links[(link["source"], link["target"])] = link
+
+    node_link_data["nodes"] = list(nodes.values())
+    node_link_data[key] = list(links.values())
+
+
+def load_archive(directory: str, timestamp: int) -> Optional[Dict[str, Any]]:
+    """
+    Return the node-link data archived at a timestamp, rebuilding it from the
+    nearest keyframe when the archive is a delta. None if there is no archive.
+    """
+    path = find_keyframe(directory, timestamp)
+    if path is not None:
+        return read_graph_file(path)
+
+    # Walk the delta chain back to its keyframe, then replay it forward
+    chain: List[Dict[str, Any]] = []
+    current = timestamp
+    while path is None:
+        try:
+            with open(delta_path(directory, current), "r") as f:
+                delta = json.load(f)
+        except FileNotFoundError:
+            return None
+        chain.append(delta)
+        current = delta["base"]
+        path = find_keyframe(directory, current)
+
+    node_link_data = read_graph_file(path)
+    apply_deltas(node_link_data, list(reversed(chain)))
+    # The keyframe's seq does not describe the rebuilt archive
+    node_link_data.pop("seq", None)
+    if "seq" in chain[0]:
+        node_link_data["seq"] = chain[0]["seq"]
+    return node_link_data
+
+
+def stream_graph_file(path: str) -> Members:
+    """
+    Node-link members of a graph file for a streamed response. JSON files are
+    parsed as they are sent; binary snapshots are decoded as a whole first.
+    """
+    if path.endswith(SNAPSHOT_SUFFIX):
+        return node_link_members(read_snapshot(path))
+    return iter_json_members(path)
+
+
+def stream_archive(directory: str, timestamp: int) -> Optional[Members]:
+    """
+    load_archive for a streamed response: the members of the archive at a
+    timestamp, with a delta archive's chain applied while its keyframe is
+    streamed. None if there is no archive.
+    """
+    path = find_keyframe(directory, timestamp)
+    chain: List[Dict[str, Any]] = []
+    current = timestamp
+    while path is None:
+        try:
+            with open(delta_path(directory, current), "r") as f:
+                delta = json.load(f)
+        except FileNotFoundError:
+            return None
+        chain.append(delta)
+        current = delta["base"]
+        path = find_keyframe(directory, current)
+
+    if not chain:
+        return stream_graph_file(path)
+    return patch_members(stream_graph_file(path), list(reversed(chain)))
+
+
+def timeline_path(directory: str) -> str:
+    return os.path.join(directory, TIMELINE_FILE)
+
+
+def scan_archive_timestamps(directory: str) -> List[int]:
+    timestamps = {archive_timestamp(name) for name in os.listdir(directory)}
+    timestamps.discard(None)
+    return sorted(timestamps)
+
+
+def rebuild_timeline(directory: str) -> None:
+    """Rewrite the timeline of a directory from the archives it holds"""
+    temp_path = f"{timeline_path(directory)}.tmp"
+    with open(temp_path, "w") as f:
+        f.writelines(f"{ts}\n" for ts in scan_archive_timestamps(directory))
+    os.replace(temp_path, timeline_path(directory))
+
+
+def append_to_timeline(directory: str, timestamp: int) -> None:
+    with open(timeline_path(directory), "a") as f:
+        f.write(f"{timestamp}\n")
+
+
+class ArchiveTimeline:
+    """
+    Sorted archive timestamps of a directory, read from its timeline file.
+
+    Only the lines appended since the last refresh are read, and a rewritten
+    file is detected by its inode. Directories without a timeline yet are
+    scanned, again only when their modification time changes. Lookups are
+    binary searches.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._timestamps: List[int] = []
+        self._known = set()
+        self._inode = None
+        self._offset = 0
+        self._scanned_mtime = None
+        self._lock = threading.Lock()
+
+    def refresh(self) -> None:
+        with self._lock:
+            try:
+                stat = os.stat(timeline_path(self.directory))
+            except FileNotFoundError:
+                self._scan()
+                return
+
+            if stat.st_ino != self._inode or stat.st_size < self._offset:
+                self._reset()
+                self._inode = stat.st_ino
+            if stat.st_size <= self._offset:
+                return
+
+            with open(timeline_path(self.directory), "rb") as f:
+                f.seek(self._offset)
+                data = f.read(stat.st_size - self._offset)
+            # A line still being written is read on the next refresh
+            end = data.rfind(b"\n") + 1
+            for line in data[:end].split():
+                try:
+                    self._add(int(line))
+                except ValueError:
+                    continue
+            self._offset += end
+
+    def between(
+        self,
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+        after: Optional[int] = None,
+        limit: Optional[int] = None,
+    ) -> Tuple[List[int], Optional[int]]:
+        """
+        Timestamps in [start, end] greater than after, at most limit of them,
+        with the cursor to pass as after for the next page if there is one
+        """
+        with self._lock:
+            timestamps = self._timestamps
+            lo = 0 if start is None else bisect.bisect_left(timestamps, start)
+            if after is not None:
+                lo = max(lo, bisect.bisect_right(timestamps, after))
+            hi = (
+                len(timestamps) if end is None else bisect.bisect_right(timestamps, end)
+            )
+            if limit is None or lo + limit >= hi:
+                return timestamps[lo:hi], None
+            page = timestamps[lo : lo + limit]
+            return page, page[-1] if page else None
+
+    def at_or_before(self, timestamp: int) -> Optional[int]:
+        """Latest archived timestamp at or before timestamp"""
+        with self._lock:
+            i = bisect.bisect_right(self._timestamps, timestamp)
+            return self._timestamps[i - 1] if i else None
+
+    def _reset(self) -> None:
+        self._timestamps = []
+        self._known = set()
+        self._inode = None
+        self._offset = 0
+        self._scanned_mtime = None
+
+    def _scan(self) -> None:
+        try:
+            mtime = os.stat(self.directory).st_mtime_ns
+        except FileNotFoundError:
+            self._reset()
+            return
+        if self._inode is None and mtime == self._scanned_mtime:
+            return
+        self._reset()
+        for ts in scan_archive_timestamps(self.directory):
+            self._add(ts)
+        self._scanned_mtime = mtime
+
+    def _add(self, timestamp: int) -> None:
+        if timestamp in self._known:
+            return
+        self._known.add(timestamp)
+        if not self._timestamps or timestamp > self._timestamps[-1]:
+            self._timestamps.append(timestamp)
+        else:
+            bisect.insort(self._timestamps, timestamp)
+
+
+_timelines: Dict[str, ArchiveTimeline] = {}
+_timelines_lock = threading.Lock()
+
+
+def get_timeline(directory: str) -> ArchiveTimeline:
+    """Return the refreshed timeline of an archive directory"""
+    with _timelines_lock:
+        timeline = _timelines.get(directory)
+        if timeline is None:
+            timeline = _timelines[directory] = ArchiveTimeline(directory)
+    timeline.refresh()
+    return timeline
@@ -1,64 +1,424 @@
-def compress_graph_json(graph_data):
-    compressed = {
-        "directed": graph_data["directed"],
-        "multigraph": graph_data["multigraph"],
-        "graph": graph_data["graph"],
-        "node_types": {},
-        "relationship_types": {},
-        "node_values": {},
-        "link_values": [],
-    }
+import copy
+import json
+import mmap
+import struct
+import zlib
+from contextlib import contextmanager
+from typing import Any, Dict, Hashable, Iterator, List, Optional, Tuple, Union
 
-    # Compress nodes
-    for node in graph_data["nodes"]:
-        node_type = node["node_type"]
+import networkx as nx
+import numpy as np
+from networkx.readwrite import json_graph
 
-        # Store keys for this node type if we haven't seen it before
-        if node_type not in compressed["node_types"]:
-            compressed["node_types"][node_type] = list(node.keys())
-            compressed["node_values"][node_type] = []
+# Binary snapshots start with a fixed header: magic, format version, codec of
+# the columns, two reserved bytes and the length of the table of contents
+# that follows, see encode_snapshot. Version 1 files hold the whole layout as
+# JSON after the header, with the length of that JSON in its place.
+SNAPSHOT_MAGIC = b"GSNP"
+SNAPSHOT_VERSION = 2
+SNAPSHOT_HEADER = struct.Struct("<4sBBxxQ")
+SNAPSHOT_CODECS = {"none": 0, "zlib": 1}
+SNAPSHOT_ALIGNMENT = 8
+
+
+def links_key(node_link_data: Dict[str, Any]) -> str:
+    # networkx >= 3.4 names the edge list "edges" instead of "links"
+    return "edges" if "edges" in node_link_data else "links"
 
-        # Store just the values in order
-        compressed["node_values"][node_type].append(
-            [node[key] for key in compressed["node_types"][node_type]]
-        )
 
-    # Compress links
-    for link in graph_data["links"]:
-        rel_type = link["relationship_type"]
+# Values a column may be collapsed to one of: immutable, so the records can
+# share it, and of one JSON type each
+_SCALAR_TYPES = (str, int, float, bool, type(None))
 
-        # Store keys for this relationship type if we haven't seen it before
-        if rel_type not in compressed["relationship_types"]:
-            compressed["relationship_types"][rel_type] = list(link.keys())
 
-        # Store just the values in order
-        compressed["link_values"].append(
-            [link[key] for key in compressed["relationship_types"][rel_type]]
+def _constant(column: List[Any]) -> bool:
+    # 1, True and 1.0 are equal but must come back as they went in
+    first = column[0]
+    kind = type(first)
+    if kind not in _SCALAR_TYPES:
+        return False
+    return all(type(value) is kind and value == first for value in column)
+
+
+def _expand_const(column: Dict[str, Any]) -> List[Any]:
+    value = column["const"]
+    if isinstance(value, _SCALAR_TYPES):
+        return [value] * column["count"]
+    # Layouts written before only scalars were collapsed
+    return [copy.deepcopy(value) for _ in range(column["count"])]
+
+
+def _compress_records(
+    records: List[Dict[str, Any]], type_key: str
+) -> Tuple[List[Dict[str, Any]], List[List[int]]]:
+    """
+    Group records by their type_key value and key set, then store each group
+    as one value column per key. A column holding one value for the whole
+    group is stored once. The order of the records is kept as runs of group
+    indexes.
+    """
+    groups: Dict[Tuple[Hashable, Tuple[str, ...]], int] = {}
+    layouts: List[Dict[str, Any]] = []
+    rows: List[List[List[Any]]] = []
+    order: List[List[int]] = []
+
+    for record in records:
+        keys = tuple(record.keys())
+        record_type = record.get(type_key)
+        group_key = (
+            record_type if isinstance(record_type, Hashable) else None,
+            keys,
         )
+        index = groups.get(group_key)
+        if index is None:
+            index = groups[group_key] = len(layouts)
+            layouts.append({"keys": list(keys)})
+            rows.append([[] for _ in keys])
+        for column, key in zip(rows[index], keys):
+            column.append(record[key])
+
+        if order and order[-1][0] == index:
+            order[-1][1] += 1
+        else:
+            order.append([index, 1])
+
+    for layout, columns in zip(layouts, rows):
+        layout["columns"] = [
+            {"const": column[0], "count": len(column)} if _constant(column) else column
+            for column in columns
+        ]
+    return layouts, order
+
 
+def _group_columns(layout: Dict[str, Any]) -> List[List[Any]]:
+    return [
+        _expand_const(column) if isinstance(column, dict) else column
+        for column in layout["columns"]
+    ]
+
+
+def _in_order(groups: List[List[Any]], order: List[List[int]]) -> List[Any]:
+    if len(groups) == 1:
+        return groups[0]
+    takes = [iter(group).__next__ for group in groups]
+    return [take() for index, count in order for take in [takes[index]] * count]
+
+
+def _decompress_records(
+    layouts: List[Dict[str, Any]], order: List[List[int]]
+) -> List[Dict[str, Any]]:
+    groups = [
+        [dict(zip(layout["keys"], row)) for row in zip(*_group_columns(layout))]
+        for layout in layouts
+    ]
+    return _in_order(groups, order)
+
+
+def _split_records(
+    layouts: List[Dict[str, Any]], order: List[List[int]], id_keys: Tuple[str, ...]
+) -> List[Tuple[Any, ...]]:
+    """
+    Records in order as their id_keys values followed by a dict of their
+    other attributes, the shape networkx takes for nodes and edges
+    """
+    groups = []
+    for layout in layouts:
+        keys = layout["keys"]
+        columns = _group_columns(layout)
+        names = [key for key in keys if key not in id_keys]
+        values = [column for key, column in zip(keys, columns) if key not in id_keys]
+        attrs = [dict(zip(names, row)) for row in zip(*values)] if values else None
+        if attrs is None:
+            attrs = [{} for _ in range(len(columns[0]) if columns else 0)]
+        ids = [columns[keys.index(key)] for key in id_keys]
+        groups.append(list(zip(*ids, attrs)))
+    return _in_order(groups, order)
+
+
+def compress_graph_json(graph_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Columnar form of node-link data: nodes grouped by node_type (type in the
+    state graph) and links by relationship_type, each group with its key
+    table and one value array per key. Records of one type with different
+    keys get a group each, so no key is assumed to be present or to come
+    first.
+    """
+    key = links_key(graph_data)
+    # Schema nodes carry a node_type, instances in the state graph a type
+    node_type_key = (
+        "node_type"
+        if any("node_type" in node for node in graph_data["nodes"][:1])
+        else "type"
+    )
+    node_groups, node_order = _compress_records(graph_data["nodes"], node_type_key)
+    link_groups, link_order = _compress_records(graph_data[key], "relationship_type")
+    compressed = {
+        "directed": graph_data["directed"],
+        "multigraph": graph_data["multigraph"],
+        "graph": graph_data["graph"],
+        "links_key": key,
+        "node_groups": node_groups,
+        "node_order": node_order,
+        "link_groups": link_groups,
+        "link_order": link_order,
+    }
+    # Keep any other top level entries, such as the seq of an archive
+    for name, value in graph_data.items():
+        if name not in ("directed", "multigraph", "graph", "nodes", key):
+            compressed.setdefault("extra", {})[name] = value
     return compressed
 
 
-def decompress_graph_json(compressed_data):
+def decompress_graph_json(compressed_data: Dict[str, Any]) -> Dict[str, Any]:
     decompressed = {
         "directed": compressed_data["directed"],
         "multigraph": compressed_data["multigraph"],
         "graph": compressed_data["graph"],
-        "nodes": [],
-        "links": [],
+        "nodes": _decompress_records(
+            compressed_data["node_groups"], compressed_data["node_order"]
+        ),
+        compressed_data["links_key"]: _decompress_records(
+            compressed_data["link_groups"], compressed_data["link_order"]
+        ),
     }
+    decompressed.update(compressed_data.get("extra", {}))
+    return decompressed
 
-    # Decompress nodes
-    for node_type, keys in compressed_data["node_types"].items():
-        for values in compressed_data["node_values"][node_type]:
-            node = dict(zip(keys, values))
-            decompressed["nodes"].append(node)
 
-    # Decompress links
-    for values in compressed_data["link_values"]:
-        rel_type = values[0]  # Assuming relationship_type is always first
-        keys = compressed_data["relationship_types"][rel_type]
-        link = dict(zip(keys, values))
-        decompressed["links"].append(link)
+def _typed_column(column: List[Any]) -> Optional[Tuple[np.ndarray, Optional[list]]]:
+    """
+    Column as an array of a fixed dtype, and the value table of a dictionary
+    encoded one, or None for a column left as JSON. Integers and floats are
+    stored as int64 and float64, strings as int32 codes into their distinct
+    values.
+    """
+    kinds = {type(value) for value in column}
+    if kinds == {int}:
+        try:
+            return np.array(column, dtype=np.int64), None
+        except OverflowError:
+            return None
+    if kinds == {float}:
+        return np.array(column, dtype=np.float64), None
+    if kinds == {str}:
+        codes: Dict[str, int] = {}
+        encoded = np.fromiter(
+            (codes.setdefault(value, len(codes)) for value in column),
+            dtype=np.int32,
+            count=len(column),
+        )
+        return encoded, list(codes)
+    return None
 
-    return decompressed
+
+def encode_snapshot(graph_data: Dict[str, Any], codec: str = "zlib") -> bytes:
+    """
+    Binary snapshot of node-link data. The header (SNAPSHOT_HEADER) is
+    followed by a JSON table of contents holding the layout of
+    compress_graph_json, and then by the typed columns of that layout, each
+    at an 8-byte aligned offset. The table of contents gives the dtype,
+    offset and size of every such column in place of its values. With the
+    "none" codec the columns are read in place from the file; with "zlib" each
+    one is compressed on its own.
+    """
+    if codec not in SNAPSHOT_CODECS:
+        raise ValueError(f"Unknown snapshot codec: {codec}")
+    layout = compress_graph_json(graph_data)
+    buffers: List[bytes] = []
+    offset = 0
+    for groups in (layout["node_groups"], layout["link_groups"]):
+        for group in groups:
+            for i, column in enumerate(group["columns"]):
+                if not isinstance(column, list):
+                    continue
+                typed = _typed_column(column)
+                if typed is None:
+                    continue
+                array, values = typed
+                data = array.tobytes()
+                if codec == "zlib":
+                    data = zlib.compress(data, 6)
+                descriptor = {
+                    "dtype": array.dtype.str,
+                    "count": len(array),
+                    "offset": offset,
+                    "nbytes": len(data),
+                }
+                if values is not None:
+                    descriptor["values"] = values
+                group["columns"][i] = descriptor
+                padding = -len(data) % SNAPSHOT_ALIGNMENT
+                buffers.append(data + b"\0" * padding)
+                offset += len(data) + padding
+
+    contents = json.dumps(layout, separators=(",", ":")).encode()
+    contents += b" " * (-(SNAPSHOT_HEADER.size + len(contents)) % SNAPSHOT_ALIGNMENT)
+    header = SNAPSHOT_HEADER.pack(
+        SNAPSHOT_MAGIC, SNAPSHOT_VERSION, SNAPSHOT_CODECS[codec], len(contents)
+    )
+    return b"".join([header, contents] + buffers)
+
+
+class EncodedColumn:
+    """A dictionary encoded column: int32 codes into a table of values"""
+
+    __slots__ = ("codes", "values")
+
+    def __init__(self, codes: np.ndarray, values: List[Any]):
+        self.codes = codes
+        self.values = values
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+
+def _decode_v1(view: memoryview, codec: int, size: int) -> Dict[str, Any]:
+    # Version 1 snapshots hold the whole layout as JSON, read for files
+    # written before the columns were typed
+    with view[SNAPSHOT_HEADER.size :] as body:
+        if codec == SNAPSHOT_CODECS["zlib"]:
+            payload = zlib.decompress(body, bufsize=max(size, 1))
+        elif codec == SNAPSHOT_CODECS["none"]:
+            payload = body.tobytes()
+        else:
+            raise ValueError(f"Unknown snapshot codec {codec}")
+    if len(payload) != size:
+        raise ValueError("Truncated snapshot")
+    return json.loads(payload)
+
+
+def snapshot_layout(buffer: Union[bytes, memoryview, mmap.mmap]) -> Dict[str, Any]:
+    """
+    The compress_graph_json layout of a binary snapshot. Its typed columns
+    are NumPy arrays, or EncodedColumn for strings, which with the "none"
+    codec are read-only views into buffer: they are only valid while buffer
+    is, and reading them reads the file through the memory map.
+    """
+    view = memoryview(buffer)
+    if len(view) < SNAPSHOT_HEADER.size:
+        raise ValueError("Truncated snapshot")
+    magic, version, codec, size = SNAPSHOT_HEADER.unpack_from(view)
+    if magic != SNAPSHOT_MAGIC or version not in (1, SNAPSHOT_VERSION):
+        raise ValueError("Not a graph snapshot")
+    if version == 1:
+        return _decode_v1(view, codec, size)
+    if codec not in SNAPSHOT_CODECS.values():
+        raise ValueError(f"Unknown snapshot codec {codec}")
+
+    start = SNAPSHOT_HEADER.size + size
+    if len(view) < start:
+        raise ValueError("Truncated snapshot")
+    layout = json.loads(view[SNAPSHOT_HEADER.size : start].tobytes())
+    for groups in (layout["node_groups"], layout["link_groups"]):
+        for group in groups:
+            for i, column in enumerate(group["columns"]):
+                if not isinstance(column, dict) or "dtype" not in column:
+                    continue
+                begin = start + column["offset"]
+                if len(view) < begin + column["nbytes"]:
+                    raise ValueError("Truncated snapshot")
+                if codec == SNAPSHOT_CODECS["zlib"]:
+                    try:
+                        data = zlib.decompress(view[begin : begin + column["nbytes"]])
+                    except zlib.error as e:
+                        raise ValueError(f"Corrupt snapshot: {e}")
+                    array = np.frombuffer(data, dtype=column["dtype"])
+                else:
+                    array = np.frombuffer(
+                        view, dtype=column["dtype"], count=column["count"], offset=begin
+                    )
+                if len(array) != column["count"]:
+                    raise ValueError("Truncated snapshot")
+                if "values" in column:
+                    array = EncodedColumn(array, column["values"])
+                group["columns"][i] = array
+    return layout
+
+
+def column_values(column: Any) -> List[Any]:
+    """Values of a column of a snapshot layout as a list"""
+    if isinstance(column, EncodedColumn):
+        values = column.values
+        return [values[code] for code in column.codes.tolist()]
+    if isinstance(column, np.ndarray):
+        return column.tolist()
+    if isinstance(column, dict):
+        return _expand_const(column)
+    return column
+
+
+def _readable(layout: Dict[str, Any]) -> Dict[str, Any]:
+    """The layout with every column a list, as decompress_graph_json reads it"""
+    for groups in (layout["node_groups"], layout["link_groups"]):
+        for group in groups:
+            group["columns"] = [
+                column if isinstance(column, (dict, list)) else column_values(column)
+                for column in group["columns"]
+            ]
+    return layout
+
+
+def layout_node_link_data(layout: Dict[str, Any]) -> Dict[str, Any]:
+    """Node-link data of a snapshot layout"""
+    return decompress_graph_json(_readable(layout))
+
+
+def decode_snapshot(buffer: Union[bytes, memoryview, mmap.mmap]) -> Dict[str, Any]:
+    """Node-link data of a binary snapshot held in any buffer, such as an mmap"""
+    return layout_node_link_data(snapshot_layout(buffer))
+
+
+@contextmanager
+def mapped_snapshot(path: str) -> Iterator[Dict[str, Any]]:
+    """
+    snapshot_layout of a snapshot file through a read-only memory map of it.
+    The columns must not be used after the block.
+    """
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        yield snapshot_layout(mapped)
+    finally:
+        try:
+            mapped.close()
+        except BufferError:
+            # A column is still referenced; the map goes with its last view
+            pass
+
+
+def read_snapshot(path: str) -> Dict[str, Any]:
+    """Decode a snapshot file through a read-only memory map of it"""
+    with mapped_snapshot(path) as layout:
+        return layout_node_link_data(layout)
+
+
+def snapshot_graph(buffer: Union[bytes, memoryview, mmap.mmap]) -> nx.Graph:
+    """
+    Graph of a binary snapshot, built from the value columns directly rather
+    than through node-link dicts and json_graph.node_link_graph
+    """
+    return _layout_graph(snapshot_layout(buffer))
+
+
+def _layout_graph(layout: Dict[str, Any]) -> nx.Graph:
+    layout = _readable(layout)
+    if layout["multigraph"]:
+        return json_graph.node_link_graph(decompress_graph_json(layout))
+
+    graph = nx.DiGraph() if layout["directed"] else nx.Graph()
+    graph.graph.update(layout["graph"])
+    graph.add_nodes_from(
+        _split_records(layout["node_groups"], layout["node_order"], ("id",))
+    )
+    graph.add_edges_from(
+        _split_records(
+            layout["link_groups"], layout["link_order"], ("source", "target")
+        )
+    )
+    return graph
+
+
+def read_snapshot_graph(path: str) -> nx.Graph:
+    """Build the graph of a snapshot file through a read-only memory map of it"""
+    with mapped_snapshot(path) as layout:
+        return _layout_graph(layout)
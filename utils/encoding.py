@@ -0,0 +1,89 @@
+import gzip
+import zlib
+from typing import Dict, Iterable, Iterator, Optional
+
+try:
+    import zstandard
+except ImportError:  # zstd is offered only where the package is installed
+    zstandard = None
+
+# Content codings offered to clients, most preferred first, when the client
+# gives them the same weight
+CONTENT_CODINGS = ("zstd", "gzip") if zstandard is not None else ("gzip",)
+
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+def encode_content(content: bytes, coding: str) -> bytes:
+    """Body compressed with a content coding of CONTENT_CODINGS"""
+    if coding == "gzip":
+        # No file name or modification time in the header, so a body always
+        # compresses to the same bytes
+        return gzip.compress(content, GZIP_LEVEL, mtime=0)
+    if coding == "zstd" and zstandard is not None:
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(content)
+    raise ValueError(f"Unsupported content coding: {coding}")
+
+
+def encode_stream(chunks: Iterable[bytes], coding: str) -> Iterator[bytes]:
+    """
+    A body produced in chunks compressed as it goes. Each chunk is flushed so
+    the client can decode what it has received so far.
+    """
+    if coding == "gzip":
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        for chunk in chunks:
+            data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield compressor.flush()
+    elif coding == "zstd" and zstandard is not None:
+        compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+        for chunk in chunks:
+            data = compressor.compress(chunk) + compressor.flush(
+                zstandard.COMPRESSOBJ_FLUSH_BLOCK
+            )
+            if data:
+                yield data
+        yield compressor.flush()
+    else:
+        raise ValueError(f"Unsupported content coding: {coding}")
+
+
+def _weights(accept_encoding: str) -> Dict[str, float]:
+    weights = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        weight = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[coding] = weight
+    return weights
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """
+    Content coding of CONTENT_CODINGS to answer an Accept-Encoding header
+    with: the one of highest weight, ties going to the preferred one. None for
+    an uncompressed body.
+    """
+    if not accept_encoding:
+        return None
+    weights = _weights(accept_encoding)
+    wildcard = weights.get("*", 0.0)
+    best = None
+    best_weight = 0.0
+    for coding in CONTENT_CODINGS:
+        weight = weights.get(coding, wildcard)
+        if weight > best_weight:
+            best, best_weight = coding, weight
+    return best
@@ -0,0 +1,260 @@
+import json
+import re
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Top level arrays of node-link data that are streamed item by item
+ARRAY_KEYS = ("nodes", "links", "edges")
+
+# Items per chunk of a streamed array, and characters per read of a file
+CHUNK_ITEMS = 1000
+READ_SIZE = 1 << 16
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_decoder = json.JSONDecoder()
+
+
+class Items:
+    """A top level array of node-link data, as an iterator of lists of items"""
+
+    def __init__(self, chunks: Iterable[List[Any]]):
+        self.chunks = iter(chunks)
+
+    def __iter__(self) -> Iterator[List[Any]]:
+        return self.chunks
+
+
+# The members of a node-link object in order, arrays as Items. A consumer has
+# to exhaust an Items before moving on to the next member.
+Members = Iterator[Tuple[str, Any]]
+
+
+def _chunked(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class _Reader:
+    """
+    Incremental JSON tokenizer over a text file. Only the unread part of the
+    current block and the value being decoded are held in memory.
+    """
+
+    def __init__(self, f):
+        self._file = f
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self) -> bool:
+        if self._eof:
+            return False
+        block = self._file.read(READ_SIZE)
+        if not block:
+            self._eof = True
+            return False
+        self._buffer = self._buffer[self._pos :] + block
+        self._pos = 0
+        return True
+
+    def peek(self) -> str:
+        while True:
+            self._pos = _WHITESPACE.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                raise ValueError("Unexpected end of JSON document")
+
+    def next_char(self) -> str:
+        char = self.peek()
+        self._pos += 1
+        return char
+
+    def expect(self, char: str) -> None:
+        found = self.next_char()
+        if found != char:
+            raise ValueError(f"Expected {char!r} in JSON document, got {found!r}")
+
+    def value(self) -> Any:
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # A number at the end of the block may continue in the next one
+            if end == len(self._buffer) and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    def items(self) -> Iterator[Any]:
+        self.expect("[")
+        if self.peek() == "]":
+            self._pos += 1
+            return
+        while True:
+            yield self.value()
+            separator = self.next_char()
+            if separator == "]":
+                return
+            if separator != ",":
+                raise ValueError(f"Expected ',' or ']' in array, got {separator!r}")
+
+
+def iter_json_members(path: str, chunk_size: int = CHUNK_ITEMS) -> Members:
+    """
+    Members of the node-link object in a JSON file, with the ARRAY_KEYS
+    arrays parsed lazily, so memory stays bounded by the largest single item
+    """
+    with open(path, "r") as f:
+        reader = _Reader(f)
+        reader.expect("{")
+        if reader.peek() == "}":
+            return
+        while True:
+            key = reader.value()
+            reader.expect(":")
+            if key in ARRAY_KEYS and reader.peek() == "[":
+                items = Items(_chunked(reader.items(), chunk_size))
+                yield key, items
+                # Skip whatever the consumer did not read
+                for _ in items:
+                    pass
+            else:
+                yield key, reader.value()
+
+            separator = reader.next_char()
+            if separator == "}":
+                return
+            if separator != ",":
+                raise ValueError(f"Expected ',' or '}}' in object, got {separator!r}")
+
+
+def node_link_members(data: Dict[str, Any], chunk_size: int = CHUNK_ITEMS) -> Members:
+    """Members of node-link data already in memory"""
+    for key, value in data.items():
+        if key in ARRAY_KEYS and isinstance(value, list):
+            yield key, Items(
+                value[start : start + chunk_size]
+                for start in range(0, len(value), chunk_size)
+            )
+        else:
+            yield key, value
+
+
+def _patched(
+    items: Items, changes: Dict[Any, Optional[Dict[str, Any]]], key
+) -> Iterator[List[Any]]:
+    seen = set()
+    for chunk in items:
+        patched = []
+        for item in chunk:
+            item_key = key(item)
+            if item_key in changes:
+                seen.add(item_key)
+                item = changes[item_key]
+                if item is None:
+                    continue
+            patched.append(item)
+        yield patched
+    added = [item for k, item in changes.items() if k not in seen and item is not None]
+    if added:
+        yield added
+
+
+def patch_members(members: Members, deltas: List[Dict[str, Any]]) -> Members:
+    """
+    Apply archive deltas, in order, to streamed node-link members, as
+    utils.archive.apply_deltas does to node-link data. Only what the deltas
+    touch is held in memory. Nodes and edges keep their position in the
+    keyframe; added ones follow the keyframe's.
+    """
+    nodes: Dict[Any, Optional[Dict[str, Any]]] = {}
+    links: Dict[Tuple[Any, Any], Optional[Dict[str, Any]]] = {}
+    for delta in deltas:
+        for node_id in delta["removed_nodes"]:
+            nodes[node_id] = None
+        for node in delta["nodes"]:
+            nodes[node["id"]] = node
+        for source, target in delta["removed_links"]:
+            links[(source, target)] = None
+        for link in delta["links"]:
+            links[(link["source"], link["target"])] = link
+
+    for key, value in members:
+        if key == "seq":
+            # The keyframe's seq does not describe the patched archive
+            continue
+        if key == "nodes" and isinstance(value, Items):
+            value = Items(_patched(value, nodes, lambda node: node["id"]))
+        elif key in ARRAY_KEYS and isinstance(value, Items):
+            value = Items(
+                _patched(value, links, lambda link: (link["source"], link["target"]))
+            )
+        yield key, value
+    if deltas and "seq" in deltas[-1]:
+        yield "seq", deltas[-1]["seq"]
+
+
+def encode_json_stream(members: Members) -> Iterator[bytes]:
+    """The node-link object as JSON, one piece per member or array chunk"""
+    yield b"{"
+    first = True
+    for key, value in members:
+        prefix = ("" if first else ", ") + json.dumps(key) + ": "
+        first = False
+        if not isinstance(value, Items):
+            yield (prefix + json.dumps(value)).encode()
+            continue
+
+        yield (prefix + "[").encode()
+        separator = ""
+        for chunk in value:
+            if chunk:
+                yield (
+                    separator + ", ".join(json.dumps(item) for item in chunk)
+                ).encode()
+                separator = ", "
+        yield b"]"
+    yield b"}"
+
+
+def encode_ndjson_stream(members: Members) -> Iterator[bytes]:
+    """
+    The node-link object as newline delimited JSON: one {"type": "node"} or
+    {"type": "link"} line per item, with the item under "data", and
+    {"type": "meta"} lines holding the other members, sent before the
+    first array and after the last one
+    """
+    meta: Dict[str, Any] = {}
+    for key, value in members:
+        if not isinstance(value, Items):
+            meta[key] = value
+            continue
+
+        if meta:
+            yield (json.dumps({"type": "meta", "data": meta}) + "\n").encode()
+            meta = {}
+        item_type = "node" if key == "nodes" else "link"
+        for chunk in value:
+            if chunk:
+                yield "".join(
+                    json.dumps({"type": item_type, "data": item}) + "\n"
+                    for item in chunk
+                ).encode()
+    if meta:
+        yield (json.dumps({"type": "meta", "data": meta}) + "\n").encode()
+
+
+STREAM_ENCODERS = {
+    "json": (encode_json_stream, "application/json"),
+    "ndjson": (encode_ndjson_stream, "application/x-ndjson"),
+}
@@ -7,20 +7,75 @@ import logging
 import uuid
 import time
 import os
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Callable
 import fcntl
+from psycopg2.extras import execute_values
 
-from .actions import process_schema_create, process_schema_update, process_schema_delete
+from .actions import (
+    process_schema_create,
+    process_schema_update,
+    process_schema_delete,
+    process_state_expire,
+)
+from .checkpoint import (
+    Checkpointer,
+    finish_checkpoint,
+    load_checkpoint,
+    wal_directory,
+)
+from .delta_sink import DeltaRow, DeltaSink
+from .graph_store import GraphStore, LiveGraphs
+from .history import reconstruct
+from .instance_store import InstanceStore, node_link_data
+from . import metrics
+from .pool import ProcessWorkerPool, WorkerPool, run_shard
+from .transaction import GraphTransaction
+from .wal import WriteAheadLog
 
-from utils.compression import compress_graph_json, decompress_graph_json
+from utils.archive import (
+    GRAPH_FILE_SUFFIXES,
+    KEYFRAME_SUFFIX,
+    SNAPSHOT_SUFFIX,
+    append_to_timeline,
+    build_delta,
+    delta_path,
+    find_graph_file,
+    keyframe_path,
+    read_graph,
+    read_graph_file,
+    rebuild_timeline,
+)
+from utils.compression import encode_snapshot, mapped_snapshot
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 from server.config import (
+    ARCHIVE_KEYFRAME_INTERVAL,
+    CHANGE_BATCH_LINGER_MS,
+    CHANGE_BATCH_SIZE,
+    CHANGE_FEED_BACKEND,
+    CHANGE_FEED_CHANNEL,
+    CHANGE_LOG_GENERATIONS,
+    CHECKPOINT_EVERY_CHANGES,
+    CHECKPOINT_INTERVAL_SECONDS,
+    DEFAULT_VERSION,
+    DELTA_SINK_BATCH_SIZE,
+    DELTA_SINK_FLUSH_INTERVAL_MS,
+    DELTA_SINK_MAX_BACKLOG,
+    EXPIRY_SWEEP_BATCH_SIZE,
+    EXPIRY_SWEEP_INTERVAL_SECONDS,
+    GRAPH_STORE_IDLE_SECONDS,
+    GRAPH_STORE_MAX_VERSIONS,
+    SNAPSHOT_CODEC,
+    SNAPSHOT_FORMAT,
+    WAL_FSYNC_INTERVAL_MS,
+    WORKER_POOL_MODE,
+    WORKER_POOL_SIZE,
+    WAL_FSYNC_POLICY,
     get_paths,
+    get_postgres_pool,
     redis_client,
-    postgres_conn,
 )
 
 # Get default paths
@@ -30,77 +85,221 @@ STATEARCHIVE_PATH = paths["STATEARCHIVE_PATH"]
 SCHEMAARCHIVE_PATH = paths["SCHEMAARCHIVE_PATH"]
 LIVESCHEMA_PATH = paths["LIVESCHEMA_PATH"]
 
-CURRENT_TIMESTAMP = None
+# How often the workers check the graph store for versions to evict
+EVICTION_INTERVAL_SECONDS = 30
 
+# How long shutdown waits for the delta sink to write what it holds
+DELTA_SINK_SHUTDOWN_TIMEOUT_SECONDS = 5
 
-def write_to_postgres(timestamp, change_data=None):
-    try:
-        cursor = postgres_conn.cursor()
+# How often the workers check resident versions for due WAL syncs and checkpoints
+MAINTENANCE_INTERVAL_SECONDS = 0.1
+
+# How often worker processes report their delta sink and resident versions
+WORKER_STATS_INTERVAL_SECONDS = 1
 
-        # Create table if it doesn't exist
+# How long shutdown waits for worker processes to make their changes durable
+WORKER_POOL_SHUTDOWN_TIMEOUT_SECONDS = 30
+
+# Actions apply_change_to_graphs applies, others are skipped
+CHANGE_ACTIONS = ("create", "update", "delete", "expire")
+
+
+def ensure_delta_table(cursor) -> None:
+    """
+    Create the state_deltas table, moving aside a table in the original
+    layout, which was keyed on the change timestamp alone and so kept only
+    one change per timestamp
+    """
+    cursor.execute(
+        """
+        SELECT column_name FROM information_schema.columns
+        WHERE table_name = 'state_deltas'
+    """
+    )
+    columns = {row[0] for row in cursor.fetchall()}
+    if columns and "seq" not in columns:
+        logger.info(
+            "Renaming state_deltas in the original layout to state_deltas_legacy"
+        )
+        cursor.execute("ALTER TABLE state_deltas RENAME TO state_deltas_legacy")
         cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS state_deltas (
-                timestamp BIGINT PRIMARY KEY,
-                action VARCHAR(50),
-                change_type VARCHAR(50),
-                change_data JSONB,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
+            "ALTER INDEX IF EXISTS state_deltas_pkey RENAME TO state_deltas_legacy_pkey"
+        )
+
+    cursor.execute(
         """
+        CREATE TABLE IF NOT EXISTS state_deltas (
+            id BIGSERIAL PRIMARY KEY,
+            version VARCHAR(255) NOT NULL,
+            seq BIGINT NOT NULL,
+            timestamp BIGINT NOT NULL,
+            applied_timestamp BIGINT,
+            action VARCHAR(50),
+            change_type VARCHAR(50),
+            change_data JSONB,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (version, seq)
         )
+    """
+    )
+    # Range scans of graphs_as_of between an archive and the requested time
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS state_deltas_version_timestamp
+        ON state_deltas (version, timestamp)
+    """
+    )
 
-        # Insert change delta
-        if change_data:
-            cursor.execute(
+
+def write_to_postgres(rows: List[DeltaRow]) -> None:
+    """
+    Insert deltas into state_deltas with multi-row inserts, creating the table
+    on first use. Deltas already recorded under the same version and seq are
+    skipped. Raises on failure so the sink can retry.
+    """
+    global delta_table_ready
+    pool = get_postgres_pool()
+    conn = pool.getconn()
+    try:
+        with conn.cursor() as cursor:
+            if not delta_table_ready:
+                ensure_delta_table(cursor)
+            execute_values(
+                cursor,
                 """
-                INSERT INTO state_deltas 
-                (timestamp, action, change_type, change_data)
-                VALUES (%s, %s, %s, %s)
-                ON CONFLICT (timestamp) DO NOTHING
+                INSERT INTO state_deltas
+                (version, seq, timestamp, applied_timestamp, action, change_type, change_data)
+                VALUES %s
+                ON CONFLICT (version, seq) DO NOTHING
             """,
-                (
-                    timestamp,
-                    change_data["action"],
-                    change_data["type"],
-                    json.dumps(change_data["data"]),
-                ),
+                [row[:-1] + (json.dumps(row[-1]),) for row in rows],
+                page_size=len(rows),
             )
+        conn.commit()
+        delta_table_ready = True
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn)
 
-        postgres_conn.commit()
-        cursor.close()
-        logger.info(f"Successfully wrote delta for timestamp {timestamp}")
 
-    except Exception as e:
-        logger.error(f"Error writing delta to postgres: {str(e)}")
-        postgres_conn.rollback()
+def drain_changes(
+    max_batch: int = CHANGE_BATCH_SIZE, linger_ms: float = CHANGE_BATCH_LINGER_MS
+) -> List[bytes]:
+    """
+    Pop up to max_batch changes from the queue, waiting at most linger_ms after
+    the first one for more to arrive. Each pop is a single round trip.
+    """
+    batch = redis_client.lpop("changes", max_batch) or []
+    if not batch or len(batch) >= max_batch or linger_ms <= 0:
+        return batch
 
+    deadline = time.monotonic() + linger_ms / 1000
+    while len(batch) < max_batch:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        sleep(min(remaining, 0.001))
+        batch.extend(redis_client.lpop("changes", max_batch - len(batch)) or [])
+    return batch
 
-def main_worker():
-    logger.info("Starting main worker")
-    while True:
-        # Check Redis for new changes
-        latest_change = redis_client.lpop("changes")
-        if latest_change:
-            change_data = json.loads(latest_change)
-            version = change_data.get("version")
 
-            if not version:
-                logger.warning("No version specified in change data, using default")
-                version = "default"
+# Keys every queued change carries, see Change.to_dict
+CHANGE_KEYS = ("action", "type", "timestamp", "payload")
 
-            logger.info(
-                f"Processing change type: {change_data['type']} action: {change_data['action']} version: {version}"
-            )
 
-            # Get versioned paths for this change
-            paths = get_paths(version)
+def decode_change(raw_change: bytes) -> Dict[str, Any]:
+    """A queued change, raising ValueError for one the worker cannot apply"""
+    change_data = json.loads(raw_change)
+    if not isinstance(change_data, dict):
+        raise ValueError(f"Change is a {type(change_data).__name__}, not an object")
+    missing = [key for key in CHANGE_KEYS if key not in change_data]
+    if missing:
+        raise ValueError(f"Change is missing {', '.join(missing)}")
+    if not change_data.get("version"):
+        logger.warning("No version specified in change data, using default")
+        change_data["version"] = DEFAULT_VERSION
+    elif not isinstance(change_data["version"], str):
+        raise ValueError(f"Change version {change_data['version']!r} is not a string")
+    return change_data
 
-            # if change_data["type"] == "state":
-            #     process_state_change(change_data, paths)
-            # elif change_data["type"] == "schema":
-            #     process_schema_change(change_data, paths)
-            process_schema_change(change_data=change_data, paths=paths)
+
+def decode_changes(batch: List[bytes]) -> List[Dict[str, Any]]:
+    """
+    The changes of a drained batch, each decoded on its own. A malformed
+    entry is logged and skipped, the rest of the batch is still applied.
+    """
+    changes = []
+    for raw_change in batch:
+        try:
+            changes.append(decode_change(raw_change))
+        except ValueError as e:  # JSONDecodeError is a ValueError
+            logger.error(f"Skipping malformed change {raw_change[:200]!r}: {str(e)}")
+    return changes
+
+
+def process_change_batch(batch: List[Dict[str, Any]]) -> int:
+    """
+    Apply a batch of changes in order and persist each touched version once at
+    the end. Returns the number of changes applied successfully.
+    """
+    started = time.perf_counter()
+    # The live graphs each version's changes were applied to. They are
+    # persisted as they are, not looked up again: the version may have been
+    # evicted and loaded anew in the meantime, without the pending deltas.
+    touched: Dict[str, Any] = {}
+    applied = 0
+    for change_data in batch:
+        version = change_data["version"]
+
+        logger.info(
+            f"Processing change type: {change_data['type']} action: {change_data['action']} version: {version}"
+        )
+
+        # Get versioned paths for this change
+        paths = get_paths(version)
+
+        # if change_data["type"] == "state":
+        #     process_state_change(change_data, paths)
+        # elif change_data["type"] == "schema":
+        #     process_schema_change(change_data, paths)
+        live = apply_schema_change(change_data=change_data, paths=paths)
+        if live is not None:
+            touched[version] = (live, paths)
+            applied += 1
+
+    for version, (live, paths) in touched.items():
+        try:
+            publish_live_graphs(live, paths)
+        except Exception as e:
+            logger.error(f"Error persisting version {version}: {str(e)}")
+
+    elapsed = time.perf_counter() - started
+    metrics.change_batch_size.observe(len(batch))
+    metrics.change_batch_seconds.observe(elapsed)
+    logger.info(
+        f"Processed batch of {len(batch)} changes ({applied} applied) across "
+        f"{len(touched)} versions in {elapsed * 1000:.1f} ms"
+    )
+    return applied
+
+
+def main_worker():
+    """
+    Drain the changes queue and dispatch every change to the pool worker that
+    owns its version
+    """
+    logger.info(
+        f"Starting main worker (batch size {CHANGE_BATCH_SIZE}, "
+        f"linger {CHANGE_BATCH_LINGER_MS} ms, {WORKER_POOL_SIZE} shards)"
+    )
+    worker_pool.start()
+    while not dispatcher_stop.is_set():
+        # Check Redis for new changes
+        batch = drain_changes()
+        if batch:
+            worker_pool.dispatch(decode_changes(batch))
         else:
             sleep(0.01)  # Wait before checking again
 
@@ -121,30 +320,233 @@ def create_initial_schema_and_state(paths):
 
 def load_live_schema(paths):
     try:
-        with open(f"{paths['LIVESCHEMA_PATH']}/current_schema.json", "r") as f:
-            schema_node_link_data = json.load(f)
-            return json_graph.node_link_graph(schema_node_link_data)
-    except (FileNotFoundError, json.JSONDecodeError):
+        path = find_graph_file(f"{paths['LIVESCHEMA_PATH']}/current_schema")
+        if path is None:
+            raise FileNotFoundError("current_schema")
+        return read_graph(path)
+    except (FileNotFoundError, ValueError):
         create_initial_schema_and_state(paths)
         return load_live_schema(paths)
 
 
+def read_live_state(path: str) -> InstanceStore:
+    """The instances of a state file, JSON or binary snapshot"""
+    if path.endswith(SNAPSHOT_SUFFIX):
+        # Built from the typed columns, read in place through the map
+        with mapped_snapshot(path) as layout:
+            return InstanceStore.from_snapshot_layout(layout)
+    return InstanceStore.from_node_link_data(read_graph_file(path))
+
+
 def load_live_state(paths):
     try:
-        with open(f"{paths['LIVESTATE_PATH']}/current_state.json", "r") as f:
-            state_node_link_data = json.load(f)
-            return json_graph.node_link_graph(state_node_link_data)
-    except (FileNotFoundError, json.JSONDecodeError):
+        path = find_graph_file(f"{paths['LIVESTATE_PATH']}/current_state")
+        if path is None:
+            raise FileNotFoundError("current_state")
+        return read_live_state(path)
+    except (FileNotFoundError, ValueError):
         create_initial_schema_and_state(paths)
         return load_live_state(paths)
 
 
+def load_version(version: str) -> LiveGraphs:
+    """
+    Load the live graphs of a version from the live files its latest
+    checkpoint points at, or from whatever live files it has without one, and
+    replay the WAL records the checkpoint does not cover
+    """
+    paths = get_paths(version)
+    checkpoint = load_checkpoint(paths)
+    if checkpoint is not None and "files" in checkpoint:
+        files = finish_checkpoint(paths, checkpoint)
+        schema_data = read_graph(files["schema"])
+        state_data = read_live_state(files["state"])
+        seq = checkpoint["seq"]
+        timestamp = checkpoint.get("timestamp")
+        modified_at = checkpoint.get("modified_at")
+    elif checkpoint is not None:
+        # Written before checkpoints pointed at the live files, with both graphs
+        schema_data = json_graph.node_link_graph(checkpoint["schema"])
+        state_data = InstanceStore.from_node_link_data(checkpoint["state"])
+        seq = checkpoint["seq"]
+        timestamp = checkpoint.get("timestamp")
+        modified_at = checkpoint.get("modified_at")
+    else:
+        schema_data = load_live_schema(paths)
+        state_data = load_live_state(paths)
+        seq = 0
+        timestamp = None
+        modified_at = None
+
+    wal = WriteAheadLog(wal_directory(paths), WAL_FSYNC_POLICY, WAL_FSYNC_INTERVAL_MS)
+    live = LiveGraphs(
+        version,
+        schema_data,
+        state_data,
+        wal=wal,
+        seq=seq,
+        change_log_size=CHANGE_LOG_GENERATIONS,
+    )
+    live.current_timestamp = timestamp
+    if modified_at is not None:
+        live.modified_at = modified_at
+
+    # Every record still in the WAL may not have reached Postgres: the sink
+    # writes after the WAL commit, and segments are only deleted once it has.
+    # Recording them again is harmless, rows already written are skipped.
+    rows = []
+    replayed = 0
+    for record in wal.replay():
+        rows.append(
+            delta_row(
+                version, record["seq"], record["change"], record["current_timestamp"]
+            )
+        )
+        if record["seq"] <= seq:
+            continue
+        try:
+            apply_change_to_graphs(
+                record["change"], schema_data, state_data, record["current_timestamp"]
+            )
+        except Exception as e:
+            logger.error(f"Error replaying WAL record {record['seq']}: {str(e)}")
+        live.seq = record["seq"]
+        live.current_timestamp = record["change"]["timestamp"]
+        replayed += 1
+
+    wal.last_seq = max(wal.last_seq, live.seq)
+    live.checkpoint_seq = seq
+    live.rollup.rebuild(schema_data, state_data)
+    # Diffs start here, clients that followed the replayed changes before a
+    # restart get a full snapshot
+    live.publish()
+    live.reset_change_log()
+    delta_sink.record(rows)
+    if replayed:
+        logger.info(f"Replayed {replayed} WAL records for version {version}")
+    return live
+
+
+def close_live_graphs(live: LiveGraphs) -> None:
+    """
+    Release an evicted version once its live files are checkpointed up to its
+    last change, so the API reads them in place of the graphs. Changes
+    applied but not yet persisted are committed and handed to the delta sink
+    and the change feed first, the batch that applied them skips the closed
+    graphs.
+    """
+    checkpointer.flush()
+    with live.lock:
+        live.wal.commit()
+        rows = live.pending_deltas
+        live.pending_deltas = []
+        live.closed = True
+        if live.seq > live.checkpoint_seq:
+            paths = get_paths(live.version)
+            while not checkpointer.checkpoint(live, paths):
+                checkpointer.flush()
+        live.wal.close()
+
+    checkpointer.flush()
+    delta_sink.record(rows)
+    publish_changes(rows)
+
+
+def maintain_live_graphs(owns: Optional[Callable[[str], bool]] = None) -> None:
+    """
+    Sync due WAL writes, start due checkpoints and evict idle versions among
+    the resident versions accepted by ``owns``
+    """
+    global last_eviction
+    for live in graph_store.entries():
+        if owns is None or owns(live.version):
+            sweep_expired(live)
+            with live.lock:
+                if live.closed:
+                    continue
+                live.wal.sync_if_due()
+                live.state.compact_if_due()
+                checkpointer.maybe_checkpoint(live, get_paths(live.version))
+
+    if time.monotonic() - last_eviction > EVICTION_INTERVAL_SECONDS:
+        last_eviction = time.monotonic()
+        graph_store.evict_idle()
+
+
+def sweep_expired(live: LiveGraphs) -> int:
+    """
+    Expire the instances of a version whose valid_to the timestamp of its
+    latest change has reached, at most EXPIRY_SWEEP_BATCH_SIZE at a time,
+    through an "expire" change applied and persisted like any other. The
+    change carries that same timestamp, so expiry follows the clients'
+    timeline and adds no timestamps of its own to the change stream. Sweeps
+    are EXPIRY_SWEEP_INTERVAL_SECONDS apart unless the previous one left
+    expired instances behind. Returns the number of instances expired.
+    """
+    if EXPIRY_SWEEP_INTERVAL_SECONDS <= 0:
+        return 0
+    if time.monotonic() < live.next_expiry_sweep:
+        return 0
+    live.next_expiry_sweep = time.monotonic() + EXPIRY_SWEEP_INTERVAL_SECONDS
+
+    with live.lock:
+        # Held until a change moves the timeline past the expiry
+        timestamp = live.current_timestamp
+        next_expiry = live.state.next_expiry()
+        if timestamp is None or next_expiry is None or next_expiry > timestamp:
+            return 0
+        before = len(live.state)
+        change_data = {
+            "action": "expire",
+            "type": "state",
+            "timestamp": timestamp,
+            "payload": {"before": timestamp, "limit": EXPIRY_SWEEP_BATCH_SIZE},
+            "version": live.version,
+        }
+        paths = get_paths(live.version)
+        if not apply_change_to_live(live, change_data, paths):
+            return 0
+        expired = before - len(live.state)
+        if expired >= EXPIRY_SWEEP_BATCH_SIZE:
+            live.next_expiry_sweep = time.monotonic()
+
+    publish_live_graphs(live, paths)
+    logger.info(f"Expired {expired} instances of version {live.version}")
+    return expired
+
+
+def flush_live_graphs() -> None:
+    """Make every applied change durable, used on shutdown"""
+    # Nothing more is taken from Redis, what was is applied first
+    dispatcher_stop.set()
+    if worker_thread is not None:
+        worker_thread.join(WORKER_POOL_SHUTDOWN_TIMEOUT_SECONDS)
+    worker_pool.stop(timeout=WORKER_POOL_SHUTDOWN_TIMEOUT_SECONDS)
+    for live in graph_store.entries():
+        live.wal.close()
+    checkpointer.flush()
+    if not delta_sink.flush(timeout=DELTA_SINK_SHUTDOWN_TIMEOUT_SECONDS):
+        logger.warning(
+            f"Shutting down with {delta_sink.backlog()} deltas not written to postgres"
+        )
+
+
+graph_store = GraphStore(
+    loader=load_version,
+    max_versions=GRAPH_STORE_MAX_VERSIONS,
+    idle_seconds=GRAPH_STORE_IDLE_SECONDS,
+    on_evict=close_live_graphs,
+)
+
+
 def save_graph(
     graph: nx.DiGraph,
     paths: Dict[str, str],
     timestamp: Optional[int] = None,
     is_schema: bool = True,
+    seq: Optional[int] = None,
 ):
+    started = time.perf_counter()
     try:
         if timestamp:
             if is_schema:
@@ -152,85 +554,360 @@ def save_graph(
             else:
                 path = f"{paths['STATEARCHIVE_PATH']}"
             os.makedirs(path, exist_ok=True)
-            filepath = f"{path}/{timestamp}.json"
+            base = f"{path}/{timestamp}"
         else:
             if is_schema:
                 path = f"{paths['LIVESCHEMA_PATH']}"
             else:
                 path = f"{paths['LIVESTATE_PATH']}"
             name = "current_schema" if is_schema else "current_state"
-            filepath = f"{path}/{name}.json"
+            base = f"{path}/{name}"
 
         # Convert graph to node-link format
-        node_link_data = json_graph.node_link_data(graph)
+        data = node_link_data(graph)
+        if seq is not None:
+            # Last change contained in an archive, replayed from by graphs_as_of
+            data["seq"] = seq
 
-        # Use safe write with file locking
-        safe_write_json(filepath, node_link_data)
+        write_graph_file(base, data)
     except Exception as e:
         logger.error(f"Error saving graph: {str(e)}")
         raise
+    metrics.save_graph_seconds.labels(
+        "schema" if is_schema else "state", "archive" if timestamp else "live"
+    ).observe(time.perf_counter() - started)
+
+
+def write_graph_file(base: str, node_link_data: Dict[str, Any]) -> str:
+    """
+    Write node-link data to base plus the suffix of SNAPSHOT_FORMAT, remove
+    a file left at base in the other format and return the path written
+    """
+    if SNAPSHOT_FORMAT == "binary":
+        filepath = base + SNAPSHOT_SUFFIX
+        started = time.perf_counter()
+        content = encode_snapshot(node_link_data, SNAPSHOT_CODEC)
+        metrics.encode_seconds.labels("binary").observe(time.perf_counter() - started)
+        safe_write_bytes(filepath, content)
+    else:
+        filepath = base + KEYFRAME_SUFFIX
+        # Compact, the live files are sent to clients as they are
+        safe_write_json(filepath, node_link_data, indent=None)
+
+    for suffix in GRAPH_FILE_SUFFIXES:
+        if base + suffix != filepath and os.path.exists(base + suffix):
+            os.remove(base + suffix)
+    return filepath
 
 
 def process_schema_change(change_data, paths):
-    global CURRENT_TIMESTAMP
+    """Apply a single change and persist the live graphs of its version"""
+    live = apply_schema_change(change_data, paths)
+    if live is None:
+        return False
+
     try:
-        schema_data = load_live_schema(paths)
-        state_data = load_live_state(paths)
+        publish_live_graphs(live, paths)
+        return True
+    except Exception as e:
+        logger.error(f"Error processing schema change: {str(e)}")
+        return False
 
-        if change_data["action"] in ["create", "update", "delete"]:
 
-            if change_data["action"] == "create":
-                schema_data, state_data = process_schema_create(
-                    change_data["payload"], schema_data, state_data, CURRENT_TIMESTAMP
-                )
-            elif change_data["action"] == "update":
-                schema_data, state_data = process_schema_update(
-                    change_data["payload"], schema_data, state_data, CURRENT_TIMESTAMP
-                )
-            elif change_data["action"] == "delete":
-                schema_data, state_data = process_schema_delete(
-                    change_data["payload"], schema_data, state_data, CURRENT_TIMESTAMP
-                )
+def apply_schema_change(change_data, paths) -> Optional[LiveGraphs]:
+    """
+    Apply a change to the in-memory graphs of its version, record it in the
+    version's WAL and archive the graphs when the change moves the version's
+    timestamp. Returns the live graphs the change was applied to, None if it
+    failed. The change is only durable once publish_live_graphs commits the
+    WAL of those graphs.
+    """
+    started = time.perf_counter()
+    version = change_data.get("version") or DEFAULT_VERSION
+    while True:
+        try:
+            live = graph_store.get(version)
+        except Exception as e:
+            logger.error(f"Error processing schema change: {str(e)}")
+            metrics.change_apply_seconds.labels(
+                _action_label(change_data), "failed"
+            ).observe(time.perf_counter() - started)
+            return None
+        with live.lock:
+            # Evicted by another shard since it was looked up
+            if live.closed:
+                continue
+            if apply_change_to_live(live, change_data, paths):
+                return live
+            return None
 
-        save_graph(schema_data, paths, is_schema=True)
-        save_graph(state_data, paths, is_schema=False)
 
-        logger.info(
-            f"Current timestamp: {CURRENT_TIMESTAMP}, change timestamp: {change_data['timestamp']}"
-        )
+def _action_label(change_data) -> str:
+    # Actions come from clients, unknown ones must not add label values
+    action = change_data.get("action")
+    return action if action in CHANGE_ACTIONS else "other"
 
-        if CURRENT_TIMESTAMP is None:
-            CURRENT_TIMESTAMP = change_data["timestamp"]
 
-        if change_data["timestamp"] != CURRENT_TIMESTAMP:
-            timestamp = change_data["timestamp"]
-            save_graph(schema_data, paths, timestamp=timestamp, is_schema=True)
-            save_graph(state_data, paths, timestamp=timestamp, is_schema=False)
-            CURRENT_TIMESTAMP = timestamp
+def apply_change_to_live(live: LiveGraphs, change_data, paths) -> bool:
+    """apply_schema_change on the live graphs of a version already at hand"""
+    started = time.perf_counter()
+    applied = False
+    try:
+        with live.lock:
+            if live.closed:
+                # Its WAL would be reopened next to the one of the reloaded version
+                raise RuntimeError(f"Version {live.version} was evicted")
+            schema_data = live.schema
+            state_data = live.state
 
-        return True
+            applied_timestamp = live.current_timestamp
+            tx = apply_change_to_graphs(
+                change_data, schema_data, state_data, applied_timestamp
+            )
+            live.seq = live.wal.append(
+                {"current_timestamp": applied_timestamp, "change": change_data}
+            )
+            live.pending_deltas.append(
+                delta_row(live.version, live.seq, change_data, applied_timestamp)
+            )
+            live.record_changes(tx)
+
+            logger.info(
+                f"Current timestamp: {live.current_timestamp}, change timestamp: {change_data['timestamp']}"
+            )
+
+            if live.current_timestamp is None:
+                live.current_timestamp = change_data["timestamp"]
+
+            if change_data["timestamp"] != live.current_timestamp:
+                timestamp = change_data["timestamp"]
+                archive_live_graphs(live, paths, timestamp)
+                live.current_timestamp = timestamp
+
+        applied = True
 
     except Exception as e:
         logger.error(f"Error processing schema change: {str(e)}")
-        return False
 
+    metrics.change_apply_seconds.labels(
+        _action_label(change_data), "applied" if applied else "failed"
+    ).observe(time.perf_counter() - started)
+    return applied
+
+
+def delta_row(
+    version: str, seq: int, change_data, applied_timestamp: Optional[int]
+) -> DeltaRow:
+    """The state_deltas row of a change applied as seq"""
+    return (
+        version,
+        seq,
+        change_data["timestamp"],
+        applied_timestamp,
+        change_data["action"],
+        change_data["type"],
+        change_data["payload"],
+    )
+
+
+def apply_change_to_graphs(change_data, schema_data, state_data, timestamp):
+    """
+    Apply a change in place and return its committed transaction, which knows
+    what the change touched. The transaction undoes the change if it raises.
+    """
+    with GraphTransaction() as tx:
+        if change_data["action"] not in CHANGE_ACTIONS:
+            return tx
+
+        if change_data["action"] == "create":
+            process_schema_create(
+                change_data["payload"], schema_data, state_data, timestamp, tx=tx
+            )
+        elif change_data["action"] == "update":
+            process_schema_update(
+                change_data["payload"], schema_data, state_data, timestamp, tx=tx
+            )
+        elif change_data["action"] == "delete":
+            process_schema_delete(
+                change_data["payload"], schema_data, state_data, timestamp, tx=tx
+            )
+        elif change_data["action"] == "expire":
+            process_state_expire(
+                change_data["payload"], schema_data, state_data, timestamp, tx=tx
+            )
+    return tx
+
+
+def graphs_as_of(version: str, timestamp: int) -> Dict[str, Any]:
+    """Rebuild the schema and state of a version as of a timestamp"""
+    return reconstruct(
+        version,
+        timestamp,
+        get_paths(version),
+        get_postgres_pool(),
+        apply_change=apply_change_to_graphs,
+    )
+
+
+def archive_live_graphs(
+    live: LiveGraphs, paths: Dict[str, str], timestamp: int
+) -> None:
+    """
+    Archive both graphs of a version at a timestamp. Every
+    ARCHIVE_KEYFRAME_INTERVAL archives a full keyframe is written; in between
+    only a delta of what changed since the previous archive is stored. The
+    timestamp is added to the timeline of both archive directories.
+    """
+    keyframe = (
+        live.archive_changes is None
+        or live.archive_timestamp is None
+        or timestamp <= live.archive_timestamp
+        or live.archives_since_keyframe + 1 >= ARCHIVE_KEYFRAME_INTERVAL
+    )
+
+    for graph, directory, name in (
+        (live.schema, paths["SCHEMAARCHIVE_PATH"], "schema"),
+        (live.state, paths["STATEARCHIVE_PATH"], "state"),
+    ):
+        os.makedirs(directory, exist_ok=True)
+        if keyframe:
+            save_graph(
+                graph,
+                paths,
+                timestamp=timestamp,
+                is_schema=name == "schema",
+                seq=live.seq,
+            )
+            stale_paths = [delta_path(directory, timestamp)]
+        else:
+            nodes, edges = live.archive_changes[name]
+            delta = build_delta(graph, live.archive_timestamp, nodes, edges)
+            delta["seq"] = live.seq
+            safe_write_json(delta_path(directory, timestamp), delta, indent=None)
+            stale_paths = [
+                keyframe_path(directory, timestamp, suffix)
+                for suffix in GRAPH_FILE_SUFFIXES
+            ]
+
+        metrics.archives_written.labels(name, "keyframe" if keyframe else "delta").inc()
+
+        # A timestamp archived again must not keep its previous archive around
+        for stale_path in stale_paths:
+            if os.path.exists(stale_path):
+                os.remove(stale_path)
+
+        # The first archive since the version was loaded rebuilds the timeline,
+        # which also recovers archives a crash kept out of it
+        if live.archive_timestamp is None:
+            rebuild_timeline(directory)
+        else:
+            append_to_timeline(directory, timestamp)
+
+    live.archives_since_keyframe = 0 if keyframe else live.archives_since_keyframe + 1
+    live.archive_timestamp = timestamp
+    live.reset_archive_changes()
+
+
+def persist_live_graphs(version: str, paths: Dict[str, str]) -> None:
+    """
+    Commit the WAL records of a version, publish them as a new generation,
+    hand them to the delta sink and the change feed and start a background
+    checkpoint of its graphs when one is due. A version no longer resident
+    was persisted by close_live_graphs when it was evicted.
+    """
+    live = graph_store.peek(version)
+    if live is not None:
+        publish_live_graphs(live, paths)
+
+
+def publish_live_graphs(live: LiveGraphs, paths: Dict[str, str]) -> None:
+    """persist_live_graphs on the live graphs of a version already at hand"""
+    with live.lock:
+        # Evicted since the changes were applied, close_live_graphs persisted them
+        if live.closed:
+            return
+        started = time.perf_counter()
+        live.wal.commit()
+        metrics.wal_commit_seconds.observe(time.perf_counter() - started)
+        live.publish()
+        rows = live.pending_deltas
+        live.pending_deltas = []
+        checkpointer.maybe_checkpoint(live, paths)
+
+    delta_sink.record(rows)
+    publish_changes(rows)
+
+
+def publish_changes(rows: List[DeltaRow]) -> None:
+    """
+    Announce committed changes, one message per change carrying its seq and
+    the generation published with it. Messages go to every registered change
+    listener and, with the "redis" feed backend, to the version's channel.
+    """
+    if not rows:
+        return
+    generation = rows[-1][1]
+    messages = [
+        {
+            "version": version,
+            "seq": seq,
+            "generation": generation,
+            "timestamp": timestamp,
+            "action": action,
+            "type": change_type,
+            "payload": payload,
+        }
+        for version, seq, timestamp, _, action, change_type, payload in rows
+    ]
+
+    if CHANGE_FEED_BACKEND == "redis":
+        try:
+            redis_client.publish(
+                f"{CHANGE_FEED_CHANNEL}:{messages[0]['version']}", json.dumps(messages)
+            )
+        except Exception as e:
+            logger.error(f"Error publishing changes to redis: {str(e)}")
 
-def safe_write_json(filepath: str, data: Dict[str, Any]) -> None:
+    notify_change_listeners(messages)
+
+
+def notify_change_listeners(messages: List[Dict[str, Any]]) -> None:
+    for listener in change_listeners:
+        try:
+            listener(messages)
+        except Exception as e:
+            logger.error(f"Error in change listener: {str(e)}")
+
+
+def safe_write_json(
+    filepath: str, data: Dict[str, Any], indent: Optional[int] = 2
+) -> None:
     """Safely write JSON data to file with exclusive lock"""
+    started = time.perf_counter()
+    content = json.dumps(data, indent=indent).encode()
+    metrics.encode_seconds.labels("json").observe(time.perf_counter() - started)
+    safe_write_bytes(filepath, content)
+
+
+def safe_write_bytes(filepath: str, content: bytes) -> None:
+    """Safely write a file's content with exclusive lock"""
     temp_path = f"{filepath}.tmp"
     try:
         # First write to temp file
-        with open(temp_path, "w") as f:
+        with open(temp_path, "wb") as f:
             fcntl.flock(f, fcntl.LOCK_EX)
             try:
-                json.dump(data, f, indent=2)
+                f.write(content)
                 f.flush()  # Ensure data is written to disk
+                started = time.perf_counter()
                 os.fsync(f.fileno())  # Force write to disk
+                metrics.fsync_seconds.observe(time.perf_counter() - started)
             finally:
                 fcntl.flock(f, fcntl.LOCK_UN)
 
         # Then atomically rename temp file to target file
         os.rename(temp_path, filepath)
+        metrics.bytes_written.inc(len(content))
     except Exception as e:
         logger.error(f"Error writing to {filepath}: {str(e)}")
         if os.path.exists(temp_path):
@@ -238,8 +915,147 @@ def safe_write_json(filepath: str, data: Dict[str, Any]) -> None:
         raise
 
 
+checkpointer = Checkpointer(
+    write_json=safe_write_json,
+    write_graph=write_graph_file,
+    every_changes=CHECKPOINT_EVERY_CHANGES,
+    interval_seconds=CHECKPOINT_INTERVAL_SECONDS,
+    # Looked up on use, the benchmarks swap the sink
+    written_through=lambda version: delta_sink.written_through(version),
+)
+
+
+delta_sink = DeltaSink(
+    write=write_to_postgres,
+    batch_size=DELTA_SINK_BATCH_SIZE,
+    flush_interval_ms=DELTA_SINK_FLUSH_INTERVAL_MS,
+    max_backlog=DELTA_SINK_MAX_BACKLOG,
+)
+delta_table_ready = False
+
+# Called with the messages of every committed batch of a version
+change_listeners: List[Callable[[List[Dict[str, Any]]], None]] = []
+
+
+def resident_version_stats() -> List[Dict[str, Any]]:
+    """
+    Sizes of the versions resident in this process, or in the worker
+    processes when they hold the versions. Read without the versions' locks,
+    a batch being applied may be half in.
+    """
+    if not holds_versions:
+        return [
+            version
+            for stats in list(worker_stats.values())
+            for version in stats["versions"]
+        ]
+    return [
+        {
+            "version": live.version,
+            "schema_nodes": live.schema.number_of_nodes(),
+            "schema_edges": live.schema.number_of_edges(),
+            "state_nodes": live.state.number_of_nodes(),
+            "state_edges": live.state.number_of_edges(),
+            "state_bytes": live.state.nbytes(),
+            "seq": live.seq,
+        }
+        for live in graph_store.entries()
+    ]
+
+
+def delta_sink_stats() -> Dict[str, Any]:
+    """DeltaSink.stats of this process, or summed over the worker processes"""
+    if holds_versions:
+        return delta_sink.stats()
+    reported = [stats["delta_sink"] for stats in list(worker_stats.values())]
+    total = {
+        key: sum(stats[key] for stats in reported)
+        for key in ("backlog", "written", "full_waits", "failures", "flushes")
+    }
+    last = [stats["last_flush_ms"] for stats in reported]
+    total["last_flush_ms"] = max((ms for ms in last if ms is not None), default=None)
+    total["max_flush_ms"] = max(
+        (stats["max_flush_ms"] for stats in reported), default=0.0
+    )
+    return total
+
+
+def run_shard_process(shard: int, shard_queue, events) -> None:
+    """
+    A worker process of a ProcessWorkerPool: apply the changes of its shard
+    with the graph store, WAL, checkpoints and delta sink of this process,
+    reporting committed changes and stats through events, until stopped
+    """
+    global holds_versions
+    holds_versions = True
+    if CHANGE_FEED_BACKEND == "local":
+        # Delivered to the feed of the API process by handle_worker_event
+        change_listeners.append(lambda messages: events.put(("changes", messages)))
+    last_report = 0.0
+
+    def maintain() -> None:
+        nonlocal last_report
+        maintain_live_graphs()
+        if time.monotonic() - last_report >= WORKER_STATS_INTERVAL_SECONDS:
+            last_report = time.monotonic()
+            stats = {
+                "delta_sink": delta_sink.stats(),
+                "versions": resident_version_stats(),
+            }
+            events.put(("stats", shard, stats))
+
+    run_shard(
+        shard,
+        shard_queue,
+        process_change_batch,
+        maintain,
+        CHANGE_BATCH_SIZE,
+        MAINTENANCE_INTERVAL_SECONDS,
+    )
+    flush_live_graphs()
+
+
+def handle_worker_event(event) -> None:
+    """Take in what a worker process reported, in the API process"""
+    if event[0] == "changes":
+        notify_change_listeners(event[1])
+    elif event[0] == "stats":
+        worker_stats[event[1]] = event[2]
+
+
+# Latest stats reported by each worker process, by shard
+worker_stats: Dict[int, Dict[str, Any]] = {}
+# False in the API process when worker processes hold the versions
+holds_versions = WORKER_POOL_MODE != "process"
+
+if WORKER_POOL_MODE == "process":
+    worker_pool = ProcessWorkerPool(
+        size=WORKER_POOL_SIZE,
+        target=run_shard_process,
+        on_event=handle_worker_event,
+        batch_size=CHANGE_BATCH_SIZE,
+    )
+else:
+    worker_pool = WorkerPool(
+        size=WORKER_POOL_SIZE,
+        process_batch=process_change_batch,
+        maintain=maintain_live_graphs,
+        batch_size=CHANGE_BATCH_SIZE,
+        maintenance_interval=MAINTENANCE_INTERVAL_SECONDS,
+    )
+
+last_eviction = time.monotonic()
+worker_thread: Optional[threading.Thread] = None
+dispatcher_stop = threading.Event()
+
+
 # Function to start the worker thread
 def start_worker():
+    global worker_thread
+    # A second dispatcher would break the per-version ordering
+    if worker_thread is not None and worker_thread.is_alive():
+        return
+    dispatcher_stop.clear()
     worker_thread = threading.Thread(target=main_worker, daemon=True)
     worker_thread.start()
 
@@ -1,8 +1,9 @@
 import networkx as nx
 import logging
-from copy import deepcopy
 from typing import Dict, Any, Optional
-import uuid
+
+from .instance_store import InstanceStore
+from .transaction import GraphTransaction, transaction
 
 logger = logging.getLogger(__name__)
 
@@ -10,8 +11,9 @@ logger = logging.getLogger(__name__)
 def process_schema_create(
     payload: Dict[str, Any],
     schema_data: nx.DiGraph,
-    state_data: nx.DiGraph,
+    state_data: InstanceStore,
     timestamp: int,
+    tx: Optional[GraphTransaction] = None,
 ) -> nx.DiGraph:
     """
     Process schema creation payload and update the schema graph.
@@ -38,76 +40,86 @@ def process_schema_create(
     }
     """
     try:
-        schema = deepcopy(schema_data)
-        state = deepcopy(state_data)
-
-        # Check if this is an edge creation
-        if "source_id" in payload and "target_id" in payload:
-            source_id = payload["source_id"]
-            target_id = payload["target_id"]
-
-            # Verify both nodes exist
-            if not schema.has_node(source_id):
-                raise ValueError(f"Source node {source_id} does not exist in schema")
-            if not schema.has_node(target_id):
-                raise ValueError(f"Target node {target_id} does not exist in schema")
-
-            logger.info(f"Processing edge create: {source_id} -> {target_id}")
-
-            # Add the edge with its properties
-            schema.add_edge(
-                source_id,
-                target_id,
-                relationship_type=payload["edge_type"],
-                **payload.get("properties", {}),
-            )
-
-            logger.info(f"Edge create complete: {source_id} -> {target_id}")
-
-        # Node creation
-        else:
-            node_id = payload["node_id"]
-            logger.info(f"Processing node create: {node_id}")
-
-            # Verify node doesn't already exist
-            if schema.has_node(node_id):
-                raise ValueError(f"Node {node_id} already exists in schema")
+        with transaction(tx) as tx:
+            schema = schema_data
+            state = state_data
+
+            # Check if this is an edge creation
+            if "source_id" in payload and "target_id" in payload:
+                source_id = payload["source_id"]
+                target_id = payload["target_id"]
+
+                # Verify both nodes exist
+                if not schema.has_node(source_id):
+                    raise ValueError(
+                        f"Source node {source_id} does not exist in schema"
+                    )
+                if not schema.has_node(target_id):
+                    raise ValueError(
+                        f"Target node {target_id} does not exist in schema"
+                    )
+
+                logger.info(f"Processing edge create: {source_id} -> {target_id}")
+
+                # Add the edge with its properties
+                tx.add_edge(
+                    schema,
+                    source_id,
+                    target_id,
+                    relationship_type=payload["edge_type"],
+                    **payload.get("properties", {}),
+                )
 
-            # Add node with its properties
-            schema.add_node(
-                node_id, node_type=payload["node_type"], **payload["properties"]
-            )
+                logger.info(f"Edge create complete: {source_id} -> {target_id}")
 
-            # if units_in_chain is specified, add instances to state graph
-            properties = dict(payload["properties"])
-            logger.info(f"Available properties: {properties.keys()}")
-            if "units_in_chain" in properties.keys():
-                units = properties.get("units_in_chain")
-                logger.info(
-                    f"Adding instances to state graph for {node_id} with {units} units"
-                )
-                if units:
-                    try:
-                        units = int(units)
-                    except ValueError:
-                        units = 0
-                expiry = None
-                if "expiry" in properties.keys():
-                    try:
-                        expiry = int(properties["expiry"])
-                    except ValueError:
-                        expiry = 0
-
-                state = update_state_instances(
-                    state_data=state,
-                    parent_id=node_id,
-                    type=payload["node_type"],
-                    target_count=units,
-                    created_at=timestamp,
-                    expiry=expiry,
+            # Node creation
+            else:
+                node_id = payload["node_id"]
+                logger.info(f"Processing node create: {node_id}")
+
+                # Verify node doesn't already exist
+                if schema.has_node(node_id):
+                    raise ValueError(f"Node {node_id} already exists in schema")
+
+                # Add node with its properties
+                tx.add_node(
+                    schema,
+                    node_id,
+                    node_type=payload["node_type"],
+                    **payload["properties"],
                 )
 
-            logger.info(f"Node create complete for {node_id}")
+                # if units_in_chain is specified, add instances to state graph
+                properties = dict(payload["properties"])
+                logger.info(f"Available properties: {properties.keys()}")
+                if "units_in_chain" in properties.keys():
+                    units = properties.get("units_in_chain")
+                    logger.info(
+                        f"Adding instances to state graph for {node_id} with {units} units"
+                    )
+                    if units:
+                        try:
+                            units = int(units)
+                        except ValueError:
+                            units = 0
+                    expiry = None
+                    if "expiry" in properties.keys():
+                        try:
+                            expiry = int(properties["expiry"])
+                        except ValueError:
+                            expiry = 0
+
+                    state = update_state_instances(
+                        state_data=state,
+                        parent_id=node_id,
+                        type=payload["node_type"],
+                        target_count=units,
+                        created_at=timestamp,
+                        expiry=expiry,
+                        tx=tx,
+                    )
+
+                logger.info(f"Node create complete for {node_id}")
 
         return schema, state
 
@@ -122,8 +134,9 @@ def process_schema_create(
 def process_schema_update(
     payload: Dict[str, Any],
     schema_data: nx.DiGraph,
-    state_data: nx.DiGraph,
+    state_data: InstanceStore,
     timestamp: int,
+    tx: Optional[GraphTransaction] = None,
 ) -> nx.DiGraph:
     """
     Process schema update payload and update the schema graph.
@@ -144,55 +157,57 @@ def process_schema_update(
     Edge updates are handled through separate create/delete operations
     """
     try:
-        schema = deepcopy(schema_data)
-        state = deepcopy(state_data)
-        node_id = payload["node_id"]
-
-        logger.info(f"Processing schema update: {node_id}")
-
-        if not schema.has_node(node_id):
-            raise ValueError(f"Node {node_id} does not exist in schema")
-
-        # Update node properties
-        properties = None
-        try:
-            properties = dict(payload["updates"]["properties"])
-        except KeyError:
-            pass
-
-        if properties:
-            for key, value in properties.items():
-                schema.nodes[node_id][key] = value
-
-            # if units_in_chain is specified, add instances to state graph
-            if "units_in_chain" in properties.keys():
-                units = properties.get("units_in_chain")
-                logger.info(
-                    f"Updating instances to state graph for {node_id} to {units} units"
-                )
-                if units:
-                    try:
-                        units = int(units)
-                    except ValueError:
-                        units = 0
-
-                expiry = None
-                if "expiry" in properties.keys():
-                    try:
-                        expiry = int(properties["expiry"])
-                    except ValueError:
-                        expiry = 0
-
-                state = update_state_instances(
-                    state_data=state,
-                    parent_id=node_id,
-                    type=schema.nodes[node_id]["node_type"],
-                    target_count=units,
-                    created_at=timestamp,
-                    expiry=expiry,
-                )
+        with transaction(tx) as tx:
+            schema = schema_data
+            state = state_data
+            node_id = payload["node_id"]
+
+            logger.info(f"Processing schema update: {node_id}")
 
-        logger.info(f"Update complete for {node_id}")
+            if not schema.has_node(node_id):
+                raise ValueError(f"Node {node_id} does not exist in schema")
+
+            # Update node properties
+            properties = None
+            try:
+                properties = dict(payload["updates"]["properties"])
+            except KeyError:
+                pass
+
+            if properties:
+                for key, value in properties.items():
+                    tx.set_node_attr(schema, node_id, key, value)
+
+                # if units_in_chain is specified, add instances to state graph
+                if "units_in_chain" in properties.keys():
+                    units = properties.get("units_in_chain")
+                    logger.info(
+                        f"Updating instances to state graph for {node_id} to {units} units"
+                    )
+                    if units:
+                        try:
+                            units = int(units)
+                        except ValueError:
+                            units = 0
+
+                    expiry = None
+                    if "expiry" in properties.keys():
+                        try:
+                            expiry = int(properties["expiry"])
+                        except ValueError:
+                            expiry = 0
+
+                    state = update_state_instances(
+                        state_data=state,
+                        parent_id=node_id,
+                        type=schema.nodes[node_id]["node_type"],
+                        target_count=units,
+                        created_at=timestamp,
+                        expiry=expiry,
+                        tx=tx,
+                    )
+
+            logger.info(f"Update complete for {node_id}")
         return schema, state
 
     except KeyError as e:
@@ -206,8 +221,9 @@ def process_schema_update(
 def process_schema_delete(
     payload: Dict[str, Any],
     schema_data: nx.DiGraph,
-    state_data: nx.DiGraph,
+    state_data: InstanceStore,
     timestamp: int,
+    tx: Optional[GraphTransaction] = None,
 ) -> nx.DiGraph:
     """
     Process schema deletion payload and update the schema graph.
@@ -228,58 +244,62 @@ def process_schema_delete(
     }
     """
     try:
-        schema = deepcopy(schema_data)
-        state = deepcopy(state_data)
+        with transaction(tx) as tx:
+            schema = schema_data
+            state = state_data
+
+            # Check if this is an edge deletion
+            if "source_id" in payload and "target_id" in payload:
+                source_id = payload["source_id"]
+                target_id = payload["target_id"]
+
+                logger.info(f"Processing edge delete: {source_id} -> {target_id}")
 
-        # Check if this is an edge deletion
-        if "source_id" in payload and "target_id" in payload:
-            source_id = payload["source_id"]
-            target_id = payload["target_id"]
+                if not schema.has_edge(source_id, target_id):
+                    raise ValueError(
+                        f"Edge from {source_id} to {target_id} does not exist"
+                    )
 
-            logger.info(f"Processing edge delete: {source_id} -> {target_id}")
+                # If edge_type is specified, only delete edges of that type
+                if "edge_type" in payload:
+                    edge_data = schema.get_edge_data(source_id, target_id)
+                    if edge_data.get("relationship_type") == payload["edge_type"]:
+                        tx.remove_edge(schema, source_id, target_id)
+                else:
+                    tx.remove_edge(schema, source_id, target_id)
 
-            if not schema.has_edge(source_id, target_id):
-                raise ValueError(f"Edge from {source_id} to {target_id} does not exist")
+                logger.info(f"Edge delete complete: {source_id} -> {target_id}")
 
-            # If edge_type is specified, only delete edges of that type
-            if "edge_type" in payload:
-                edge_data = schema.get_edge_data(source_id, target_id)
-                if edge_data.get("relationship_type") == payload["edge_type"]:
-                    schema.remove_edge(source_id, target_id)
+            # Node deletion
             else:
-                schema.remove_edge(source_id, target_id)
+                node_id = payload["node_id"]
+                logger.info(f"Processing node delete: {node_id}")
 
-            logger.info(f"Edge delete complete: {source_id} -> {target_id}")
+                if not schema.has_node(node_id):
+                    raise ValueError(f"Node {node_id} does not exist in schema")
 
-        # Node deletion
-        else:
-            node_id = payload["node_id"]
-            logger.info(f"Processing node delete: {node_id}")
+                if payload.get("cascade", False):
+                    # Get all descendant nodes
+                    descendants = nx.descendants(schema, node_id)
+                    # Remove all descendants
+                    tx.remove_nodes_from(schema, descendants)
 
-            if not schema.has_node(node_id):
-                raise ValueError(f"Node {node_id} does not exist in schema")
+                node_properties = schema.nodes[node_id]
 
-            if payload.get("cascade", False):
-                # Get all descendant nodes
-                descendants = nx.descendants(schema, node_id)
-                # Remove all descendants
-                schema.remove_nodes_from(descendants)
-
-            node_properties = schema.nodes[node_id]
-
-            if "units_in_chain" in node_properties.keys():
-                state = update_state_instances(
-                    state_data=state,
-                    parent_id=node_id,
-                    type=node_properties["node_type"],
-                    target_count=0,
-                    created_at=timestamp,
-                )
+                if "units_in_chain" in node_properties.keys():
+                    state = update_state_instances(
+                        state_data=state,
+                        parent_id=node_id,
+                        type=node_properties["node_type"],
+                        target_count=0,
+                        created_at=timestamp,
+                        tx=tx,
+                    )
 
-            # Remove the target node and all its edges
-            schema.remove_node(node_id)
+                # Remove the target node and all its edges
+                tx.remove_node(schema, node_id)
 
-            logger.info(f"Node delete complete: {node_id}")
+                logger.info(f"Node delete complete: {node_id}")
 
         return schema, state
 
@@ -291,13 +311,44 @@ def process_schema_delete(
         raise
 
 
-# Function to find all nodes with specific attributes
-def find_nodes_with_property(graph, key, value):
-    return [node for node, attr in graph.nodes(data=True) if attr.get(key) == value]
+def process_state_expire(
+    payload: Dict[str, Any],
+    schema_data: nx.DiGraph,
+    state_data: InstanceStore,
+    timestamp: int,
+    tx: Optional[GraphTransaction] = None,
+) -> InstanceStore:
+    """
+    Remove the instances whose validity ended. Issued by the expiry sweeper
+    rather than by clients, and replayed like any other change.
 
+    Expected payload structure:
+    {
+        "before": int,  # instances with a valid_to up to this are removed
+        "limit": int  # Optional, the most instances removed by the change
+    }
+    """
+    try:
+        with transaction(tx) as tx:
+            expired = state_data.expire(
+                payload["before"], limit=payload.get("limit"), tx=tx
+            )
+            logger.info(
+                f"Expired {len(expired)} instances with valid_to up to {payload['before']}"
+            )
+        return state_data
 
+    except KeyError as e:
+        logger.error(f"Missing required field in expire payload: {str(e)}")
+        raise
+    except Exception as e:
+        logger.error(f"Error processing state expire: {str(e)}")
+        raise
+
+
+# Function to find all nodes with specific attributes
 def update_state_instances(
-    state_data: nx.DiGraph,
+    state_data: InstanceStore,
     parent_id: str,
     type: str,
     target_count: int,
@@ -305,59 +356,50 @@ def update_state_instances(
     expiry: Optional[
         int
     ] = None,  # Optional, if specified will use expiry instead of created_at
-) -> nx.DiGraph:
+    tx: Optional[GraphTransaction] = None,
+) -> InstanceStore:
     """
     Add instances to the state graph.
 
     Args:
-        state_data (nx.DiGraph): The state graph.
+        state_data (InstanceStore): The instances of the state graph.
         count (int): The number of instances to add.
         properties (Dict[str, Any]): The properties to add to the instances.
+        tx (GraphTransaction): Records the mutations so they can be rolled back.
 
     Returns:
-        nx.DiGraph: The updated state graph.
+        InstanceStore: The updated state graph.
     """
-    # Count all nodes in state data with parent ID
-    current_count = len(find_nodes_with_property(state_data, parent_id, parent_id))
+    current_count = state_data.count(parent_id)
 
     # If there are more instances than target count, remove excess instances
     if current_count > target_count:
         excess_count = current_count - target_count
         # remove instances by FIFO on expiry if available, otherwise by FIFO on created_at
-        for i in range(excess_count):
-            node_to_remove = sorted(
-                find_nodes_with_property(state_data, parent_id, parent_id),
-                key=lambda node: state_data.nodes[node].get(
-                    "expiry", state_data.nodes[node]["created_at"]
-                ),
-            )[i]
-            state_data.remove_node(node_to_remove)
+        state_data.remove_oldest(parent_id, excess_count, tx=tx)
 
         logger.info(f"Removed {excess_count} of {type} instances from state graph")
 
     elif current_count < target_count:
         # Add instances
-        for i in range(target_count - current_count):
-            # Convert UUID to string when creating node
-            node_id = str(uuid.uuid4())
-            if expiry is not None:
-                valid_from = created_at
-                valid_to = created_at + expiry
-                state_data.add_node(
-                    node_id,  # Use string UUID
-                    parent_id=parent_id,
-                    type=type,
-                    created_at=created_at,
-                    valid_from=valid_from,
-                    valid_to=valid_to,
-                )
-            else:
-                state_data.add_node(
-                    node_id,  # Use string UUID
-                    parent_id=parent_id,
-                    type=type,
-                    created_at=created_at,
-                )
+        if expiry is not None:
+            state_data.add(
+                parent_id,
+                type,
+                target_count - current_count,
+                created_at=created_at,
+                valid_from=created_at,
+                valid_to=created_at + expiry,
+                tx=tx,
+            )
+        else:
+            state_data.add(
+                parent_id,
+                type,
+                target_count - current_count,
+                created_at=created_at,
+                tx=tx,
+            )
         logger.info(
             f"Added {target_count - current_count} of {type} instances to state graph"
         )
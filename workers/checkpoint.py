@@ -0,0 +1,198 @@
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from networkx.readwrite import json_graph
+
+from utils.archive import GRAPH_FILE_SUFFIXES
+
+from .graph_store import LiveGraphs
+from .instance_store import InstanceStore
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_FILE = "checkpoint.json"
+
+# The live file of each graph: its name, directory and base name
+LIVE_FILES = (
+    ("schema", "LIVESCHEMA_PATH", "current_schema"),
+    ("state", "LIVESTATE_PATH", "current_state"),
+)
+
+
+def checkpoint_path(paths: Dict[str, str]) -> str:
+    return os.path.join(paths["LIVESTATE_PATH"], CHECKPOINT_FILE)
+
+
+def wal_directory(paths: Dict[str, str]) -> str:
+    return os.path.join(paths["LIVESTATE_PATH"], "wal")
+
+
+def load_checkpoint(paths: Dict[str, str]) -> Optional[Dict[str, Any]]:
+    """Return the latest checkpoint of a version, or None if it has none yet"""
+    try:
+        with open(checkpoint_path(paths), "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def finish_checkpoint(
+    paths: Dict[str, str], checkpoint: Dict[str, Any]
+) -> Dict[str, str]:
+    """
+    Move the live files a checkpoint was written to into place, if a crash
+    left them staged, and return the path of each. Files staged by a
+    checkpoint that never got recorded are removed.
+    """
+    files = {}
+    for name, directory_key, base_name in LIVE_FILES:
+        directory = paths[directory_key]
+        entry = checkpoint["files"][name]
+        staged = os.path.join(directory, entry["staged"])
+        path = os.path.join(directory, entry["file"])
+        if os.path.exists(staged):
+            os.replace(staged, path)
+
+        leftover = re.compile(rf"{re.escape(base_name)}\.\d+\.")
+        for file_name in os.listdir(directory):
+            stale = leftover.match(file_name) or any(
+                file_name == base_name + suffix for suffix in GRAPH_FILE_SUFFIXES
+            )
+            if stale and file_name != entry["file"]:
+                os.remove(os.path.join(directory, file_name))
+        files[name] = path
+    return files
+
+
+class Checkpointer:
+    """
+    Writes checkpoints of the live graphs in the background.
+
+    A checkpoint is due once a version has ``every_changes`` changes, or any
+    change older than ``interval_seconds``, that are only recorded in its WAL.
+    The graphs are snapshotted on the calling worker thread, which is the only
+    one mutating them; encoding and writing happen on a background thread.
+    Each graph is written once, to a file staged next to its live file. Then
+    the checkpoint file is written atomically, recording the WAL sequence
+    number the checkpoint covers, the version's current timestamp, the time
+    its generation was last published and the staged files, and these are
+    moved over the live files read by the API. A version is loaded from the
+    live files its checkpoint points at, in the binary snapshot format when
+    SNAPSHOT_FORMAT is "binary", with the WAL replayed after that sequence
+    number; a crash before the files are moved leaves them to be moved on
+    load, one before the checkpoint file is written leaves the previous
+    checkpoint and its files whole. The WAL segments it covers are deleted once
+    ``written_through`` reports their rows written to Postgres too, the
+    others are replayed into the delta sink when the version is loaded again.
+    """
+
+    def __init__(
+        self,
+        write_json: Callable[..., None],
+        write_graph: Callable[[str, Dict[str, Any]], str],
+        every_changes: int = 1000,
+        interval_seconds: float = 10,
+        written_through: Optional[Callable[[str], int]] = None,
+    ):
+        self._write_json = write_json
+        self._write_graph = write_graph
+        self._written_through = written_through
+        self._every_changes = max(1, every_changes)
+        self._interval_seconds = interval_seconds
+        self._queue: "queue.Queue" = queue.Queue()
+        self._in_flight = set()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def is_due(self, live: LiveGraphs) -> bool:
+        pending = live.seq - live.checkpoint_seq
+        if pending <= 0:
+            return False
+        return (
+            pending >= self._every_changes
+            or time.monotonic() - live.last_checkpoint >= self._interval_seconds
+        )
+
+    def maybe_checkpoint(self, live: LiveGraphs, paths: Dict[str, str]) -> bool:
+        if not self.is_due(live):
+            return False
+        return self.checkpoint(live, paths)
+
+    def checkpoint(self, live: LiveGraphs, paths: Dict[str, str]) -> bool:
+        """Snapshot the graphs of a version and queue the snapshot to be written"""
+        with self._lock:
+            # Let the previous checkpoint of this version finish first
+            if live.version in self._in_flight:
+                return False
+            self._in_flight.add(live.version)
+
+        snapshot = {
+            "seq": live.seq,
+            "timestamp": live.current_timestamp,
+            "modified_at": live.modified_at,
+            "schema": json_graph.node_link_data(live.schema),
+            # Copied now, rendered on the background thread
+            "state": live.state.copy(),
+        }
+        live.wal.rotate()
+        live.checkpoint_seq = live.seq
+        live.last_checkpoint = time.monotonic()
+
+        self._ensure_thread()
+        self._queue.put((live.version, live.wal, paths, snapshot))
+        return True
+
+    def flush(self) -> None:
+        """Block until every queued checkpoint has been written"""
+        self._queue.join()
+
+    def _ensure_thread(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            version, wal, paths, snapshot = self._queue.get()
+            try:
+                started = time.perf_counter()
+                if isinstance(snapshot["state"], InstanceStore):
+                    snapshot["state"] = snapshot["state"].node_link_data()
+                checkpoint = {
+                    key: snapshot[key] for key in ("seq", "timestamp", "modified_at")
+                }
+                checkpoint["files"] = {}
+                for name, directory_key, base_name in LIVE_FILES:
+                    staged_base = os.path.join(
+                        paths[directory_key], f"{base_name}.{snapshot['seq']}"
+                    )
+                    staged = self._write_graph(staged_base, snapshot[name])
+                    suffix = staged[len(staged_base) :]
+                    checkpoint["files"][name] = {
+                        "file": base_name + suffix,
+                        "staged": os.path.basename(staged),
+                    }
+                self._write_json(checkpoint_path(paths), checkpoint, indent=None)
+                finish_checkpoint(paths, checkpoint)
+                discard_seq = snapshot["seq"]
+                if self._written_through is not None:
+                    discard_seq = min(discard_seq, self._written_through(version))
+                wal.discard_through(discard_seq)
+                logger.info(
+                    f"Checkpointed version {version} at seq {snapshot['seq']} in "
+                    f"{(time.perf_counter() - started) * 1000:.1f} ms"
+                )
+            except Exception as e:
+                logger.error(
+                    f"Error writing checkpoint for version {version}: {str(e)}"
+                )
+            finally:
+                with self._lock:
+                    self._in_flight.discard(version)
+                self._queue.task_done()
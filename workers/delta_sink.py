@@ -0,0 +1,180 @@
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# One row of the state_deltas table: version, seq, timestamp, applied
+# timestamp, action, change type and the change payload
+DeltaRow = Tuple[str, int, int, Optional[int], str, str, Dict[str, Any]]
+
+
+class DeltaSink:
+    """
+    Records applied changes in Postgres from a background thread.
+
+    Workers hand over the rows of changes they made durable with
+    :meth:`record`, which returns at once unless ``max_backlog`` rows are
+    waiting: then it blocks until the writer has made room, so a worker stops
+    taking changes rather than losing their rows. The writer thread collects
+    rows until it has ``batch_size`` of them or the oldest has waited
+    ``flush_interval_ms``, then writes them in one call to ``write``. A failed
+    write is retried with the same rows after ``retry_seconds``. Rows are
+    written in the order they were recorded, so :meth:`written_through` is a
+    seq below which every recorded row of a version is in Postgres.
+    """
+
+    def __init__(
+        self,
+        write: Callable[[List[DeltaRow]], None],
+        batch_size: int = 500,
+        flush_interval_ms: float = 1000,
+        max_backlog: int = 100000,
+        retry_seconds: float = 1,
+    ):
+        self._write = write
+        self._batch_size = max(1, batch_size)
+        self._flush_interval = flush_interval_ms / 1000
+        self._retry_seconds = retry_seconds
+        self._queue: "queue.Queue[DeltaRow]" = queue.Queue(maxsize=max(1, max_backlog))
+        self._pending: List[DeltaRow] = []
+        self._flush_requested = threading.Event()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        # Highest seq written per version
+        self._written_seq: Dict[str, int] = {}
+
+        self.written = 0
+        self.full_waits = 0
+        self.failures = 0
+        self.flushes = 0
+        self.last_flush_ms: Optional[float] = None
+        self.max_flush_ms = 0.0
+
+    def record(self, rows: List[DeltaRow]) -> None:
+        if not rows:
+            return
+        self._ensure_thread()
+        waited = False
+        for row in rows:
+            try:
+                self._queue.put_nowait(row)
+            except queue.Full:
+                if not waited:
+                    waited = True
+                    with self._lock:
+                        self.full_waits += 1
+                    logger.warning(
+                        f"Delta sink backlog full, waiting to record {len(rows)} deltas"
+                    )
+                self._queue.put(row)
+
+    def written_through(self, version: str) -> int:
+        """Highest seq of a version written to Postgres, 0 if none was"""
+        with self._lock:
+            return self._written_seq.get(version, 0)
+
+    def backlog(self) -> int:
+        """Rows recorded but not written yet"""
+        return self._queue.qsize() + len(self._pending)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "backlog": self.backlog(),
+                "written": self.written,
+                "full_waits": self.full_waits,
+                "failures": self.failures,
+                "flushes": self.flushes,
+                "last_flush_ms": self.last_flush_ms,
+                "max_flush_ms": self.max_flush_ms,
+            }
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Write everything recorded so far without waiting for the flush
+        interval. Returns False if rows are still pending after timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.backlog():
+            if self._thread is None or not self._thread.is_alive():
+                return False
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            self._flush_requested.set()
+            time.sleep(0.01)
+        return True
+
+    def _ensure_thread(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(
+                target=self._run, name="delta-sink", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self) -> None:
+        oldest = None
+        while True:
+            if not self._pending:
+                timeout = self._flush_interval
+            else:
+                timeout = max(0, oldest + self._flush_interval - time.monotonic())
+            if len(self._pending) < self._batch_size:
+                try:
+                    self._pending.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    pass
+
+            while len(self._pending) < self._batch_size:
+                try:
+                    self._pending.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            if not self._pending:
+                continue
+            if oldest is None:
+                oldest = time.monotonic()
+            if (
+                len(self._pending) < self._batch_size
+                and time.monotonic() - oldest < self._flush_interval
+                and not self._flush_requested.is_set()
+            ):
+                continue
+
+            self._flush_requested.clear()
+            if self._flush_pending():
+                oldest = None
+            else:
+                time.sleep(self._retry_seconds)
+
+    def _flush_pending(self) -> bool:
+        started = time.perf_counter()
+        try:
+            self._write(self._pending)
+        except Exception as e:
+            with self._lock:
+                self.failures += 1
+            logger.error(
+                f"Error writing {len(self._pending)} deltas to postgres: {str(e)}"
+            )
+            return False
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            for row in self._pending:
+                version, seq = row[0], row[1]
+                if seq > self._written_seq.get(version, 0):
+                    self._written_seq[version] = seq
+            self.written += len(self._pending)
+            self.flushes += 1
+            self.last_flush_ms = elapsed_ms
+            self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+        logger.info(
+            f"Wrote {len(self._pending)} deltas to postgres in {elapsed_ms:.1f} ms "
+            f"({self._queue.qsize()} waiting)"
+        )
+        self._pending = []
+        return True
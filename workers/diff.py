@@ -0,0 +1,70 @@
+import os
+from typing import Any, Dict, Optional
+
+from utils.archive import build_delta, read_graph_file
+
+from .graph_store import LiveGraphs
+from .instance_store import node_link_data
+from .subgraph import LINKS_KEY
+
+
+def graph_diff(
+    live: LiveGraphs,
+    name: str,
+    since: Optional[int] = None,
+    since_timestamp: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Changes to the schema or state graph of a version after generation since,
+    or after the changes up to since_timestamp.
+
+    Nodes and edges touched since then are listed with their current
+    attributes under "nodes" and the usual edge key, to be upserted, and the
+    ones that no longer exist under "removed_nodes" and "removed_links".
+    When the change log does not reach back far enough, "full" is true and
+    the whole graph is returned in its place. "generation" is the point the
+    result is current to, to pass as since next time.
+    """
+    with live.lock:
+        graph = live.schema if name == "schema" else live.state
+        changes = live.changes_since(since, since_timestamp)
+        if changes is None:
+            data = node_link_data(graph)
+        else:
+            nodes, edges = changes[name]
+            data = build_delta(graph, None, nodes, edges)
+            del data["base"]
+            data[LINKS_KEY] = data.pop("links")
+        generation = live.seq
+
+    return {
+        "version": live.version,
+        "since": since,
+        "since_timestamp": since_timestamp,
+        "generation": generation,
+        "full": changes is None,
+        **data,
+    }
+
+
+def file_diff(
+    version: str,
+    path: str,
+    since: Optional[int] = None,
+    since_timestamp: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    graph_diff of a version that is not resident: the whole graph of its live
+    file, which has no change log to diff against. "generation" is None, the
+    point the file is current to is not known.
+    """
+    data = read_graph_file(path) if os.path.exists(path) else {"nodes": []}
+    data.setdefault(LINKS_KEY, data.pop("links", []))
+    return {
+        "version": version,
+        "since": since,
+        "since_timestamp": since_timestamp,
+        "generation": None,
+        "full": True,
+        **data,
+    }
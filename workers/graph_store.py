@@ -0,0 +1,288 @@
+import threading
+import time
+import logging
+from collections import OrderedDict, deque
+from typing import Callable, Deque, Dict, List, Optional, Set, Tuple
+
+import networkx as nx
+
+from .instance_store import InstanceStore
+from .rollup import InventoryRollup
+from .transaction import GraphTransaction
+
+logger = logging.getLogger(__name__)
+
+
+class LiveGraphs:
+    """In-memory schema and state graphs for a single version"""
+
+    def __init__(
+        self,
+        version: str,
+        schema: nx.DiGraph,
+        state: InstanceStore,
+        wal=None,
+        seq: int = 0,
+        change_log_size: int = 1000,
+    ):
+        self.version = version
+        self.schema = schema
+        self.state = state
+        self.last_used = time.monotonic()
+
+        # Held while the graphs are mutated or snapshotted
+        self.lock = threading.RLock()
+
+        # Timestamp of the last applied change, archives are taken when it moves
+        self.current_timestamp = None
+
+        # Write-ahead log of the version; seq is the last change applied to the
+        # graphs and checkpoint_seq the last one covered by a checkpoint
+        self.wal = wal
+        self.seq = seq
+        self.checkpoint_seq = seq
+        self.last_checkpoint = time.monotonic()
+
+        # Last seq whose changes have been published by a save, and the wall
+        # clock time of that save. Readers tag what they serve with it.
+        self.generation = seq
+        self.modified_at = time.time()
+
+        # Monotonic time from which the expiry sweeper looks at the version again
+        self.next_expiry_sweep = 0.0
+
+        # Rows of the applied changes not yet handed to the delta sink
+        self.pending_deltas: List[Tuple] = []
+
+        # Set once the version is evicted and its WAL closed; changes must go
+        # to the graphs loaded in its place
+        self.closed = False
+
+        # Nodes and edges touched since the last publish, and for each of the
+        # last change_log_size generations (generation, timestamp, touched).
+        # The log starts after the generation and timestamp of change_log_floor.
+        self.unpublished_changes = self._empty_changes()
+        self.change_log: Deque[Tuple[int, Optional[int], Dict]] = deque()
+        self.change_log_size = max(1, change_log_size)
+        self.change_log_floor: Tuple[int, Optional[float]] = (seq, None)
+
+        # Instance counts per schema node rolled up the schema, built by the
+        # loader once the graphs are complete and updated by record_changes
+        self.rollup = InventoryRollup()
+
+        # Nodes and edges touched since the last archive, per graph. None until
+        # the version has been archived once since it was loaded, in which case
+        # the next archive has to be a keyframe.
+        self.archive_timestamp = None
+        self.archives_since_keyframe = 0
+        self.archive_changes: Optional[Dict[str, Tuple[Set, Set]]] = None
+
+    def touch(self) -> None:
+        self.last_used = time.monotonic()
+
+    def publish(self) -> bool:
+        """
+        Bump the generation to the last applied change and log what the new
+        generation touched. True if the generation moved.
+        """
+        if self.seq == self.generation:
+            return False
+        self.change_log.append(
+            (self.seq, self.current_timestamp, self.unpublished_changes)
+        )
+        self.unpublished_changes = self._empty_changes()
+        while len(self.change_log) > self.change_log_size:
+            generation, timestamp, _ = self.change_log.popleft()
+            self.change_log_floor = (generation, timestamp)
+
+        self.generation = self.seq
+        self.modified_at = time.time()
+        return True
+
+    def reset_change_log(self) -> None:
+        self.change_log.clear()
+        self.unpublished_changes = self._empty_changes()
+        timestamp = self.current_timestamp
+        if timestamp is None and not self.schema and not self.state:
+            # Nothing precedes the log of an empty version
+            timestamp = float("-inf")
+        self.change_log_floor = (self.seq, timestamp)
+
+    def changes_since(
+        self, generation: Optional[int] = None, timestamp: Optional[int] = None
+    ) -> Optional[Dict[str, Tuple[Set, Set]]]:
+        """
+        Nodes and edges of each graph touched after a generation, or by the
+        changes with a timestamp after timestamp, up to the last applied
+        change. None if the change log does not reach back that far.
+        """
+        floor_generation, floor_timestamp = self.change_log_floor
+        if generation is not None:
+            if not floor_generation <= generation <= self.seq:
+                return None
+            entries = [c for g, _, c in self.change_log if g > generation]
+        elif timestamp is not None:
+            # Changes before the floor have timestamps up to floor_timestamp
+            if floor_timestamp is None or timestamp < floor_timestamp:
+                return None
+            entries = [c for _, t, c in self.change_log if t is None or t > timestamp]
+        else:
+            return None
+
+        changes = self._empty_changes()
+        for entry in entries + [self.unpublished_changes]:
+            for name, (nodes, edges) in entry.items():
+                changes[name][0].update(nodes)
+                changes[name][1].update(edges)
+        return changes
+
+    def record_changes(self, tx: GraphTransaction) -> None:
+        """
+        Record what a change touched for the next archive and the change log,
+        and update the inventory rollups
+        """
+        for changes in (self.archive_changes, self.unpublished_changes):
+            if changes is None:
+                continue
+            for name, graph in (("schema", self.schema), ("state", self.state)):
+                nodes, edges = changes[name]
+                nodes.update(tx.touched_nodes(graph))
+                edges.update(tx.touched_edges(graph))
+
+        self.rollup.update(
+            self.schema,
+            self.state,
+            tx.touched_nodes(self.schema),
+            tx.touched_edges(self.schema),
+            self.state.take_changed_parents(),
+        )
+
+    def reset_archive_changes(self) -> None:
+        self.archive_changes = self._empty_changes()
+
+    @staticmethod
+    def _empty_changes() -> Dict[str, Tuple[Set, Set]]:
+        return {"schema": (set(), set()), "state": (set(), set())}
+
+
+class GraphStore:
+    """
+    Keeps the live graphs of each version resident in memory.
+
+    A version is loaded through ``loader`` the first time it is requested and
+    is mutated in place from then on; the files on disk are only read again
+    after the version has been evicted. Versions are evicted when they have
+    been idle for longer than ``idle_seconds`` or, least recently used first,
+    when more than ``max_versions`` are resident. ``on_evict`` is called with
+    every evicted entry.
+    """
+
+    def __init__(
+        self,
+        loader: Callable[[str], LiveGraphs],
+        max_versions: int = 16,
+        idle_seconds: Optional[float] = 600,
+        on_evict: Optional[Callable[[LiveGraphs], None]] = None,
+    ):
+        self._loader = loader
+        self._on_evict = on_evict
+        self._max_versions = max(1, max_versions)
+        self._idle_seconds = idle_seconds
+        self._versions: "OrderedDict[str, LiveGraphs]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, version: str) -> LiveGraphs:
+        """Return the live graphs for a version, loading them on first use"""
+        with self._lock:
+            entry = self._versions.get(version)
+            if entry is not None:
+                self._versions.move_to_end(version)
+                entry.touch()
+                return entry
+
+        entry = self._loader(version)
+        logger.info(
+            f"Loaded version {version} into graph store "
+            f"({entry.schema.number_of_nodes()} schema nodes, "
+            f"{entry.state.number_of_nodes()} state nodes)"
+        )
+
+        with self._lock:
+            # Another thread may have loaded the same version in the meantime
+            existing = self._versions.get(version)
+            if existing is None:
+                self._versions[version] = entry
+                evicted = self._evict_overflow()
+            else:
+                self._versions.move_to_end(version)
+                existing.touch()
+                evicted = [entry]
+
+        self._evicted(evicted)
+        return existing or entry
+
+    def peek(self, version: str) -> Optional[LiveGraphs]:
+        """Return the live graphs for a version only if they are already resident"""
+        with self._lock:
+            return self._versions.get(version)
+
+    def evict(self, version: str) -> bool:
+        with self._lock:
+            entry = self._versions.pop(version, None)
+        if entry is None:
+            return False
+        self._evicted([entry])
+        return True
+
+    def evict_idle(self) -> List[str]:
+        """Drop every version that has not been used within the idle timeout"""
+        if self._idle_seconds is None:
+            return []
+
+        cutoff = time.monotonic() - self._idle_seconds
+        with self._lock:
+            evicted = [
+                entry for entry in self._versions.values() if entry.last_used < cutoff
+            ]
+            for entry in evicted:
+                del self._versions[entry.version]
+
+        for entry in evicted:
+            logger.info(f"Evicted idle version {entry.version} from graph store")
+        self._evicted(evicted)
+        return [entry.version for entry in evicted]
+
+    def versions(self) -> List[str]:
+        with self._lock:
+            return list(self._versions.keys())
+
+    def entries(self) -> List[LiveGraphs]:
+        with self._lock:
+            return list(self._versions.values())
+
+    def __contains__(self, version: str) -> bool:
+        with self._lock:
+            return version in self._versions
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._versions)
+
+    def _evict_overflow(self) -> List[LiveGraphs]:
+        evicted = []
+        while len(self._versions) > self._max_versions:
+            version, entry = self._versions.popitem(last=False)
+            logger.info(
+                f"Evicted least recently used version {version} from graph store"
+            )
+            evicted.append(entry)
+        return evicted
+
+    def _evicted(self, entries: List[LiveGraphs]) -> None:
+        if self._on_evict is None:
+            return
+        for entry in entries:
+            try:
+                self._on_evict(entry)
+            except Exception as e:
+                logger.error(f"Error evicting version {entry.version}: {str(e)}")
@@ -0,0 +1,143 @@
+import logging
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import networkx as nx
+from networkx.readwrite import json_graph
+
+from utils.archive import get_timeline, load_archive
+
+from .instance_store import InstanceStore
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryUnavailable(Exception):
+    """The archives and the delta log cannot rebuild a version at a timestamp"""
+
+
+def find_anchor(
+    paths: Dict[str, str], timestamp: int
+) -> Optional[Tuple[int, Dict[str, Any], Dict[str, Any]]]:
+    """
+    Return the latest archive at or before timestamp as (archive timestamp,
+    schema data, state data), provided it records the seq of the last change
+    it contains. None if there is no such archive.
+    """
+    ts = get_timeline(paths["STATEARCHIVE_PATH"]).at_or_before(timestamp)
+    if ts is None:
+        return None
+
+    state = load_archive(paths["STATEARCHIVE_PATH"], ts)
+    schema = load_archive(paths["SCHEMAARCHIVE_PATH"], ts)
+    # Archives written before seqs were recorded cannot anchor a replay
+    if state is None or schema is None or "seq" not in state:
+        return None
+    if schema.get("seq") != state["seq"]:
+        return None
+    return ts, schema, state
+
+
+def fetch_deltas(
+    cursor, version: str, after_seq: int, from_timestamp: Optional[int], timestamp: int
+) -> List[Tuple]:
+    """
+    Rows of the changes of a version after after_seq with a timestamp up to
+    timestamp, in the order they were applied. The (version, timestamp) index
+    bounds the scan to the rows since the anchor.
+    """
+    if from_timestamp is None:
+        cursor.execute(
+            """
+            SELECT seq, timestamp, applied_timestamp, action, change_type, change_data
+            FROM state_deltas
+            WHERE version = %s AND timestamp <= %s AND seq > %s
+            ORDER BY seq
+        """,
+            (version, timestamp, after_seq),
+        )
+    else:
+        cursor.execute(
+            """
+            SELECT seq, timestamp, applied_timestamp, action, change_type, change_data
+            FROM state_deltas
+            WHERE version = %s AND timestamp BETWEEN %s AND %s AND seq > %s
+            ORDER BY seq
+        """,
+            (version, from_timestamp, timestamp, after_seq),
+        )
+    return cursor.fetchall()
+
+
+def reconstruct(
+    version: str,
+    timestamp: int,
+    paths: Dict[str, str],
+    pool,
+    apply_change: Callable[..., Any],
+) -> Dict[str, Any]:
+    """
+    Rebuild the schema and state of a version as of a timestamp: after every
+    change with a timestamp up to it. The latest archive at or before the
+    timestamp is the starting point and the changes recorded in state_deltas
+    since that archive are replayed onto it with ``apply_change``, so the cost
+    is bounded by the archive interval rather than by the history length.
+    Change timestamps are assumed not to go backwards, as for archiving.
+    """
+    anchor = find_anchor(paths, timestamp)
+    if anchor is not None:
+        anchor_timestamp, schema_data, state_data = anchor
+        seq = state_data.pop("seq")
+        schema_data.pop("seq", None)
+        schema = json_graph.node_link_graph(schema_data)
+        state = InstanceStore.from_node_link_data(state_data)
+    else:
+        anchor_timestamp = None
+        seq = 0
+        schema = nx.DiGraph()
+        state = InstanceStore()
+
+    conn = pool.getconn()
+    try:
+        with conn.cursor() as cursor:
+            rows = fetch_deltas(cursor, version, seq, anchor_timestamp, timestamp)
+        conn.rollback()
+    finally:
+        pool.putconn(conn)
+
+    for row_seq, row_timestamp, applied_timestamp, action, change_type, data in rows:
+        if row_seq != seq + 1:
+            raise HistoryUnavailable(
+                f"Delta log of version {version} is missing changes "
+                f"{seq + 1} to {row_seq - 1}"
+            )
+        change = {
+            "action": action,
+            "type": change_type,
+            "timestamp": row_timestamp,
+            "payload": data,
+            "version": version,
+        }
+        try:
+            apply_change(change, schema, state, applied_timestamp)
+        except Exception as e:
+            logger.error(f"Error replaying delta {row_seq} of {version}: {str(e)}")
+        seq = row_seq
+
+    if anchor is None and seq == 0:
+        raise HistoryUnavailable(
+            f"No archive or recorded change of version {version} at or before {timestamp}"
+        )
+
+    logger.info(
+        f"Rebuilt version {version} as of {timestamp} from archive "
+        f"{anchor_timestamp} and {len(rows)} deltas"
+    )
+    return {
+        "version": version,
+        "timestamp": timestamp,
+        "anchor": anchor_timestamp,
+        "seq": seq,
+        "replayed": len(rows),
+        "schema": json_graph.node_link_data(schema),
+        "state": state.node_link_data(),
+    }
@@ -0,0 +1,821 @@
+import heapq
+import itertools
+from typing import Any, Dict, Hashable, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+from networkx.readwrite import json_graph
+
+from utils.compression import EncodedColumn, column_values, layout_node_link_data
+
+from .subgraph import LINKS_KEY
+from .transaction import GraphTransaction
+
+# Stands for an absent created_at, valid_from or valid_to
+MISSING = np.iinfo(np.int64).min
+
+# Columns of the instances; parent_id and type are codes into interned tables
+INSTANCE_DTYPE = np.dtype(
+    [
+        ("id", np.int64),
+        ("parent", np.int32),
+        ("type", np.int32),
+        ("created_at", np.int64),
+        ("valid_from", np.int64),
+        ("valid_to", np.int64),
+        ("alive", np.bool_),
+    ]
+)
+
+INITIAL_CAPACITY = 1024
+
+# Graph attribute saving the id the next instance gets, so the ids of
+# instances trimmed or expired before a save are not given out again
+NEXT_ID_KEY = "next_id"
+
+
+def instance_sort_key(
+    created_at: Optional[int], valid_to: Optional[int]
+) -> Tuple[int, int]:
+    """FIFO order of an instance: on expiry (valid_to) if set, otherwise on created_at"""
+    created_at = created_at or 0
+    return (created_at if valid_to is None else valid_to, created_at)
+
+
+def _optional(value: int) -> Optional[int]:
+    return None if value == MISSING else value
+
+
+def _column_length(column: Any) -> int:
+    return column["count"] if isinstance(column, dict) else len(column)
+
+
+def _int_column(column: Any, count: int) -> Optional[np.ndarray]:
+    """
+    int64 values of a snapshot layout column, MISSING for None or an absent
+    column (None). None if the column holds anything else.
+    """
+    if column is None:
+        return np.full(count, MISSING, dtype=np.int64)
+    if isinstance(column, np.ndarray):
+        return column.astype(np.int64, copy=False) if column.dtype.kind == "i" else None
+    if isinstance(column, EncodedColumn):
+        return None
+    values = column_values(column)
+    if not all(value is None or type(value) is int for value in values):
+        return None
+    try:
+        return np.array(
+            [MISSING if value is None else value for value in values], dtype=np.int64
+        )
+    except OverflowError:
+        return None
+
+
+def _interned_column(column: Any, count: int, interned: "_Interned") -> np.ndarray:
+    """Codes in interned of the values of a snapshot layout column"""
+    if isinstance(column, EncodedColumn):
+        table = np.array([interned.code(v) for v in column.values], dtype=np.int32)
+        return table[column.codes]
+    if isinstance(column, dict):
+        return np.full(count, interned.code(column["const"]), dtype=np.int32)
+    values = [None] * count if column is None else column_values(column)
+    return np.fromiter((interned.code(v) for v in values), dtype=np.int32, count=count)
+
+
+class _Interned:
+    """Table of distinct values and the integer code of each"""
+
+    def __init__(self):
+        self.values: List[Hashable] = []
+        self.codes: Dict[Hashable, int] = {}
+
+    def code(self, value: Hashable) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+class _Columns:
+    """
+    One contiguous array per field of INSTANCE_DTYPE, so searching and
+    filtering a column does not stride over the others
+    """
+
+    def __init__(self, capacity: int):
+        self.arrays = {
+            name: np.zeros(capacity, dtype=INSTANCE_DTYPE[name])
+            for name in INSTANCE_DTYPE.names
+        }
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.arrays[name]
+
+    def __len__(self) -> int:
+        return len(self.arrays["id"])
+
+    @property
+    def nbytes(self) -> int:
+        return sum(array.nbytes for array in self.arrays.values())
+
+    def select(self, size: int, capacity: int) -> "_Columns":
+        """Columns holding the live rows among the first size ones"""
+        alive = self.arrays["alive"][:size]
+        live = {name: array[:size][alive] for name, array in self.arrays.items()}
+        columns = _Columns(max(capacity, len(live["id"])))
+        for name, array in live.items():
+            columns.arrays[name][: len(array)] = array
+        return columns
+
+    def grown(self, size: int, capacity: int) -> "_Columns":
+        columns = _Columns(capacity)
+        for name, array in self.arrays.items():
+            columns.arrays[name][:size] = array[:size]
+        return columns
+
+
+class _Run:
+    """
+    Instances of one parent added together, which share their type and FIFO
+    key. The run covers the ids from start to end; ids before start were
+    trimmed.
+    """
+
+    __slots__ = ("key", "type", "start", "end")
+
+    def __init__(self, key: Tuple[int, int], type: int, start: int, end: int):
+        self.key = key
+        self.type = type
+        self.start = start
+        self.end = end
+
+
+class _NodeView:
+    """The subset of networkx's NodeView used on the state graph"""
+
+    def __init__(self, store: "InstanceStore"):
+        self._store = store
+
+    def __call__(self, data: bool = False):
+        if data:
+            return self._store.items()
+        return iter(self._store)
+
+    def __getitem__(self, node_id: Hashable) -> Dict[str, Any]:
+        row = self._store._row(node_id)
+        if row is None:
+            raise KeyError(node_id)
+        return self._store._record(row)
+
+    def __contains__(self, node_id: Hashable) -> bool:
+        return self._store.has_node(node_id)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._store)
+
+    def __len__(self) -> int:
+        return len(self._store)
+
+
+class InstanceStore:
+    """
+    Columnar store of the state graph instances.
+
+    Instances are rows of NumPy columns laid out as INSTANCE_DTYPE, with
+    integer ids handed out in increasing order, so the id column stays sorted
+    and rows are found by binary search. parent_id and type are interned.
+    Removed rows are only flagged until :meth:`compact` drops them, which keeps
+    removals reversible by a transaction.
+
+    The instances of a parent are kept as runs, one per batch added together,
+    in a min-heap on their FIFO key, so the oldest instances of a parent are
+    trimmed a run at a time without sorting. Runs with a valid_to are also in
+    a min-heap on it across parents, so expiring instances costs in proportion
+    to the runs that expired rather than to the store. The store answers the read side
+    of the networkx graph interface the archives and diffs use, and
+    :meth:`node_link_data` renders it in node-link form with no edges.
+    """
+
+    def __init__(self, capacity: int = INITIAL_CAPACITY):
+        self.graph: Dict[str, Any] = {}
+        self._rows = _Columns(max(1, capacity))
+        self._size = 0
+        self._alive = 0
+        self._next_id = 1
+        self._parents = _Interned()
+        self._types = _Interned()
+        self._runs: Dict[int, List[Tuple[Tuple[int, int], int, _Run]]] = {}
+        # (valid_to, first id, parent, run); runs emptied otherwise are
+        # dropped when they reach the top
+        self._expiry: List[Tuple[int, int, int, _Run]] = []
+        self._counts: Dict[int, int] = {}
+        # Instances per parent and type code, for inventory rollups
+        self._type_counts: Dict[int, Dict[int, int]] = {}
+        self._changed_parents: Set[int] = set()
+        self._run_counter = itertools.count()
+
+    @classmethod
+    def from_node_link_data(cls, data: Dict[str, Any]) -> "InstanceStore":
+        """
+        Load node-link data of a state graph. Instances keep integer ids; other
+        ids, such as the uuids instances used to have, are replaced by new
+        integer ids. Nodes without a parent_id are not instances and skipped.
+        """
+        nodes = data.get("nodes") or []
+        store = cls(capacity=len(nodes))
+        store._load_graph_data(data.get("graph"))
+        instances = [node for node in nodes if node.get("parent_id") is not None]
+        if not instances:
+            return store
+
+        integer_ids = all(
+            isinstance(node.get("id"), int) and not isinstance(node["id"], bool)
+            for node in instances
+        )
+        if integer_ids:
+            instances.sort(key=lambda node: node["id"])
+        else:
+            # Keep the instances of a run next to each other under new ids
+            instances.sort(
+                key=lambda node: (
+                    str(node["parent_id"]),
+                    instance_sort_key(node.get("created_at"), node.get("valid_to")),
+                )
+            )
+
+        def column(key):
+            return [
+                MISSING if node.get(key) is None else node[key] for node in instances
+            ]
+
+        count = len(instances)
+        rows = store._rows
+        if integer_ids:
+            rows["id"][:count] = [node["id"] for node in instances]
+        else:
+            rows["id"][:count] = np.arange(1, count + 1)
+        rows["parent"][:count] = [
+            store._parents.code(node["parent_id"]) for node in instances
+        ]
+        rows["type"][:count] = [
+            store._types.code(node.get("type")) for node in instances
+        ]
+        rows["created_at"][:count] = column("created_at")
+        rows["valid_from"][:count] = column("valid_from")
+        rows["valid_to"][:count] = column("valid_to")
+        rows["alive"][:count] = True
+        store._size = store._alive = count
+        store._next_id = max(store._next_id, int(rows["id"][count - 1]) + 1)
+        store._rebuild_runs()
+        return store
+
+    @classmethod
+    def from_snapshot_layout(cls, layout: Dict[str, Any]) -> "InstanceStore":
+        """
+        Load the layout of a binary snapshot of a state graph, as returned by
+        utils.compression.snapshot_layout, from its typed columns without
+        rendering a record per instance. A layout with instances whose ids
+        are not all integers or whose parent_id may be missing is loaded
+        through from_node_link_data.
+        """
+        store = cls(capacity=1)
+        groups = []
+        for group in layout["node_groups"]:
+            columns = dict(zip(group["keys"], group["columns"]))
+            if not group["columns"] or "parent_id" not in columns:
+                continue
+            count = _column_length(group["columns"][0])
+            parent = columns["parent_id"]
+            ids = _int_column(columns.get("id"), count)
+            if (
+                not isinstance(parent, (EncodedColumn, dict))
+                or (isinstance(parent, dict) and parent["const"] is None)
+                or ids is None
+                or (ids == MISSING).any()
+            ):
+                return cls.from_node_link_data(layout_node_link_data(layout))
+            times = [
+                _int_column(columns.get(key), count)
+                for key in ("created_at", "valid_from", "valid_to")
+            ]
+            if any(column is None for column in times):
+                return cls.from_node_link_data(layout_node_link_data(layout))
+            groups.append(
+                (
+                    ids,
+                    _interned_column(parent, count, store._parents),
+                    _interned_column(columns.get("type"), count, store._types),
+                    *times,
+                )
+            )
+
+        store._load_graph_data(layout.get("graph"))
+        if not groups:
+            return store
+
+        ids, parents, types, created_at, valid_from, valid_to = (
+            np.concatenate(column) for column in zip(*groups)
+        )
+        order = np.argsort(ids, kind="stable")
+        count = len(ids)
+        store._rows = _Columns(count)
+        rows = store._rows
+        rows["id"][:] = ids[order]
+        rows["parent"][:] = parents[order]
+        rows["type"][:] = types[order]
+        rows["created_at"][:] = created_at[order]
+        rows["valid_from"][:] = valid_from[order]
+        rows["valid_to"][:] = valid_to[order]
+        rows["alive"][:] = True
+        store._size = store._alive = count
+        store._next_id = max(store._next_id, int(rows["id"][count - 1]) + 1)
+        store._rebuild_runs()
+        return store
+
+    def _load_graph_data(self, graph: Optional[Dict[str, Any]]) -> None:
+        self.graph.update(graph or {})
+        next_id = self.graph.pop(NEXT_ID_KEY, None)
+        if isinstance(next_id, int) and not isinstance(next_id, bool):
+            self._next_id = max(1, next_id)
+
+    def copy(self) -> "InstanceStore":
+        """Copy of the live instances, cheap enough to take under the lock"""
+        store = InstanceStore(capacity=self._alive)
+        store._rows = self._rows.select(self._size, self._alive)
+        store._size = store._alive = self._alive
+        store.graph = dict(self.graph)
+        store._next_id = self._next_id
+        store._parents.values = list(self._parents.values)
+        store._parents.codes = dict(self._parents.codes)
+        store._types.values = list(self._types.values)
+        store._types.codes = dict(self._types.codes)
+        store._rebuild_runs()
+        return store
+
+    # Read side of the graph interface
+
+    def __len__(self) -> int:
+        return self._alive
+
+    def __iter__(self) -> Iterator[int]:
+        alive = self._rows["alive"][: self._size]
+        return iter(self._rows["id"][: self._size][alive].tolist())
+
+    def __contains__(self, node_id: Hashable) -> bool:
+        return self.has_node(node_id)
+
+    @property
+    def nodes(self) -> _NodeView:
+        return _NodeView(self)
+
+    def number_of_nodes(self) -> int:
+        return self._alive
+
+    def number_of_edges(self) -> int:
+        return 0
+
+    def has_node(self, node_id: Hashable) -> bool:
+        return self._row(node_id) is not None
+
+    def has_edge(self, source: Hashable, target: Hashable) -> bool:
+        return False
+
+    def edges(self, data: bool = False) -> List[Tuple]:
+        # Instances are not connected; kept for json_graph.node_link_data
+        return []
+
+    def is_directed(self) -> bool:
+        return True
+
+    def is_multigraph(self) -> bool:
+        return False
+
+    def items(self) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        for record in self._records():
+            yield record["id"], {k: v for k, v in record.items() if k != "id"}
+
+    def count(self, parent_id: Hashable) -> int:
+        code = self._parents.codes.get(parent_id)
+        return 0 if code is None else self._counts.get(code, 0)
+
+    def counts_by_type(self, parent_id: Hashable) -> Dict[Any, int]:
+        """Instances of a parent per type"""
+        code = self._parents.codes.get(parent_id)
+        counts = self._type_counts.get(code, {}) if code is not None else {}
+        return {self._types.values[type_code]: n for type_code, n in counts.items()}
+
+    def recount(self) -> Dict[Hashable, Dict[Any, int]]:
+        """
+        Instances per parent and type counted from the columns rather than
+        from the counters kept up to date by the mutations, for verification
+        """
+        alive = self._rows["alive"][: self._size]
+        pairs = np.stack(
+            (
+                self._rows["parent"][: self._size][alive],
+                self._rows["type"][: self._size][alive],
+            ),
+            axis=1,
+        )
+        counts: Dict[Hashable, Dict[Any, int]] = {}
+        if len(pairs):
+            unique, totals = np.unique(pairs, axis=0, return_counts=True)
+            for (parent, type_code), n in zip(unique.tolist(), totals.tolist()):
+                parent_id = self._parents.values[parent]
+                counts.setdefault(parent_id, {})[self._types.values[type_code]] = n
+        return counts
+
+    def take_changed_parents(self) -> Set[Hashable]:
+        """parent_id of the parents whose counts changed since the last call"""
+        changed = {self._parents.values[code] for code in self._changed_parents}
+        self._changed_parents = set()
+        return changed
+
+    def last_id(self) -> int:
+        """id of the latest instance added, 0 if none was"""
+        return self._next_id - 1
+
+    def records_after(
+        self, after_id: int, limit: int, up_to_id: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Up to limit records of live instances with an id above after_id, and
+        up to up_to_id if given, in id order. Rows are kept sorted by id, so
+        paging through the store this way scans each row once.
+        """
+        ids = self._rows["id"][: self._size]
+        start = int(np.searchsorted(ids, after_id, side="right"))
+        end = self._size
+        if up_to_id is not None:
+            end = int(np.searchsorted(ids, up_to_id, side="right"))
+        selected: List[np.ndarray] = []
+        found = 0
+        # Widen the window until it holds limit live rows or reaches the end
+        window = limit
+        while start < end and found < limit:
+            stop = min(start + window, end)
+            rows = start + np.flatnonzero(self._rows["alive"][start:stop])
+            rows = rows[: limit - found]
+            selected.append(rows)
+            found += len(rows)
+            start = stop
+            window *= 2
+        if not selected:
+            return []
+        return self._render(np.concatenate(selected))
+
+    def nbytes(self) -> int:
+        """Memory held by the instance columns"""
+        return self._rows.nbytes
+
+    def graph_data(self) -> Dict[str, Any]:
+        """The graph attributes, with the id the next instance gets"""
+        return {**self.graph, NEXT_ID_KEY: self._next_id}
+
+    def node_link_data(self) -> Dict[str, Any]:
+        """The instances in the node-link layout of json_graph.node_link_data"""
+        return {
+            "directed": True,
+            "multigraph": False,
+            "graph": self.graph_data(),
+            "nodes": self._records(),
+            LINKS_KEY: [],
+        }
+
+    # Mutations
+
+    def add(
+        self,
+        parent_id: Hashable,
+        type: Any,
+        count: int,
+        created_at: Optional[int],
+        valid_from: Optional[int] = None,
+        valid_to: Optional[int] = None,
+        tx: Optional[GraphTransaction] = None,
+    ) -> np.ndarray:
+        """Add count instances of a parent and return their ids"""
+        if count <= 0:
+            return np.empty(0, dtype=np.int64)
+
+        self._reserve(count)
+        start = self._next_id
+        ids = np.arange(start, start + count, dtype=np.int64)
+        parent = self._parents.code(parent_id)
+        type_code = self._types.code(type)
+        new = slice(self._size, self._size + count)
+        rows = self._rows
+        rows["id"][new] = ids
+        rows["parent"][new] = parent
+        rows["type"][new] = type_code
+        rows["created_at"][new] = MISSING if created_at is None else created_at
+        rows["valid_from"][new] = MISSING if valid_from is None else valid_from
+        rows["valid_to"][new] = MISSING if valid_to is None else valid_to
+        rows["alive"][new] = True
+        self._size += count
+        self._next_id += count
+
+        run = _Run(
+            instance_sort_key(created_at, valid_to), type_code, start, start + count
+        )
+        self._push_run(parent, run)
+        if valid_to is not None:
+            self._push_expiry(valid_to, parent, run)
+        self._change_count(parent, type_code, count)
+
+        if tx is not None:
+
+            def undo():
+                self._set_alive(ids, False)
+                run.start = run.end
+                self._change_count(parent, type_code, -count)
+
+            tx.on_rollback(undo)
+            tx.touch_nodes(self, ids.tolist())
+        return ids
+
+    def remove_oldest(
+        self, parent_id: Hashable, count: int, tx: Optional[GraphTransaction] = None
+    ) -> np.ndarray:
+        """Remove up to count of the first instances of a parent in FIFO order"""
+        parent = self._parents.codes.get(parent_id)
+        heap = self._runs.get(parent)
+        if parent is None or heap is None or count <= 0:
+            return np.empty(0, dtype=np.int64)
+
+        ids_column = self._rows["id"][: self._size]
+        alive_column = self._rows["alive"][: self._size]
+        removed = []
+        undo_steps = []
+        while count > 0 and heap:
+            entry = heap[0]
+            run = entry[2]
+            lo, hi = np.searchsorted(ids_column, (run.start, run.end))
+            rows = lo + np.flatnonzero(alive_column[lo:hi])
+            taken = rows[:count]
+            alive_column[taken] = False
+            taken_ids = ids_column[taken].copy()
+            removed.append(taken_ids)
+            count -= len(taken)
+
+            previous_start = run.start
+            exhausted = len(taken) == len(rows)
+            if exhausted:
+                heapq.heappop(heap)
+                run.start = run.end
+            else:
+                run.start = int(taken_ids[-1]) + 1
+            undo_steps.append((entry, previous_start, exhausted, taken_ids))
+
+        removed_ids = np.concatenate(removed) if removed else np.empty(0, np.int64)
+        for entry, _, _, taken_ids in undo_steps:
+            self._change_count(parent, entry[2].type, -len(taken_ids))
+
+        if tx is not None:
+
+            def undo():
+                for entry, previous_start, exhausted, taken_ids in reversed(undo_steps):
+                    self._set_alive(taken_ids, True)
+                    entry[2].start = previous_start
+                    if exhausted:
+                        self._push_entry(parent, entry)
+                    self._change_count(parent, entry[2].type, len(taken_ids))
+
+            tx.on_rollback(undo)
+            tx.touch_nodes(self, removed_ids.tolist())
+        return removed_ids
+
+    def next_expiry(self) -> Optional[int]:
+        """The earliest valid_to among the instances, None if none has one"""
+        self._drop_expired_runs()
+        return self._expiry[0][0] if self._expiry else None
+
+    def expire(
+        self,
+        before: int,
+        limit: Optional[int] = None,
+        tx: Optional[GraphTransaction] = None,
+    ) -> np.ndarray:
+        """
+        Remove instances with a valid_to at or before before, earliest valid_to
+        first, at most limit of them, and return their ids. Ties are broken on
+        the id, so the same call on the same instances removes the same ones.
+        """
+        removed = []
+        undo_steps = []
+        remaining = limit
+        ids_column = self._rows["id"][: self._size]
+        alive_column = self._rows["alive"][: self._size]
+        self._drop_expired_runs()
+        while self._expiry and self._expiry[0][0] <= before:
+            if remaining is not None and remaining <= 0:
+                break
+            entry = self._expiry[0]
+            _, _, parent, run = entry
+            lo, hi = np.searchsorted(ids_column, (run.start, run.end))
+            rows = lo + np.flatnonzero(alive_column[lo:hi])
+            taken = rows if remaining is None else rows[:remaining]
+            alive_column[taken] = False
+            taken_ids = ids_column[taken].copy()
+            removed.append(taken_ids)
+
+            previous_start = run.start
+            heap = self._runs.get(parent)
+            exhausted = len(taken) == len(rows)
+            if exhausted:
+                heapq.heappop(self._expiry)
+                run.start = run.end
+            else:
+                run.start = int(taken_ids[-1]) + 1
+            if remaining is not None:
+                remaining -= len(taken)
+            self._change_count(parent, run.type, -len(taken_ids))
+            undo_steps.append(
+                (entry, parent, heap, previous_start, exhausted, taken_ids)
+            )
+
+        removed_ids = np.concatenate(removed) if removed else np.empty(0, np.int64)
+
+        if tx is not None and undo_steps:
+
+            def undo():
+                for (
+                    entry,
+                    parent,
+                    heap,
+                    previous_start,
+                    exhausted,
+                    taken_ids,
+                ) in reversed(undo_steps):
+                    self._set_alive(taken_ids, True)
+                    run = entry[3]
+                    run.start = previous_start
+                    if exhausted:
+                        heapq.heappush(self._expiry, entry)
+                    # The parent's heap went away when its count dropped to zero
+                    if heap is not None and self._runs.get(parent) is not heap:
+                        self._runs[parent] = heap
+                    self._change_count(parent, run.type, len(taken_ids))
+
+            tx.on_rollback(undo)
+            tx.touch_nodes(self, removed_ids.tolist())
+        return removed_ids
+
+    def compact(self) -> None:
+        """Drop removed rows. Not to be called while a transaction is open."""
+        if self._alive == self._size:
+            return
+        self._expiry = [
+            entry for entry in self._expiry if entry[3].start < entry[3].end
+        ]
+        heapq.heapify(self._expiry)
+        self._rows = self._rows.select(
+            self._size, max(INITIAL_CAPACITY, 2 * self._alive)
+        )
+        self._size = self._alive
+
+    def compact_if_due(self) -> bool:
+        if self._size - self._alive <= max(INITIAL_CAPACITY, self._alive):
+            return False
+        self.compact()
+        return True
+
+    # Internals
+
+    def _row(self, node_id: Hashable) -> Optional[int]:
+        if not isinstance(node_id, (int, np.integer)) or isinstance(node_id, bool):
+            return None
+        ids = self._rows["id"][: self._size]
+        row = int(np.searchsorted(ids, node_id))
+        if row < self._size and ids[row] == node_id and self._rows["alive"][row]:
+            return row
+        return None
+
+    def _record(self, row: int) -> Dict[str, Any]:
+        rows = self._rows
+        record = {
+            "parent_id": self._parents.values[rows["parent"][row]],
+            "type": self._types.values[rows["type"][row]],
+        }
+        for key in ("created_at", "valid_from", "valid_to"):
+            value = _optional(int(rows[key][row]))
+            if value is not None:
+                record[key] = value
+        record["id"] = int(rows["id"][row])
+        return record
+
+    def _records(self) -> List[Dict[str, Any]]:
+        return self._render(self._rows["alive"][: self._size])
+
+    def _render(self, select: np.ndarray) -> List[Dict[str, Any]]:
+        """Records of the rows picked by select, a mask or an index array"""
+        rows = {
+            name: self._rows[name][: self._size][select]
+            for name in INSTANCE_DTYPE.names
+        }
+        parents = self._parents.values
+        types = self._types.values
+        records = []
+        for node_id, parent, type_code, created_at, valid_from, valid_to in zip(
+            rows["id"].tolist(),
+            rows["parent"].tolist(),
+            rows["type"].tolist(),
+            rows["created_at"].tolist(),
+            rows["valid_from"].tolist(),
+            rows["valid_to"].tolist(),
+        ):
+            record = {"parent_id": parents[parent], "type": types[type_code]}
+            if created_at != MISSING:
+                record["created_at"] = created_at
+            if valid_from != MISSING:
+                record["valid_from"] = valid_from
+            if valid_to != MISSING:
+                record["valid_to"] = valid_to
+            record["id"] = node_id
+            records.append(record)
+        return records
+
+    def _reserve(self, count: int) -> None:
+        needed = self._size + count
+        if needed <= len(self._rows):
+            return
+        self._rows = self._rows.grown(self._size, max(needed, 2 * len(self._rows)))
+
+    def _set_alive(self, ids: np.ndarray, alive: bool) -> None:
+        rows = np.searchsorted(self._rows["id"][: self._size], ids)
+        self._rows["alive"][rows] = alive
+
+    def _change_count(self, parent: int, type_code: int, delta: int) -> None:
+        count = self._counts.get(parent, 0) + delta
+        self._alive += delta
+        if count:
+            self._counts[parent] = count
+        else:
+            self._counts.pop(parent, None)
+            self._runs.pop(parent, None)
+
+        self._changed_parents.add(parent)
+        type_counts = self._type_counts.setdefault(parent, {})
+        type_count = type_counts.get(type_code, 0) + delta
+        if type_count:
+            type_counts[type_code] = type_count
+        else:
+            type_counts.pop(type_code, None)
+            if not type_counts:
+                del self._type_counts[parent]
+
+    def _push_run(self, parent: int, run: _Run) -> None:
+        self._push_entry(parent, (run.key, next(self._run_counter), run))
+
+    def _push_entry(self, parent: int, entry: Tuple[Tuple[int, int], int, _Run]):
+        heapq.heappush(self._runs.setdefault(parent, []), entry)
+
+    def _push_expiry(self, valid_to: int, parent: int, run: _Run) -> None:
+        heapq.heappush(self._expiry, (valid_to, run.start, parent, run))
+
+    def _drop_expired_runs(self) -> None:
+        """Pop runs emptied by trimming or a rollback off the expiry heap"""
+        while self._expiry and self._expiry[0][3].start >= self._expiry[0][3].end:
+            heapq.heappop(self._expiry)
+
+    def _rebuild_runs(self) -> None:
+        """Runs and counts of the rows, which must all be alive"""
+        self._runs = {}
+        self._expiry = []
+        self._counts = {}
+        self._type_counts = {}
+        self._alive = 0
+        if not self._size:
+            return
+        rows = {name: self._rows[name][: self._size] for name in INSTANCE_DTYPE.names}
+        valid_to = rows["valid_to"]
+        created_at = np.where(rows["created_at"] == MISSING, 0, rows["created_at"])
+        first_key = np.where(valid_to == MISSING, created_at, valid_to)
+        # A run ends wherever the parent, the type or the FIFO key changes
+        changed = (
+            (rows["parent"][1:] != rows["parent"][:-1])
+            | (rows["type"][1:] != rows["type"][:-1])
+            | (first_key[1:] != first_key[:-1])
+            | (created_at[1:] != created_at[:-1])
+            | (valid_to[1:] != valid_to[:-1])
+        )
+        starts = np.concatenate(([0], np.flatnonzero(changed) + 1))
+        ends = np.concatenate((starts[1:], [self._size]))
+        ids = rows["id"]
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            parent = int(rows["parent"][start])
+            type_code = int(rows["type"][start])
+            key = (int(first_key[start]), int(created_at[start]))
+            run = _Run(key, type_code, int(ids[start]), int(ids[end - 1]) + 1)
+            self._push_run(parent, run)
+            if valid_to[start] != MISSING:
+                self._push_expiry(int(valid_to[start]), parent, run)
+            self._change_count(parent, type_code, end - start)
+
+
+def node_link_data(graph) -> Dict[str, Any]:
+    """Node-link data of a schema graph or of an instance store"""
+    if isinstance(graph, InstanceStore):
+        return graph.node_link_data()
+    return json_graph.node_link_data(graph)
@@ -0,0 +1,46 @@
+"""Metrics recorded by the worker as it applies, persists and archives changes"""
+
+from utils.metrics import COUNT_BUCKETS, counter, histogram
+
+change_apply_seconds = histogram(
+    "graph_server_change_apply_seconds",
+    "Time to apply a change to the live graphs, record it in the WAL and "
+    "archive when it moves the timestamp, by action and whether it applied",
+    ("action", "result"),
+)
+change_batch_size = histogram(
+    "graph_server_change_batch_size",
+    "Changes per batch processed by a worker",
+    buckets=COUNT_BUCKETS,
+)
+change_batch_seconds = histogram(
+    "graph_server_change_batch_seconds",
+    "Time to apply and persist a batch of changes",
+)
+wal_commit_seconds = histogram(
+    "graph_server_wal_commit_seconds",
+    "Time to commit the WAL records of a version, fsync included",
+)
+save_graph_seconds = histogram(
+    "graph_server_save_graph_seconds",
+    "Time to save a graph as a live file or an archive keyframe",
+    ("graph", "kind"),
+)
+encode_seconds = histogram(
+    "graph_server_file_encode_seconds",
+    "Time to serialize a graph file, by format",
+    ("format",),
+)
+fsync_seconds = histogram(
+    "graph_server_file_fsync_seconds",
+    "Time to fsync a written graph file",
+)
+bytes_written = counter(
+    "graph_server_file_bytes_written_total",
+    "Bytes of graph files, archives and checkpoints written",
+)
+archives_written = counter(
+    "graph_server_archives_total",
+    "Archives written, by graph and whether a keyframe or a delta",
+    ("graph", "kind"),
+)
@@ -0,0 +1,236 @@
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+import zlib
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# How often a process pool checks its worker processes are alive
+PROCESS_CHECK_INTERVAL_SECONDS = 1
+
+
+def shard_for(version: str, size: int) -> int:
+    """Stable shard of a version, identical across processes and restarts"""
+    return zlib.crc32(version.encode()) % size
+
+
+def run_shard(
+    shard: int,
+    shard_queue,
+    process_batch: Callable[[List[Dict[str, Any]]], Any],
+    maintain: Callable[[], None],
+    batch_size: int,
+    maintenance_interval: float,
+) -> None:
+    """
+    Apply the changes of a shard queue as they arrive, what has queued up as
+    one batch through ``process_batch``, and call ``maintain`` between
+    batches, until a None is queued. Runs a thread of a WorkerPool or the
+    process of a ProcessWorkerPool shard.
+    """
+    last_maintenance = time.monotonic()
+    stopping = False
+    while not stopping:
+        try:
+            batch = [shard_queue.get(timeout=maintenance_interval)]
+        except queue.Empty:
+            batch = []
+
+        while batch and batch[-1] is not None and len(batch) < batch_size:
+            try:
+                batch.append(shard_queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch and batch[-1] is None:
+            stopping = True
+            batch.pop()
+
+        try:
+            if batch:
+                process_batch(batch)
+            if time.monotonic() - last_maintenance >= maintenance_interval:
+                maintain()
+                last_maintenance = time.monotonic()
+        except Exception as e:
+            logger.error(f"Error in worker shard {shard}: {str(e)}")
+
+
+class WorkerPool:
+    """
+    Fixed pool of worker threads with every version pinned to one of them.
+
+    Changes are routed by version hash to the queue of their shard, so the
+    changes of a version are always applied in order by the same thread.
+    Applying changes holds the GIL, so shards only overlap where one waits on
+    I/O (WAL fsyncs, archive and checkpoint writes) while another applies
+    changes; they do not use more than one core, see ProcessWorkerPool for
+    that. Each shard applies what has queued up as one batch through
+    ``process_batch`` and runs ``maintain`` for the versions it owns between
+    batches. Shard queues are bounded so a slow shard pushes back on the
+    dispatcher and the backlog stays in Redis.
+    """
+
+    def __init__(
+        self,
+        size: int,
+        process_batch: Callable[[List[Dict[str, Any]]], Any],
+        maintain: Callable[[Callable[[str], bool]], None],
+        batch_size: int = 100,
+        maintenance_interval: float = 0.1,
+    ):
+        self.size = max(1, size)
+        self._process_batch = process_batch
+        self._maintain = maintain
+        self._batch_size = max(1, batch_size)
+        self._maintenance_interval = maintenance_interval
+        self._queues = [
+            queue.Queue(maxsize=10 * self._batch_size) for _ in range(self.size)
+        ]
+        self._threads: List[threading.Thread] = []
+
+    def owns(self, shard: int) -> Callable[[str], bool]:
+        return lambda version: shard_for(version, self.size) == shard
+
+    def start(self) -> None:
+        if self._threads:
+            return
+        for shard in range(self.size):
+            owns = self.owns(shard)
+            thread = threading.Thread(
+                target=run_shard,
+                args=(
+                    shard,
+                    self._queues[shard],
+                    self._process_batch,
+                    lambda owns=owns: self._maintain(owns),
+                    self._batch_size,
+                    self._maintenance_interval,
+                ),
+                name=f"graph-worker-{shard}",
+                daemon=True,
+            )
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Started worker pool with {self.size} shards")
+
+    def dispatch(self, changes: List[Dict[str, Any]]) -> None:
+        """Hand changes to their shards, blocking while a shard queue is full"""
+        for change_data in changes:
+            self._queues[shard_for(change_data["version"], self.size)].put(change_data)
+
+    def backlog(self) -> List[int]:
+        return [q.qsize() for q in self._queues]
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """The threads stop with the process"""
+
+
+class ProcessWorkerPool:
+    """
+    Fixed pool of worker processes with every version pinned to one of them,
+    routed by the same version hash as WorkerPool, so shards apply changes on
+    as many cores as there are processes.
+
+    Each process runs ``target(shard, shard_queue, events)``, which owns the
+    graph store, WAL, checkpoints and delta sink of the versions of its shard
+    and applies the changes put on its queue until a None is queued. The API
+    process holds none of these versions and reads them from their live
+    files. The processes report through ``events``, a queue whose items are
+    handed to ``on_event`` on a thread of the pool. A process that dies is
+    started again on the same queue; the changes it had taken and not made
+    durable are lost like in a crash. Processes are spawned, not forked, as
+    the API process runs threads of its own.
+    """
+
+    def __init__(
+        self,
+        size: int,
+        target: Callable[[int, Any, Any], None],
+        on_event: Callable[[Any], None],
+        batch_size: int = 100,
+    ):
+        self.size = max(1, size)
+        self._target = target
+        self._on_event = on_event
+        self._batch_size = max(1, batch_size)
+        self._context = multiprocessing.get_context("spawn")
+        self._queues: List[Any] = []
+        self._events = None
+        self._processes: List[Any] = []
+        self._lock = threading.Lock()
+        self._stopping = False
+
+    def start(self) -> None:
+        with self._lock:
+            if self._processes:
+                return
+            self._events = self._context.Queue()
+            self._queues = [
+                self._context.Queue(maxsize=10 * self._batch_size)
+                for _ in range(self.size)
+            ]
+            self._processes = [self._spawn(shard) for shard in range(self.size)]
+        threading.Thread(
+            target=self._watch, name="graph-worker-events", daemon=True
+        ).start()
+        logger.info(f"Started worker pool with {self.size} shard processes")
+
+    def dispatch(self, changes: List[Dict[str, Any]]) -> None:
+        """Hand changes to their shards, blocking while a shard queue is full"""
+        for change_data in changes:
+            self._queues[shard_for(change_data["version"], self.size)].put(change_data)
+
+    def backlog(self) -> List[int]:
+        return [q.qsize() for q in self._queues]
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Let every process apply what it was handed, make it durable and exit"""
+        with self._lock:
+            self._stopping = True
+            processes = list(self._processes)
+        for shard_queue in self._queues:
+            shard_queue.put(None)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for process in processes:
+            process.join(
+                None if deadline is None else max(0, deadline - time.monotonic())
+            )
+            if process.is_alive():
+                logger.warning(f"Worker process {process.name} did not stop in time")
+
+    def _spawn(self, shard: int):
+        process = self._context.Process(
+            target=self._target,
+            args=(shard, self._queues[shard], self._events),
+            name=f"graph-worker-{shard}",
+            daemon=True,
+        )
+        process.start()
+        return process
+
+    def _watch(self) -> None:
+        last_check = time.monotonic()
+        while True:
+            try:
+                self._on_event(self._events.get(timeout=PROCESS_CHECK_INTERVAL_SECONDS))
+            except queue.Empty:
+                pass
+            except Exception as e:
+                logger.error(f"Error handling a worker process event: {str(e)}")
+
+            if time.monotonic() - last_check < PROCESS_CHECK_INTERVAL_SECONDS:
+                continue
+            last_check = time.monotonic()
+            with self._lock:
+                if self._stopping:
+                    continue
+                for shard, process in enumerate(self._processes):
+                    if not process.is_alive():
+                        logger.error(
+                            f"Worker process of shard {shard} exited with code "
+                            f"{process.exitcode}, starting it again"
+                        )
+                        self._processes[shard] = self._spawn(shard)
@@ -0,0 +1,135 @@
+from typing import Any, Dict, Hashable, Iterable, Optional, Set, Tuple
+
+import networkx as nx
+
+from .instance_store import InstanceStore
+from .subgraph import neighborhood
+
+Counts = Dict[Any, int]
+
+
+def _add_counts(into: Counts, counts: Counts, sign: int = 1) -> None:
+    for instance_type, count in counts.items():
+        total = into.get(instance_type, 0) + sign * count
+        if total:
+            into[instance_type] = total
+        else:
+            into.pop(instance_type, None)
+
+
+def _sum_counts(direct: Dict[Hashable, Counts], nodes: Iterable[Hashable]) -> Counts:
+    total: Counts = {}
+    for node in nodes:
+        _add_counts(total, direct.get(node, {}))
+    return total
+
+
+def compute_rollups(
+    schema: nx.DiGraph, direct: Dict[Hashable, Counts]
+) -> Dict[Hashable, Counts]:
+    """
+    Instances per type of every schema node and of every node with an edge
+    path to it, from scratch. Edges point up the hierarchy, from Parts to
+    Facility and on to BusinessUnit, so a node's rollup covers its networkx
+    ancestors. Each instance counts once per node even when several paths
+    lead there.
+    """
+    return {
+        node: _sum_counts(direct, neighborhood(schema, node, None, "in"))
+        for node in schema.nodes
+    }
+
+
+class InventoryRollup:
+    """
+    Live instance counts per schema node and type, and the same counts rolled
+    up along the schema edges, kept up to date change by change.
+
+    A change of the instances of a node is added to the rollups of the node
+    and of its descendants only; nodes reached through an edge the change
+    added or removed are summed again from the direct counts of their
+    ancestors. The rollups of a node are read in constant time.
+    """
+
+    def __init__(self):
+        self._direct: Dict[Hashable, Counts] = {}
+        self._totals: Dict[Hashable, Counts] = {}
+
+    def rebuild(self, schema: nx.DiGraph, state: InstanceStore) -> None:
+        state.take_changed_parents()
+        self._direct = state.recount()
+        self._totals = compute_rollups(schema, self._direct)
+
+    def update(
+        self,
+        schema: nx.DiGraph,
+        state: InstanceStore,
+        nodes: Set[Hashable],
+        edges: Set[Tuple[Hashable, Hashable]],
+        parents: Set[Hashable],
+    ) -> None:
+        """
+        Bring the rollups up to date after a change that touched nodes and
+        edges of the schema and the instances of parents
+        """
+        # New nodes and nodes whose set of ancestors may have changed are
+        # summed again
+        resummed = {
+            node for node in nodes if schema.has_node(node) and node not in self._totals
+        }
+        for _, target in edges:
+            if schema.has_node(target):
+                resummed.update(neighborhood(schema, target, None, "out"))
+
+        for parent in parents | nodes:
+            counts = state.counts_by_type(parent)
+            previous = self._direct.get(parent, {})
+            if counts == previous:
+                continue
+            delta = dict(counts)
+            _add_counts(delta, previous, -1)
+            if counts:
+                self._direct[parent] = counts
+            else:
+                self._direct.pop(parent, None)
+            if not schema.has_node(parent):
+                continue
+            for node in neighborhood(schema, parent, None, "out"):
+                if node not in resummed:
+                    _add_counts(self._totals.setdefault(node, {}), delta)
+
+        for node in resummed:
+            self._totals[node] = _sum_counts(
+                self._direct, neighborhood(schema, node, None, "in")
+            )
+        for node in nodes:
+            if not schema.has_node(node):
+                self._totals.pop(node, None)
+
+    def get(self, node: Hashable) -> Optional[Dict[str, Counts]]:
+        """Direct and rolled up counts of a schema node, None if it has none"""
+        if node not in self._totals:
+            return None
+        return {
+            "direct": dict(self._direct.get(node, {})),
+            "total": dict(self._totals[node]),
+        }
+
+    def all(self) -> Dict[Hashable, Dict[str, Counts]]:
+        return {node: self.get(node) for node in self._totals}
+
+    def verify(
+        self, schema: nx.DiGraph, state: InstanceStore
+    ) -> Dict[Hashable, Dict[str, Counts]]:
+        """
+        Recompute every rollup from the instance columns and return the nodes
+        whose maintained counts differ, with both versions
+        """
+        expected = compute_rollups(schema, state.recount())
+        mismatches = {}
+        for node in set(expected) | set(self._totals):
+            maintained = self._totals.get(node, {})
+            recomputed = expected.get(node, {})
+            if maintained != recomputed:
+                mismatches[node] = {"maintained": maintained, "recomputed": recomputed}
+        return mismatches
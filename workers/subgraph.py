@@ -0,0 +1,84 @@
+from typing import Any, Dict, Hashable, Iterable, List, Optional
+
+import networkx as nx
+from networkx.readwrite import json_graph
+
+from utils.archive import links_key
+
+DIRECTIONS = ("out", "in", "both")
+
+# Edge list key of node_link_data in the installed networkx
+LINKS_KEY = links_key(json_graph.node_link_data(nx.DiGraph()))
+
+
+def _matches(attrs: Dict[str, Any], relationship_type: Optional[str]) -> bool:
+    return (
+        relationship_type is None or attrs.get("relationship_type") == relationship_type
+    )
+
+
+def neighborhood(
+    graph: nx.DiGraph,
+    node_id: Hashable,
+    hops: Optional[int] = 1,
+    direction: str = "both",
+    relationship_type: Optional[str] = None,
+) -> List[Hashable]:
+    """
+    Nodes reachable from node_id in at most hops steps, or any number of steps
+    if hops is None, in breadth-first order starting with node_id itself.
+    Only edges of relationship_type are followed when it is given; direction
+    "out" follows edges forward, "in" backward and "both" either way.
+    The work done is proportional to the edges of the nodes reached.
+    """
+    if direction not in DIRECTIONS:
+        raise ValueError(f"Unknown direction: {direction}")
+
+    adjacencies = []
+    if direction in ("out", "both"):
+        adjacencies.append(graph.succ)
+    if direction in ("in", "both"):
+        adjacencies.append(graph.pred)
+
+    seen = {node_id}
+    order = [node_id]
+    frontier = [node_id]
+    depth = 0
+    while frontier and (hops is None or depth < hops):
+        next_frontier = []
+        for node in frontier:
+            for adjacency in adjacencies:
+                for neighbor, attrs in adjacency[node].items():
+                    if neighbor not in seen and _matches(attrs, relationship_type):
+                        seen.add(neighbor)
+                        order.append(neighbor)
+                        next_frontier.append(neighbor)
+        frontier = next_frontier
+        depth += 1
+    return order
+
+
+def subgraph_data(
+    graph: nx.DiGraph,
+    nodes: Iterable[Hashable],
+    relationship_type: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Node-link data, in the layout of json_graph.node_link_data, of the given
+    nodes and the edges between them, limited to relationship_type if given
+    """
+    nodes = list(nodes)
+    members = set(nodes)
+    edges = [
+        {**attrs, "source": node, "target": neighbor}
+        for node in nodes
+        for neighbor, attrs in graph.succ[node].items()
+        if neighbor in members and _matches(attrs, relationship_type)
+    ]
+    return {
+        "directed": True,
+        "multigraph": False,
+        "graph": {},
+        "nodes": [{**graph.nodes[node], "id": node} for node in nodes],
+        LINKS_KEY: edges,
+    }
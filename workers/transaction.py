@@ -0,0 +1,171 @@
+import logging
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+import networkx as nx
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class GraphTransaction:
+    """
+    Undo log for in-place graph mutations.
+
+    Every mutation made through the transaction records how to reverse it, so
+    a change can be applied directly to the live graphs and still be rolled
+    back as a whole. Rolling back only touches the nodes and edges that were
+    mutated, which keeps the cost of a change proportional to what it touches
+    rather than to the size of the graph.
+
+    Used as a context manager the transaction rolls back automatically when
+    the block raises. The nodes and edges it touched stay available after a
+    commit through :meth:`touched_nodes` and :meth:`touched_edges`.
+    """
+
+    def __init__(self):
+        self._undo: List[Callable[[], None]] = []
+        self._touched: Dict[
+            int, Tuple[Set[Hashable], Set[Tuple[Hashable, Hashable]]]
+        ] = {}
+
+    def __enter__(self) -> "GraphTransaction":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        if exc_type is not None:
+            self.rollback()
+        else:
+            self.commit()
+        return False
+
+    def __len__(self) -> int:
+        return len(self._undo)
+
+    def on_rollback(self, undo: Callable[[], None]) -> None:
+        """Register a custom undo step, for state kept outside of the graphs"""
+        self._undo.append(undo)
+
+    def touch_nodes(self, graph: Any, nodes: Iterable[Hashable]) -> None:
+        """Record nodes of a graph mutated outside of the transaction's methods"""
+        self._touch(graph).update(nodes)
+
+    def touched_nodes(self, graph: nx.DiGraph) -> Set[Hashable]:
+        return self._touched.get(id(graph), (set(), set()))[0]
+
+    def touched_edges(self, graph: nx.DiGraph) -> Set[Tuple[Hashable, Hashable]]:
+        return self._touched.get(id(graph), (set(), set()))[1]
+
+    def add_node(self, graph: nx.DiGraph, node_id: Hashable, **attrs: Any) -> None:
+        self._touch(graph).add(node_id)
+        if graph.has_node(node_id):
+            previous = dict(graph.nodes[node_id])
+            self._undo.append(lambda: _restore_attrs(graph.nodes[node_id], previous))
+        else:
+            self._undo.append(lambda: graph.remove_node(node_id))
+        graph.add_node(node_id, **attrs)
+
+    def set_node_attr(
+        self, graph: nx.DiGraph, node_id: Hashable, key: str, value: Any
+    ) -> None:
+        attrs = graph.nodes[node_id]
+        previous = attrs.get(key, _MISSING)
+        self._touch(graph).add(node_id)
+
+        def undo():
+            if previous is _MISSING:
+                attrs.pop(key, None)
+            else:
+                attrs[key] = previous
+
+        self._undo.append(undo)
+        attrs[key] = value
+
+    def remove_node(self, graph: nx.DiGraph, node_id: Hashable) -> None:
+        attrs = graph.nodes[node_id]
+        in_edges = list(graph.in_edges(node_id, data=True))
+        out_edges = list(graph.out_edges(node_id, data=True))
+        self._touch(graph).add(node_id)
+        touched_edges = self.touched_edges(graph)
+        touched_edges.update((u, v) for u, v, _ in in_edges)
+        touched_edges.update((u, v) for u, v, _ in out_edges)
+
+        def undo():
+            graph.add_node(node_id, **attrs)
+            graph.add_edges_from(in_edges)
+            graph.add_edges_from(out_edges)
+
+        self._undo.append(undo)
+        graph.remove_node(node_id)
+
+    def remove_nodes_from(self, graph: nx.DiGraph, nodes: Iterable[Hashable]) -> None:
+        for node_id in list(nodes):
+            if graph.has_node(node_id):
+                self.remove_node(graph, node_id)
+
+    def add_edge(
+        self, graph: nx.DiGraph, source: Hashable, target: Hashable, **attrs: Any
+    ) -> None:
+        self._touch(graph).update((source, target))
+        self.touched_edges(graph).add((source, target))
+        if graph.has_edge(source, target):
+            previous = dict(graph.edges[source, target])
+            self._undo.append(
+                lambda: _restore_attrs(graph.edges[source, target], previous)
+            )
+        else:
+            # Remember which endpoints add_edge creates implicitly
+            created = [n for n in (source, target) if not graph.has_node(n)]
+
+            def undo():
+                graph.remove_edge(source, target)
+                graph.remove_nodes_from(created)
+
+            self._undo.append(undo)
+        graph.add_edge(source, target, **attrs)
+
+    def remove_edge(
+        self, graph: nx.DiGraph, source: Hashable, target: Hashable
+    ) -> None:
+        attrs = graph.edges[source, target]
+        self._touch(graph)
+        self.touched_edges(graph).add((source, target))
+        self._undo.append(lambda: graph.add_edge(source, target, **attrs))
+        graph.remove_edge(source, target)
+
+    def _touch(self, graph: nx.DiGraph) -> Set[Hashable]:
+        """Return the touched node set of a graph, registering the graph"""
+        if id(graph) not in self._touched:
+            self._touched[id(graph)] = (set(), set())
+        return self._touched[id(graph)][0]
+
+    def commit(self) -> None:
+        self._undo.clear()
+
+    def rollback(self) -> None:
+        """Undo every recorded mutation, most recent first"""
+        if self._undo:
+            logger.info(f"Rolling back {len(self._undo)} graph mutations")
+        while self._undo:
+            self._undo.pop()()
+        self._touched.clear()
+
+
+def _restore_attrs(attrs: dict, previous: dict) -> None:
+    attrs.clear()
+    attrs.update(previous)
+
+
+@contextmanager
+def transaction(tx: Optional[GraphTransaction] = None):
+    """
+    Yield ``tx`` when the caller already owns a transaction, otherwise a new
+    one that is committed on success and rolled back if the block raises.
+    """
+    if tx is not None:
+        yield tx
+        return
+
+    with GraphTransaction() as own_tx:
+        yield own_tx
@@ -0,0 +1,174 @@
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Iterator, List
+
+logger = logging.getLogger(__name__)
+
+FSYNC_ALWAYS = "always"
+FSYNC_INTERVAL = "interval"
+FSYNC_OS = "os"
+FSYNC_POLICIES = (FSYNC_ALWAYS, FSYNC_INTERVAL, FSYNC_OS)
+
+SEGMENT_SUFFIX = ".wal"
+
+
+class WriteAheadLog:
+    """
+    Append-only log of the changes applied to a version.
+
+    Records are JSON lines carrying a monotonically increasing ``seq``. The log
+    is split in segments named after the first sequence number they hold; a
+    new segment is started on open and whenever a checkpoint is taken, so
+    segments fully covered by a checkpoint can simply be deleted.
+
+    ``fsync_policy`` controls durability of :meth:`commit`:
+      - ``always``: fsync on every commit
+      - ``interval``: fsync at most every ``fsync_interval_ms``
+      - ``os``: only flush to the OS and let it write back
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        fsync_policy: str = FSYNC_ALWAYS,
+        fsync_interval_ms: float = 50,
+    ):
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown WAL fsync policy: {fsync_policy}")
+
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.fsync_policy = fsync_policy
+        self.fsync_interval = fsync_interval_ms / 1000
+        self.last_seq = 0
+
+        self._lock = threading.Lock()
+        self._segments: List[int] = sorted(
+            int(name[: -len(SEGMENT_SUFFIX)])
+            for name in os.listdir(directory)
+            if name.endswith(SEGMENT_SUFFIX)
+        )
+        self._file = None
+        self._dirty = False
+        self._last_sync = time.monotonic()
+
+        # Resume numbering after the last intact record on disk
+        for start in reversed(self._segments):
+            for record in self._read_segment(start):
+                self.last_seq = max(self.last_seq, record["seq"])
+            if self.last_seq:
+                break
+
+    def replay(self, after_seq: int = 0) -> Iterator[Dict[str, Any]]:
+        """
+        Yield every record with a sequence number above ``after_seq`` in order.
+        Lines torn by a crash are skipped.
+        """
+        for start in list(self._segments):
+            for record in self._read_segment(start):
+                self.last_seq = max(self.last_seq, record["seq"])
+                if record["seq"] > after_seq:
+                    yield record
+
+    def append(self, record: Dict[str, Any]) -> int:
+        """Append a record and return its sequence number"""
+        with self._lock:
+            seq = self.last_seq + 1
+            if self._file is None:
+                # A leftover segment with this name can only hold torn records
+                if seq not in self._segments:
+                    self._segments.append(seq)
+                self._file = open(self._segment_path(seq), "wb")
+
+            self._file.write(json.dumps({"seq": seq, **record}).encode() + b"\n")
+            self.last_seq = seq
+            self._dirty = True
+            return seq
+
+    def commit(self) -> None:
+        """Make the appended records durable according to the fsync policy"""
+        with self._lock:
+            if self._file is None or not self._dirty:
+                return
+
+            self._file.flush()
+            if self.fsync_policy == FSYNC_ALWAYS or (
+                self.fsync_policy == FSYNC_INTERVAL
+                and time.monotonic() - self._last_sync >= self.fsync_interval
+            ):
+                self._sync()
+
+    def sync_if_due(self) -> None:
+        """Fsync records left pending by the interval policy once it elapses"""
+        with self._lock:
+            if (
+                self._file is not None
+                and self._dirty
+                and self.fsync_policy == FSYNC_INTERVAL
+                and time.monotonic() - self._last_sync >= self.fsync_interval
+            ):
+                self._file.flush()
+                self._sync()
+
+    def rotate(self) -> None:
+        """Start a new segment with the next appended record"""
+        with self._lock:
+            self._close_segment()
+
+    def discard_through(self, seq: int) -> None:
+        """Delete the segments whose records are all covered by a checkpoint at seq"""
+        with self._lock:
+            active = self._segments[-1] if self._file is not None else None
+            keep = []
+            for i, start in enumerate(self._segments):
+                if i + 1 < len(self._segments):
+                    end = self._segments[i + 1] - 1
+                else:
+                    end = self.last_seq
+                if start != active and end <= seq:
+                    try:
+                        os.remove(self._segment_path(start))
+                    except FileNotFoundError:
+                        pass
+                else:
+                    keep.append(start)
+            self._segments = keep
+
+    def close(self) -> None:
+        with self._lock:
+            self._close_segment()
+
+    def _close_segment(self) -> None:
+        if self._file is None:
+            return
+        self._file.flush()
+        if self.fsync_policy != FSYNC_OS:
+            self._sync()
+        self._file.close()
+        self._file = None
+
+    def _sync(self) -> None:
+        os.fsync(self._file.fileno())
+        self._dirty = False
+        self._last_sync = time.monotonic()
+
+    def _read_segment(self, start: int) -> Iterator[Dict[str, Any]]:
+        try:
+            f = open(self._segment_path(start), "rb")
+        except FileNotFoundError:
+            return
+
+        with f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    logger.warning(
+                        f"Skipping torn record in WAL segment {self._segment_path(start)}"
+                    )
+
+    def _segment_path(self, start: int) -> str:
+        return os.path.join(self.directory, f"{start:020d}{SEGMENT_SUFFIX}")